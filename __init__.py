@@ -1,7 +1,9 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from . import cli
 from . import controllers
 from . import models
+from . import wizards
 
 from odoo.addons.payment import setup_provider, reset_payment_provider
 
@@ -6,16 +6,24 @@
     'sequence': 350,
     'summary': "An NEGDi payment provider in Mongolia.",
     'description': " ",  # Non-empty string to avoid loading the README file.
-    'depends': ['payment','website'],
+    'depends': ['bus', 'payment', 'website_sale'],
     'data': [
+        'security/ir.model.access.csv',
+
+        'wizards/payment_negdi_settlement_wizard_views.xml',
+
         # 'views/payment_negdi_templates.xml',
         'views/payment_provider_views.xml',
+        'views/payment_transaction_views.xml',
 
         'data/payment_provider_data.xml',
+        'data/ir_cron_data.xml',
+        'data/ir_actions_server_data.xml',
     ],
     'assets': {
         'web.assets_frontend': [
             'payment_negdi/static/src/js/payment_form.js',
+            'payment_negdi/static/src/js/post_processing.js',
         ],
     },
     'icon': '/payment_negdi/static/description/icon.png',
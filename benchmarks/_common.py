@@ -0,0 +1,39 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" Helpers shared by the stand-alone NEGDi benchmarks.
+
+The benchmarks exercise the Odoo-independent parts of the module (API client, helpers) without a
+running Odoo server. Importing `payment_negdi` normally executes its `__init__`, which requires
+Odoo; `load_module` registers a bare package instead so that the submodules can be imported on
+their own.
+"""
+
+import importlib
+import os
+import statistics
+import sys
+import types
+
+MODULE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name):
+    """ Import and return the `payment_negdi.<name>` submodule without importing Odoo. """
+    if 'payment_negdi' not in sys.modules:
+        package = types.ModuleType('payment_negdi')
+        package.__path__ = [MODULE_PATH]
+        sys.modules['payment_negdi'] = package
+    return importlib.import_module(f'payment_negdi.{name}')
+
+
+def summarize(durations):
+    """ Return the main statistics, in milliseconds, of a list of durations in seconds. """
+    durations = sorted(durations)
+    quantiles = statistics.quantiles(durations, n=100) if len(durations) > 1 else durations * 99
+    return {
+        'count': len(durations),
+        'mean_ms': round(statistics.fmean(durations) * 1000, 3),
+        'p50_ms': round(quantiles[49] * 1000, 3),
+        'p95_ms': round(quantiles[94] * 1000, 3),
+        'p99_ms': round(quantiles[98] * 1000, 3),
+    }
@@ -0,0 +1,111 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" Compare per-call `requests.post` with the pooled NEGDi client against a local stand-in server.
+
+The stand-in server answers the ec1000 and ec1098 endpoints with canned responses and counts the
+TCP connections it accepts, each of which costs a TCP (and, against the real gateway, a TLS)
+handshake.
+
+Usage: python3 benchmarks/bench_connection_pooling.py [--requests 500] [--threads 4]
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from _common import load_module, summarize
+
+client_module = load_module('client')
+const = load_module('const')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep connections alive between requests.
+    disable_nagle_algorithm = True  # Avoid delayed ACK stalls between headers and body.
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({'order': {
+            'tranid': 1, 'checkid': 'abc', 'status': 'Approved', 'negdiurl': 'http://localhost/pay',
+        }}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(label, server, send, count, threads):
+    server.connections = 0
+    durations = []
+
+    def call(_i):
+        start = time.perf_counter()
+        send()
+        durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(call, range(count)))
+    elapsed = time.perf_counter() - start
+    return {
+        'label': label,
+        'connections': server.connections,
+        'requests_per_second': round(count / elapsed, 1),
+        **summarize(durations),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.lock = threading.Lock()
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}/api/pay'
+    payload = {'tranid': 1, 'checkid': 'abc'}
+
+    def send_unpooled():
+        response = requests.post(
+            f'{base_url}/{const.NEGDI_INQUIRY_ORDER_ENDPOINT}',
+            headers={'Content-Type': 'application/json'}, json=payload, timeout=30,
+        )
+        response.raise_for_status()
+        response.json()
+
+    client = client_module.get_client(base_url, pool_size=args.threads)
+
+    def send_pooled():
+        client.post(const.NEGDI_INQUIRY_ORDER_ENDPOINT, payload)
+
+    results = [
+        run('requests.post', server, send_unpooled, args.requests, args.threads),
+        run('NEGDiClient', server, send_pooled, args.requests, args.threads),
+    ]
+    server.shutdown()
+
+    for result in results:
+        print(json.dumps(result))
+    saved = results[0]['connections'] - results[1]['connections']
+    print(f"Handshakes saved: {saved} of {results[0]['connections']} for {args.requests} requests")
+
+
+if __name__ == '__main__':
+    main()
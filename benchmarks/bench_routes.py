@@ -0,0 +1,346 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" Drive the NEGDi checkout, return and webhook routes of a running Odoo server with concurrent
+simulated customers, and report their throughput, latency, queries and lock waits.
+
+The benchmark creates one e-commerce cart per customer through JSON-RPC, points the NEGDi
+provider to a local NEGDi simulator (see `negdi_simulator.py`) and runs three phases, one per
+route, in which all customers hit the route concurrently:
+
+- `checkout`: `/shop/payment/transaction/<order_id>` creates the transaction and the NEGDi order;
+  the customer then visits the simulated NEGDi checkout page, which settles the order.
+- `return`: `/payment/negdi/return` makes the inquiry and processes its result.
+- `webhook`: `/payment/negdi/webhook` stores the notification of the settled order.
+
+Running the phases one after the other attributes the database activity to a single route: the
+queries per request and the time spent in queries are read from the metrics route of the module
+(see `/payment/negdi/metrics`), and the lock-wait time is sampled from `pg_stat_activity` when a
+DSN is given. The results are written as JSON and can be compared with those of another run:
+
+    python3 benchmarks/bench_routes.py --url http://localhost:8069 --db bench \\
+        --password admin --metrics-token secret --dsn "dbname=bench" --output after.json
+    python3 benchmarks/bench_routes.py --compare before.json after.json
+
+The Odoo server must run with the module installed, a NEGDi provider in test mode and the
+`payment_negdi.metrics_token` system parameter set to the provided token. The provider's custom
+API URL is restored at the end of the run.
+"""
+
+import argparse
+import datetime
+import json
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from _common import MODULE_PATH, load_module, summarize
+from negdi_simulator import Simulator, serve
+
+const = load_module('const')
+
+ROUTES = ('checkout', 'return', 'webhook')
+METRIC_LINE = re.compile(r'^(negdi_route_\w+?)(?:_count)?\{route="(\w+)"\} (\S+)$')
+
+
+class OdooRPC:
+    """ Minimal JSON-RPC client of the Odoo external API. """
+
+    def __init__(self, url, db, login, password):
+        self.url, self.db, self.password = url, db, password
+        self.uid = self.call('common', 'login', db, login, password)
+
+    def call(self, service, method, *args):
+        response = requests.post(f'{self.url}/jsonrpc', json={
+            'jsonrpc': '2.0', 'method': 'call', 'id': 1,
+            'params': {'service': service, 'method': method, 'args': args},
+        }, timeout=300)
+        response.raise_for_status()
+        result = response.json()
+        if 'error' in result:
+            raise RuntimeError(result['error']['data']['message'])
+        return result['result']
+
+    def execute(self, model, method, *args, **kwargs):
+        return self.call(
+            'object', 'execute_kw', self.db, self.uid, self.password, model, method, args, kwargs
+        )
+
+
+def prepare(rpc, customers, simulator_url):
+    """ Create the carts of the customers and point the NEGDi provider to the simulator.
+
+    :return: The provider values to restore, the payment method, and the carts.
+    :rtype: tuple
+    """
+    provider = rpc.execute(
+        'payment.provider', 'search_read', [('code', '=', 'negdi'), ('state', '!=', 'disabled')],
+        fields=['negdi_api_url', 'payment_method_ids'], limit=1,
+    )[0]
+    rpc.execute('payment.provider', 'write', [provider['id']], {'negdi_api_url': simulator_url})
+    product_id = rpc.execute(
+        'product.product', 'search', [('sale_ok', '=', True), ('list_price', '>', 0)], limit=1,
+    )[0]
+    website_id = rpc.execute('website', 'search', [], limit=1)[0]
+    partner_id = rpc.execute('res.partner', 'create', {
+        'name': "NEGDi benchmark customer", 'email': 'negdi.bench@example.com',
+    })
+    order_ids = rpc.execute('sale.order', 'create', [{
+        'partner_id': partner_id,
+        'website_id': website_id,
+        'access_token': str(uuid.uuid4()),
+        'order_line': [(0, 0, {'product_id': product_id, 'product_uom_qty': 1})],
+    } for _i in range(customers)])
+    orders = rpc.execute(
+        'sale.order', 'read', order_ids, fields=['name', 'access_token', 'amount_total'],
+    )
+    return provider, provider['payment_method_ids'][0], orders
+
+
+def checkout(url, provider_id, payment_method_id, customer):
+    """ Pay the cart of the customer and settle the NEGDi order on the simulated checkout page. """
+    order = customer['order']
+    response = customer['session'].post(f"{url}/shop/payment/transaction/{order['id']}", json={
+        'jsonrpc': '2.0', 'method': 'call', 'id': 1, 'params': {
+            'access_token': order['access_token'],
+            'provider_id': provider_id,
+            'payment_method_id': payment_method_id,
+            'token_id': None,
+            'amount': order['amount_total'],
+            'flow': 'redirect',
+            'tokenization_requested': False,
+            'landing_route': '/shop/payment/validate',
+            'is_validation': False,
+        },
+    }, timeout=300)
+    duration = response.elapsed.total_seconds()
+    result = response.json().get('result') or {}
+    if 'negdi_redirect_url' not in result:
+        return duration, False
+    # Settle the order like the customer would; the time spent on NEGDi is not Odoo's.
+    return_response = customer['session'].get(
+        result['negdi_redirect_url'], allow_redirects=False, timeout=300
+    )
+    customer['return_url'] = return_response.headers['Location']
+    return duration, True
+
+
+def return_from_checkout(url, customer):
+    if 'return_url' not in customer:
+        return 0.0, False
+    response = customer['session'].get(customer['return_url'], allow_redirects=False, timeout=300)
+    location = response.headers.get('Location', '')
+    return response.elapsed.total_seconds(), response.status_code == 303 and 'error=' not in location
+
+
+def webhook(url, customer):
+    if 'return_url' not in customer:
+        return 0.0, False
+    params = parse_qs(urlsplit(customer['return_url']).query)
+    order = customer['order']
+    response = customer['session'].post(f'{url}/payment/negdi/webhook', json={'order': {
+        'tranid': int(params['tranid'][0]),
+        'checkid': params['checkid'][0],
+        'ordernum': order['name'],
+        'amount': order['amount_total'],
+        'status': 'Approved',
+        'paymentmethod': 'Card',
+    }}, timeout=300)
+    return response.elapsed.total_seconds(), response.status_code == 200
+
+
+def scrape_metrics(url, token):
+    """ Return the request count, queries and query time of each route from the metrics route. """
+    response = requests.get(
+        f'{url}/payment/negdi/metrics', headers={'Authorization': f'Bearer {token}'}, timeout=60
+    )
+    response.raise_for_status()
+    values = {}
+    for line in response.text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            name, route, value = match.groups()
+            values[(name, route)] = float(value)
+    return values
+
+
+class LockWaitSampler:
+    """ Sample the backends waiting for a lock in `pg_stat_activity` while a phase runs. """
+
+    def __init__(self, dsn, interval=0.02):
+        self.dsn, self.interval = dsn, interval
+        self.lock_wait = 0.0
+        self.max_waiting = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        if self.dsn:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self.dsn:
+            self._thread.join()
+
+    def _run(self):
+        import psycopg2
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        with connection.cursor() as cr:
+            while not self._stop.wait(self.interval):
+                cr.execute("""
+                    SELECT COUNT(*) FROM pg_stat_activity
+                     WHERE datname = current_database() AND wait_event_type = 'Lock'
+                """)
+                waiting = cr.fetchone()[0]
+                self.lock_wait += waiting * self.interval
+                self.max_waiting = max(self.max_waiting, waiting)
+        connection.close()
+
+
+def run_phase(route, func, customers, concurrency, args):
+    metrics_before = scrape_metrics(args.url, args.metrics_token) if args.metrics_token else {}
+    with LockWaitSampler(args.dsn) as sampler, ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(func, customers))
+        elapsed = time.perf_counter() - start
+    durations = [duration for duration, ok in results if ok]
+    result = {
+        'requests': len(results),
+        'errors': len(results) - len(durations),
+        'rps': round(len(results) / elapsed, 2),
+        **(summarize(durations) if durations else {}),
+    }
+    if args.dsn:
+        result['lock_wait_s'] = round(sampler.lock_wait, 3)
+        result['max_waiting_backends'] = sampler.max_waiting
+    if args.metrics_token:
+        time.sleep(const.NEGDI_METRICS_FLUSH_INTERVAL + 1)  # Let the workers write their metrics.
+        metrics_after = scrape_metrics(args.url, args.metrics_token)
+        delta = {
+            name: metrics_after.get((name, route), 0) - metrics_before.get((name, route), 0)
+            for name in ('negdi_route_duration_seconds', 'negdi_route_queries_total',
+                         'negdi_route_query_seconds_total')
+        }
+        if count := delta['negdi_route_duration_seconds']:
+            result['queries_per_request'] = round(delta['negdi_route_queries_total'] / count, 1)
+            result['query_ms_per_request'] = round(
+                delta['negdi_route_query_seconds_total'] / count * 1000, 3
+            )
+    return result
+
+
+def get_revision():
+    try:
+        return subprocess.run(
+            ['git', '-C', MODULE_PATH, 'describe', '--always', '--dirty'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(args):
+    simulator = Simulator({
+        'latency': {
+            endpoint: {'distribution': 'lognormal', 'median': args.negdi_latency, 'sigma': 0.5}
+            for endpoint in ('ec1000', 'ec1098')
+        },
+    }, seed=0)
+    server = serve(simulator, port=args.simulator_port)
+    rpc = OdooRPC(args.url, args.db, args.login, args.password)
+    provider, payment_method_id, orders = prepare(rpc, args.customers, simulator.public_url)
+    customers = [{'order': order, 'session': requests.Session()} for order in orders]
+    try:
+        phases = {
+            'checkout': lambda c: checkout(args.url, provider['id'], payment_method_id, c),
+            'return': lambda c: return_from_checkout(args.url, c),
+            'webhook': lambda c: webhook(args.url, c),
+        }
+        routes = {
+            route: run_phase(route, phases[route], customers, args.concurrency, args)
+            for route in ROUTES
+        }
+    finally:
+        rpc.execute(
+            'payment.provider', 'write', [provider['id']],
+            {'negdi_api_url': provider['negdi_api_url']},
+        )
+        server.shutdown()
+    return {
+        'revision': get_revision(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'parameters': {
+            'customers': args.customers, 'concurrency': args.concurrency,
+            'negdi_latency': args.negdi_latency,
+        },
+        'routes': routes,
+    }
+
+
+def compare(base_path, new_path, threshold):
+    """ Print the relative change of each figure between two runs; return the regressions. """
+    with open(base_path) as file:
+        base = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    print(f"{base.get('revision')} -> {new.get('revision')}")
+    regressions = []
+    for route in ROUTES:
+        for key, new_value in new['routes'].get(route, {}).items():
+            base_value = base['routes'].get(route, {}).get(key)
+            if not isinstance(base_value, (int, float)) or not base_value:
+                continue
+            change = (new_value - base_value) / base_value
+            # Higher is better for the throughput only.
+            worse = -change if key == 'rps' else change
+            flag = ''
+            if key in ('rps', 'p95_ms', 'p99_ms', 'queries_per_request') and worse > threshold:
+                flag = '  REGRESSION'
+                regressions.append((route, key))
+            print(f"{route:9} {key:24} {base_value:>12} {new_value:>12} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8069')
+    parser.add_argument('--db')
+    parser.add_argument('--login', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--metrics-token', help="Token of the NEGDi metrics route.")
+    parser.add_argument('--dsn', help="DSN of the database, to sample the lock waits.")
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--negdi-latency', type=float, default=0.2,
+                        help="Median latency of the simulated NEGDi API, in seconds.")
+    parser.add_argument('--simulator-port', type=int, default=0)
+    parser.add_argument('--output', help="File to write the JSON results to.")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help="Compare two result files instead of running the benchmark.")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Relative change flagged as a regression by --compare.")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    if not args.db:
+        parser.error("--db is required to run the benchmark")
+    results = benchmark(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
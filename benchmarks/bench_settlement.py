@@ -0,0 +1,57 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" Measure the parsing throughput and the peak memory of NEGDi settlement statements.
+
+A statement of `--lines` lines is generated in a temporary file and read by chunks with
+`settlement.read_chunks`, as `payment.transaction._negdi_reconcile_settlement` does. The maximum
+resident memory is expected to depend on the chunk size only, not on the size of the statement. The
+matching itself needs a database; use the `negdi_settlement` command of `odoo-bin` for it.
+
+Usage: python3 benchmarks/bench_settlement.py [--lines 500000] [--chunk-size 10000]
+"""
+
+import argparse
+import json
+import resource
+import tempfile
+import time
+
+from _common import load_module
+
+negdi_settlement = load_module('settlement')
+const = load_module('const')
+
+
+def generate(stream, lines):
+    stream.write(b"tranid,amount,currency,status,date\n")
+    for i in range(lines):
+        stream.write(f"{202400000 + i},{i % 100000}.50,MNT,Approved,2026-10-01\n".encode())
+    stream.seek(0)
+
+
+def run(stream, chunk_size):
+    start = time.perf_counter()
+    lines = sum(len(chunk) for chunk in negdi_settlement.read_chunks(stream, chunk_size, []))
+    duration = time.perf_counter() - start
+    return {
+        'chunk_size': chunk_size,
+        'lines': lines,
+        'duration_s': round(duration, 3),
+        'lines_per_s': round(lines / duration),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=500000)
+    parser.add_argument('--chunk-size', type=int, default=const.NEGDI_SETTLEMENT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryFile() as stream:
+        generate(stream, args.lines)
+        print(json.dumps(run(stream, args.chunk_size)))
+
+
+if __name__ == '__main__':
+    main()
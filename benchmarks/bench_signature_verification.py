@@ -0,0 +1,76 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" Measure NEGDi `ordersign` verifications per second with and without the parsed key cache.
+
+Without the cache, the PEM public key is parsed for every notification, as the former
+implementation did; with it, the key is parsed once per provider (see `_negdi_get_public_key`).
+
+Usage: python3 benchmarks/bench_signature_verification.py [--verifications 5000] [--key-size 2048]
+"""
+
+import argparse
+import base64
+import json
+import time
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from _common import load_module
+
+negdi_utils = load_module('utils')
+
+
+def verify(public_key, notification_data):
+    signed_bytes = negdi_utils.get_signed_bytes(notification_data['order'])
+    public_key.verify(
+        base64.b64decode(notification_data['ordersign'], validate=True),
+        signed_bytes,
+        padding.PKCS1v15(),
+        hashes.SHA256(),
+    )
+
+
+def run(label, count, get_key, notification_data):
+    start = time.perf_counter()
+    for _i in range(count):
+        verify(get_key(), notification_data)
+    elapsed = time.perf_counter() - start
+    return {
+        'label': label,
+        'verifications_per_second': round(count / elapsed, 1),
+        'mean_us': round(elapsed / count * 1_000_000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--verifications', type=int, default=5000)
+    parser.add_argument('--key-size', type=int, default=2048)
+    args = parser.parse_args()
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=args.key_size)
+    public_key_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    order_data = {
+        'tranid': 202400001, 'checkid': 'a1b2c3d4', 'ordernum': 'S00042', 'amount': 125000.0,
+        'currency': 'MNT', 'status': 'Approved', 'paymentmethod': 'Card', 'approvalCode': '123456',
+    }
+    signature = private_key.sign(
+        negdi_utils.get_signed_bytes(order_data), padding.PKCS1v15(), hashes.SHA256()
+    )
+    notification_data = {'order': order_data, 'ordersign': base64.b64encode(signature).decode()}
+
+    cached_key = serialization.load_pem_public_key(public_key_pem.encode())
+    results = [
+        run('parse per verification', args.verifications,
+            lambda: serialization.load_pem_public_key(public_key_pem.encode()), notification_data),
+        run('cached parsed key', args.verifications, lambda: cached_key, notification_data),
+    ]
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
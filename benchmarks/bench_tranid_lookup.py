@@ -0,0 +1,108 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" Measure the latency of NEGDi tranid lookups on a large transaction table, with and without
+the partial indexes created by `payment.transaction.init`.
+
+The benchmark works on a scratch copy of the relevant `payment_transaction` columns in the
+provided database and drops it afterwards. The lookup query is the one generated by the ORM for
+`_negdi_search_by_tranid`.
+
+Usage: python3 benchmarks/bench_tranid_lookup.py --dsn "dbname=bench" [--rows 2000000]
+"""
+
+import argparse
+import json
+import random
+import time
+
+import psycopg2
+
+from _common import summarize
+
+TABLE = 'negdi_bench_payment_transaction'
+
+LOOKUP_QUERY = f"""
+    SELECT id
+      FROM {TABLE}
+     WHERE provider_reference = %s
+       AND negdi_check_id IS NOT NULL AND negdi_check_id != ''
+       AND provider_id IN (SELECT unnest(%s::int[]))
+     LIMIT 1
+"""
+
+INDEXES = [
+    f"CREATE UNIQUE INDEX {TABLE}_negdi_tranid_uniq ON {TABLE} (provider_reference)"
+    f" WHERE negdi_check_id IS NOT NULL",
+    f"CREATE INDEX {TABLE}_negdi_check_id_index ON {TABLE} (negdi_check_id)"
+    f" WHERE negdi_check_id IS NOT NULL",
+]
+
+
+def seed(cr, rows, negdi_ratio):
+    """ Create the scratch table with `rows` transactions, a share of which are NEGDi ones. """
+    cr.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cr.execute(f"""
+        CREATE UNLOGGED TABLE {TABLE} (
+            id serial PRIMARY KEY,
+            reference varchar NOT NULL UNIQUE,
+            provider_id integer NOT NULL,
+            provider_reference varchar,
+            negdi_check_id varchar,
+            state varchar NOT NULL
+        )
+    """)
+    # NEGDi transactions use provider 1; the others are spread over providers 2 to 5 and reuse
+    # overlapping provider references, as unrelated providers would.
+    cr.execute(f"""
+        INSERT INTO {TABLE} (reference, provider_id, provider_reference, negdi_check_id, state)
+        SELECT 'tx-' || i,
+               CASE WHEN random() < %(ratio)s THEN 1 ELSE 2 + i %% 4 END,
+               i::varchar,
+               NULL,
+               'done'
+          FROM generate_series(1, %(rows)s) AS i
+    """, {'rows': rows, 'ratio': negdi_ratio})
+    cr.execute(f"UPDATE {TABLE} SET negdi_check_id = md5(id::text) WHERE provider_id = 1")
+    cr.execute(f"ANALYZE {TABLE}")
+    cr.execute(f"SELECT provider_reference FROM {TABLE} WHERE provider_id = 1")
+    return [row[0] for row in cr.fetchall()]
+
+
+def measure(cr, tranids, lookups):
+    durations = []
+    for tranid in random.choices(tranids, k=lookups):
+        start = time.perf_counter()
+        cr.execute(LOOKUP_QUERY, [tranid, [1]])
+        cr.fetchall()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', required=True, help="libpq connection string of a scratch database")
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--negdi-ratio', type=float, default=0.3)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(args.dsn)
+    connection.autocommit = True
+    with connection.cursor() as cr:
+        tranids = seed(cr, args.rows, args.negdi_ratio)
+        before = measure(cr, tranids, args.lookups)
+        for statement in INDEXES:
+            cr.execute(statement)
+        cr.execute(f"ANALYZE {TABLE}")
+        after = measure(cr, tranids, args.lookups)
+        cr.execute(f"EXPLAIN {LOOKUP_QUERY}", [tranids[0], [1]])
+        plan = '\n'.join(row[0] for row in cr.fetchall())
+        cr.execute(f"DROP TABLE {TABLE}")
+    connection.close()
+
+    print(json.dumps({'rows': args.rows, 'without_index': before, 'with_index': after}))
+    print(plan)
+
+
+if __name__ == '__main__':
+    main()
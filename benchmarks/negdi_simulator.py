@@ -0,0 +1,359 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" Local stand-in for the NEGDi gateway, for development, benchmarks and soak tests.
+
+The simulator implements the `ec1000` (create order) and `ec1098` (inquiry) endpoints, a checkout
+page that settles the order and redirects the customer to its `returnurl`, and the webhook
+callbacks sent to Odoo once an order is settled. Outcomes, latencies and faults are driven by a
+scenario that can be loaded from a JSON file and changed while the simulator is running:
+
+    {
+        "outcomes": {"Approved": 0.9, "Declined": 0.1},   # Weighted statuses of settled orders
+        "overrides": {"S00042": "Cancelled"},              # Status by ordernum
+        "latency": {                                       # Seconds, by endpoint
+            "ec1000": {"distribution": "lognormal", "median": 0.2, "sigma": 0.5, "max": 5},
+            "ec1098": {"distribution": "uniform", "low": 0.05, "high": 0.3},
+            "checkout": {"distribution": "fixed", "value": 0}
+        },
+        "faults": {                                        # Shares of the requests, by endpoint
+            "ec1000": {"error_rate": 0.01, "json_error_rate": 0, "timeout_rate": 0.01},
+            "ec1098": {"error_rate": 0, "json_error_rate": 0, "timeout_rate": 0}
+        },
+        "timeout_delay": 120,                              # Delay of the answers that time out
+        "webhook": {"url": null, "delay": 0, "duplicates": 0},
+        "credentials": null                                # Or the accepted terminalid, etc.
+    }
+
+Point the provider to the simulator by setting its "Custom API URL" to `http://<host>:<port>`.
+
+Control endpoints:
+    GET  /_simulator/stats      Requests served by endpoint and outcome, and orders by status.
+    POST /_simulator/scenario   Merge the JSON body into the current scenario.
+    POST /_simulator/reset      Forget all orders and statistics.
+
+Usage: python3 benchmarks/negdi_simulator.py [--port 8099] [--scenario scenario.json]
+           [--approve-rate 0.9] [--error-rate 0] [--timeout-rate 0] [--latency 0.1]
+           [--webhook-url http://localhost:8069/payment/negdi/webhook] [--private-key key.pem]
+"""
+
+import argparse
+import base64
+import copy
+import itertools
+import json
+import math
+import random
+import secrets
+import threading
+import time
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode, urlsplit
+
+from _common import load_module
+
+const = load_module('const')
+negdi_utils = load_module('utils')
+
+DEFAULT_SCENARIO = {
+    'outcomes': {'Approved': 1.0},
+    'overrides': {},
+    'latency': {},
+    'faults': {},
+    'timeout_delay': 120,
+    'webhook': {'url': None, 'delay': 0, 'duplicates': 0},
+    'credentials': None,
+}
+
+
+def sample_latency(spec, rng=random):
+    """ Return a latency in seconds drawn from the provided distribution specification. """
+    if not spec:
+        return 0.0
+    distribution = spec.get('distribution', 'fixed')
+    if distribution == 'fixed':
+        latency = spec.get('value', 0)
+    elif distribution == 'uniform':
+        latency = rng.uniform(spec.get('low', 0), spec['high'])
+    elif distribution == 'lognormal':
+        latency = spec['median'] * math.exp(rng.gauss(0, spec.get('sigma', 0.5)))
+    elif distribution == 'exponential':
+        latency = rng.expovariate(1 / spec['mean'])
+    else:
+        raise ValueError(f"Unknown latency distribution: {distribution}")
+    return max(0.0, min(latency, spec.get('max', math.inf)))
+
+
+def merge_scenario(scenario, changes):
+    """ Return a copy of the scenario with the provided changes merged into it, key by key. """
+    merged = copy.deepcopy(scenario)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_scenario(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class Simulator:
+    """ State of the simulated gateway: the scenario, the created orders and the statistics. """
+
+    def __init__(self, scenario=None, public_url='', private_key=None, seed=None):
+        self.scenario = merge_scenario(DEFAULT_SCENARIO, scenario or {})
+        self.public_url = public_url
+        self.private_key = private_key
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.orders = {}  # tranid -> order
+            self.tranids = itertools.count(int(time.time()) * 1000)
+            self.stats = Counter()
+
+    def count(self, endpoint, outcome):
+        with self.lock:
+            self.stats[f'{endpoint}.{outcome}'] += 1
+
+    def draw_fault(self, endpoint):
+        """ Return the fault to inject in the answer to the endpoint, if any. """
+        faults = self.scenario['faults'].get(endpoint) or {}
+        draw = self.rng.random()
+        for fault in ('timeout', 'error', 'json_error'):
+            rate = faults.get(f'{fault}_rate', 0)
+            if draw < rate:
+                return fault
+            draw -= rate
+        return None
+
+    def check_credentials(self, payload):
+        credentials = self.scenario['credentials']
+        return not credentials or all(payload.get(k) == v for k, v in credentials.items())
+
+    def create_order(self, payload):
+        with self.lock:
+            tranid = next(self.tranids)
+            order = self.orders[tranid] = {
+                'tranid': tranid,
+                'checkid': secrets.token_hex(4),
+                'ordernum': payload.get('ordernum'),
+                'amount': payload.get('amount'),
+                'currency': payload.get('currency'),
+                'returnurl': payload.get('returnurl'),
+                'status': 'Preparing',
+            }
+        return order
+
+    def settle_order(self, order):
+        """ Give the order its final status, drawn from the scenario, unless it already has one. """
+        with self.lock:
+            if order['status'] != 'Preparing':
+                return False
+            status = self.scenario['overrides'].get(order['ordernum'])
+            if not status:
+                outcomes = self.scenario['outcomes']
+                status = self.rng.choices(list(outcomes), weights=list(outcomes.values()))[0]
+            order['status'] = status
+            if const.STATUS_TO_STATE.get(status.casefold()) == 'done':
+                order['paymentmethod'] = 'Card'
+                order['approvalCode'] = f'{self.rng.randrange(1000000):06d}'
+        return True
+
+    def get_order_data(self, order):
+        return {key: value for key, value in order.items() if key != 'returnurl'}
+
+    def get_notification_data(self, order):
+        order_data = self.get_order_data(order)
+        notification_data = {'order': order_data}
+        if self.private_key:
+            from cryptography.hazmat.primitives import hashes
+            from cryptography.hazmat.primitives.asymmetric import padding
+            signature = self.private_key.sign(
+                negdi_utils.get_signed_bytes(order_data), padding.PKCS1v15(), hashes.SHA256()
+            )
+            notification_data['ordersign'] = base64.b64encode(signature).decode()
+        return notification_data
+
+    def schedule_webhook(self, order):
+        webhook = self.scenario['webhook']
+        if not webhook.get('url'):
+            return
+        body = json.dumps(self.get_notification_data(order)).encode()
+        for _i in range(1 + webhook.get('duplicates', 0)):
+            timer = threading.Timer(webhook.get('delay', 0), self.send_webhook, [webhook['url'], body])
+            timer.daemon = True
+            timer.start()
+
+    def send_webhook(self, url, body):
+        request = urllib.request.Request(
+            url, data=body, headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+            self.count('webhook', 'sent')
+        except OSError:
+            self.count('webhook', 'failed')
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real gateway.
+    disable_nagle_algorithm = True
+    simulator = None  # Set by `serve`.
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type='application/json', headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        simulator = self.simulator
+        if path == '/_simulator/stats':
+            with simulator.lock:
+                statuses = Counter(order['status'] for order in simulator.orders.values())
+                return self.send_body(200, {'requests': simulator.stats, 'orders': statuses})
+        if path.startswith('/checkout/'):
+            return self.checkout(path.rsplit('/', 1)[-1])
+        self.send_body(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        simulator = self.simulator
+        try:
+            payload = self.read_json()
+        except ValueError:
+            return self.send_body(400, {'error': 'Invalid JSON'})
+        if path == '/_simulator/scenario':
+            with simulator.lock:
+                simulator.scenario = merge_scenario(simulator.scenario, payload)
+            return self.send_body(200, simulator.scenario)
+        if path == '/_simulator/reset':
+            simulator.reset()
+            return self.send_body(200, {})
+        endpoint = path.rsplit('/', 1)[-1]
+        if endpoint not in (const.NEGDI_CREATE_ORDER_ENDPOINT, const.NEGDI_INQUIRY_ORDER_ENDPOINT):
+            return self.send_body(404, {'error': 'Not found'})
+
+        time.sleep(sample_latency(simulator.scenario['latency'].get(endpoint), simulator.rng))
+        fault = simulator.draw_fault(endpoint)
+        simulator.count(endpoint, fault or 'success')
+        if fault == 'timeout':
+            time.sleep(simulator.scenario['timeout_delay'])
+            return self.send_body(504, b'Gateway Timeout', 'text/plain')
+        if fault == 'error':
+            return self.send_body(502, b'<html>Bad Gateway</html>', 'text/html')
+        if fault == 'json_error':
+            return self.send_body(200, b'{"order": ', 'application/json')
+        if not simulator.check_credentials(payload):
+            return self.send_body(401, {'error': 'Invalid credentials'})
+
+        if endpoint == const.NEGDI_CREATE_ORDER_ENDPOINT:
+            order = simulator.create_order(payload)
+            return self.send_body(200, {'order': {
+                'tranid': order['tranid'],
+                'checkid': order['checkid'],
+                'negdiurl': f"{simulator.public_url}/checkout/{order['tranid']}",
+            }})
+        order = simulator.orders.get(payload.get('tranid'))
+        if not order or order['checkid'] != payload.get('checkid'):
+            return self.send_body(404, {'error': 'Order not found'})
+        self.send_body(200, {'order': simulator.get_order_data(order)})
+
+    def checkout(self, tranid):
+        """ Settle the order as if the customer paid on the NEGDi page, and send them back. """
+        simulator = self.simulator
+        order = simulator.orders.get(int(tranid)) if tranid.isdigit() else None
+        if not order:
+            return self.send_body(404, {'error': 'Order not found'})
+        time.sleep(sample_latency(simulator.scenario['latency'].get('checkout'), simulator.rng))
+        if simulator.settle_order(order):
+            simulator.schedule_webhook(order)
+        simulator.count('checkout', order['status'])
+        query = urlencode({'tranid': order['tranid'], 'checkid': order['checkid']})
+        separator = '&' if '?' in (order['returnurl'] or '') else '?'
+        self.send_body(302, b'', 'text/plain', [
+            ('Location', f"{order['returnurl']}{separator}{query}"),
+        ])
+
+
+def serve(simulator, host='127.0.0.1', port=8099):
+    """ Return a started server for the simulator, serving in a daemon thread. """
+    handler = type('Handler', (SimulatorHandler,), {'simulator': simulator})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if not simulator.public_url:
+        simulator.public_url = f'http://{host}:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--public-url', default='', help="URL of the simulator seen by customers.")
+    parser.add_argument('--scenario', help="JSON file of the scenario.")
+    parser.add_argument('--approve-rate', type=float, help="Share of approved orders.")
+    parser.add_argument('--error-rate', type=float, help="Share of API requests answered 502.")
+    parser.add_argument('--timeout-rate', type=float, help="Share of API requests timing out.")
+    parser.add_argument('--latency', type=float, help="Median latency of the API, in seconds.")
+    parser.add_argument('--webhook-url', help="URL of the Odoo webhook to notify.")
+    parser.add_argument('--private-key', help="PEM private key signing the notifications.")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    scenario = {}
+    if args.scenario:
+        with open(args.scenario) as file:
+            scenario = json.load(file)
+    if args.approve_rate is not None:
+        scenario['outcomes'] = {'Approved': args.approve_rate, 'Declined': 1 - args.approve_rate}
+    faults = {}
+    if args.error_rate is not None:
+        faults['error_rate'] = args.error_rate
+    if args.timeout_rate is not None:
+        faults['timeout_rate'] = args.timeout_rate
+    if faults:
+        scenario['faults'] = {
+            const.NEGDI_CREATE_ORDER_ENDPOINT: faults, const.NEGDI_INQUIRY_ORDER_ENDPOINT: faults,
+        }
+    if args.latency is not None:
+        latency = {'distribution': 'lognormal', 'median': args.latency, 'sigma': 0.5}
+        scenario['latency'] = {
+            const.NEGDI_CREATE_ORDER_ENDPOINT: latency, const.NEGDI_INQUIRY_ORDER_ENDPOINT: latency,
+        }
+    if args.webhook_url:
+        scenario.setdefault('webhook', {})['url'] = args.webhook_url
+    private_key = None
+    if args.private_key:
+        from cryptography.hazmat.primitives import serialization
+        with open(args.private_key, 'rb') as file:
+            private_key = serialization.load_pem_private_key(file.read(), password=None)
+
+    simulator = Simulator(scenario, args.public_url, private_key, args.seed)
+    server = serve(simulator, args.host, args.port)
+    print(f"NEGDi simulator listening on {simulator.public_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+import threading
+import time
+
+import requests
+
+from . import const
+
+
+_logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """ Raised instead of sending a request while the circuit breaker of the gateway is open. """
+
+
+class CircuitBreaker:
+    """ Circuit breaker of the NEGDi gateway shared by all the workers using the same database.
+
+    The state of the breaker is kept in the `payment_negdi_breaker` table and updated in short,
+    independent database transactions, so that every worker and cron sees the gateway as
+    unavailable as soon as one of them opens the breaker:
+
+    - `closed`: requests are sent and their outcome is counted over a sliding window; the breaker
+      opens when the share of failed or slow requests in the window exceeds its threshold.
+    - `open`: requests fail immediately with :class:`CircuitOpenError` until `open_duration`
+      seconds have elapsed.
+    - `half_open`: a single probe request is let through; the breaker closes if it succeeds and
+      opens again if it fails.
+
+    The state read by :meth:`allow` is cached in the process for `state_ttl` seconds to avoid a
+    query per request while the breaker is closed. The outcomes of the requests are counted in the
+    process and only added to the shared window once a request failed and either the outcomes
+    counted so far would open the breaker on their own or `flush_interval` seconds elapsed since
+    the last flush, so that a healthy gateway costs no write at all. Database errors never block
+    requests.
+    """
+
+    def __init__(
+        self, cursor_factory, key,
+        window=const.NEGDI_BREAKER_WINDOW,
+        min_calls=const.NEGDI_BREAKER_MIN_CALLS,
+        error_rate=const.NEGDI_BREAKER_ERROR_RATE,
+        slow_call_duration=const.NEGDI_BREAKER_SLOW_CALL_DURATION,
+        slow_call_rate=const.NEGDI_BREAKER_SLOW_CALL_RATE,
+        open_duration=const.NEGDI_BREAKER_OPEN_DURATION,
+        state_ttl=const.NEGDI_BREAKER_STATE_TTL,
+        flush_interval=const.NEGDI_BREAKER_FLUSH_INTERVAL,
+    ):
+        """
+        :param callable cursor_factory: The function returning a new database cursor.
+        :param str key: The identifier of the protected gateway, e.g. its base URL.
+        """
+        self.cursor_factory = cursor_factory
+        self.key = key
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_duration = open_duration
+        self.state_ttl = state_ttl
+        self.flush_interval = flush_interval
+        self._cached_state = None  # (state, is_available, expiry)
+        self._lock = threading.Lock()
+        self._pending = (0, 0, 0)  # The calls, failed calls and slow calls not flushed yet
+        self._pending_since = None
+        self._flushed_at = time.monotonic()
+        self._local = threading.local()  # Whether the current thread's request is the probe.
+        self._row_ensured = False
+
+    def _execute(self, query, params):
+        with self.cursor_factory() as cr:
+            # Concurrent workers update the same row: let them wait for each other rather than
+            # fail with serialization errors.
+            cr.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+            if not self._row_ensured:
+                cr.execute("""
+                    INSERT INTO payment_negdi_breaker (name, state, window_start, call_count,
+                                                       failure_count, slow_count)
+                         VALUES (%s, 'closed', now() at time zone 'UTC', 0, 0, 0)
+                    ON CONFLICT (name) DO NOTHING
+                """, [self.key])
+            cr.execute(query, params)
+            result = cr.fetchone() if cr.description else None
+            cr.commit()
+            self._row_ensured = True
+            return result
+
+    def _read_state(self):
+        """ Return the state of the breaker and whether it lets a request through without probe. """
+        cached_state = self._cached_state
+        if cached_state and cached_state[2] > time.monotonic():
+            return cached_state[:2]
+        state, is_available = self._execute("""
+            SELECT state,
+                   state = 'closed' OR (
+                       state = 'open'
+                       AND opened_at <= (now() at time zone 'UTC') - make_interval(secs => %s)
+                   )
+              FROM payment_negdi_breaker
+             WHERE name = %s
+        """, [self.open_duration, self.key])
+        self._cached_state = (state, is_available, time.monotonic() + self.state_ttl)
+        return state, is_available
+
+    def is_open(self):
+        """ Return whether requests are currently rejected, without claiming the probe. """
+        try:
+            state, is_available = self._read_state()
+        except Exception:
+            _logger.exception("NEGDi: Unable to read the state of the circuit breaker.")
+            return False
+        return not is_available and state != 'half_open'
+
+    def allow(self):
+        """ Return whether a request can be sent; claim the probe request if one is due.
+
+        :return: Whether the request can be sent.
+        :rtype: bool
+        """
+        self._local.probe = False
+        try:
+            state, is_available = self._read_state()
+            if state == 'closed':
+                return True
+            if state == 'open' and not is_available:
+                return False
+            # The open duration has elapsed or a probe is in progress: let a single request probe
+            # the gateway, or a new one if the previous probe never reported back.
+            claimed = self._execute("""
+                UPDATE payment_negdi_breaker
+                   SET state = 'half_open',
+                       probe_until = (now() at time zone 'UTC') + make_interval(secs => %s)
+                 WHERE name = %s
+                   AND (
+                       state = 'open'
+                       AND opened_at <= (now() at time zone 'UTC') - make_interval(secs => %s)
+                       OR state = 'half_open'
+                       AND (probe_until IS NULL OR probe_until < (now() at time zone 'UTC'))
+                   )
+             RETURNING id
+            """, [self.slow_call_duration + self.open_duration, self.key, self.open_duration])
+            self._cached_state = None
+        except Exception:
+            _logger.exception("NEGDi: Unable to update the state of the circuit breaker.")
+            return True
+        self._local.probe = bool(claimed)
+        return bool(claimed)
+
+    def record(self, success, duration):
+        """ Record the outcome of a request allowed by :meth:`allow`.
+
+        :param bool success: Whether the gateway answered properly.
+        :param float duration: The duration of the request, in seconds.
+        :return: None
+        """
+        slow = duration >= self.slow_call_duration
+        try:
+            if getattr(self._local, 'probe', False):
+                self._local.probe = False
+                if success and not slow:
+                    self._close()
+                else:
+                    self._open()
+                return
+
+            pending = self._count(success, slow)
+            if pending:
+                self._flush(*pending)
+        except Exception:
+            _logger.exception("NEGDi: Unable to record the outcome in the circuit breaker.")
+
+    def _is_tripped(self, call_count, failure_count, slow_count):
+        """ Return whether the outcomes of a window open the breaker. """
+        return call_count >= self.min_calls and (
+            failure_count / call_count >= self.error_rate
+            or slow_count / call_count >= self.slow_call_rate
+        )
+
+    def _count(self, success, slow):
+        """ Count the outcome of a request in the process.
+
+        :return: The calls, failed calls and slow calls to add to the shared window, if they are
+                 due to be flushed.
+        :rtype: tuple
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._pending_since is None or now - self._pending_since > self.window:
+                self._pending, self._pending_since = (0, 0, 0), now
+            call_count, failure_count, slow_count = self._pending
+            pending = self._pending = (
+                call_count + 1, failure_count + int(not success), slow_count + int(slow)
+            )
+            if not (pending[1] or pending[2]) or (
+                now - self._flushed_at < self.flush_interval and not self._is_tripped(*pending)
+            ):
+                return None
+            self._pending, self._pending_since, self._flushed_at = (0, 0, 0), None, now
+            return pending
+
+    def _flush(self, call_count, failure_count, slow_count):
+        """ Add the outcomes counted in the process to the shared window and open the breaker if
+        the window exceeds its thresholds. """
+        # All the expressions of the SET clause see the values before the update.
+        shared_counts = self._execute("""
+            WITH params AS (
+                SELECT (now() at time zone 'UTC') - make_interval(secs => %(window)s) AS expiry
+            )
+            UPDATE payment_negdi_breaker
+               SET window_start = CASE WHEN window_start < expiry
+                                       THEN now() at time zone 'UTC' ELSE window_start END,
+                   call_count = CASE WHEN window_start < expiry
+                                     THEN 0 ELSE call_count END + %(calls)s,
+                   failure_count = CASE WHEN window_start < expiry
+                                        THEN 0 ELSE failure_count END + %(failures)s,
+                   slow_count = CASE WHEN window_start < expiry
+                                     THEN 0 ELSE slow_count END + %(slow)s
+              FROM params
+             WHERE name = %(key)s
+         RETURNING call_count, failure_count, slow_count
+        """, {
+            'window': self.window, 'calls': call_count, 'failures': failure_count,
+            'slow': slow_count, 'key': self.key,
+        })
+        if self._is_tripped(*shared_counts):
+            _logger.warning(
+                "NEGDi: Opening the circuit breaker of %s (%d failed and %d slow out of %d"
+                " requests).", self.key, shared_counts[1], shared_counts[2], shared_counts[0],
+            )
+            self._open()
+
+    def _open(self):
+        self._execute("""
+            UPDATE payment_negdi_breaker
+               SET state = 'open', opened_at = now() at time zone 'UTC', probe_until = NULL
+             WHERE name = %s
+        """, [self.key])
+        self._cached_state = None
+        with self._lock:
+            self._pending, self._pending_since = (0, 0, 0), None
+
+    def _close(self):
+        _logger.info("NEGDi: Closing the circuit breaker of %s.", self.key)
+        self._execute("""
+            UPDATE payment_negdi_breaker
+               SET state = 'closed', opened_at = NULL, probe_until = NULL,
+                   window_start = now() at time zone 'UTC',
+                   call_count = 0, failure_count = 0, slow_count = 0
+             WHERE name = %s
+        """, [self.key])
+        self._cached_state = None
+        with self._lock:
+            self._pending, self._pending_since = (0, 0, 0), None
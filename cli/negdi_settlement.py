@@ -0,0 +1,56 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import datetime
+import json
+import logging
+import optparse
+import sys
+from pathlib import Path
+
+import odoo
+from odoo.cli import Command
+
+_logger = logging.getLogger(__name__)
+
+
+class NegdiSettlement(Command):
+    """ Reconcile a NEGDi settlement statement with the transactions of a database. """
+    name = 'negdi_settlement'
+
+    def run(self, args):
+        parser = odoo.tools.config.parser
+        parser.prog = f'{Path(sys.argv[0]).name} {self.name}'
+        group = optparse.OptionGroup(
+            parser, "NEGDi Settlement",
+            "Match a NEGDi settlement statement against the NEGDi transactions of the database"
+            " specified by the `-d` argument and write the discrepancies as CSV.",
+        )
+        group.add_option('--settlement-file', dest='settlement_file', help="The settlement statement")
+        group.add_option(
+            '--report', dest='report', help="The CSV discrepancy report; the standard output if not set"
+        )
+        group.add_option('--date-from', dest='date_from', help="The first day of the period (YYYY-MM-DD)")
+        group.add_option('--date-to', dest='date_to', help="The last day of the period (YYYY-MM-DD)")
+        parser.add_option_group(group)
+        opt = odoo.tools.config.parse_config(args, setup_logging=True)
+
+        dbname = odoo.tools.config['db_name']
+        if not dbname or not opt.settlement_file:
+            _logger.error("NEGDi Settlement: the -d and --settlement-file options are required.")
+            sys.exit(1)
+        date_from = opt.date_from and datetime.date.fromisoformat(opt.date_from)
+        date_to = opt.date_to and datetime.date.fromisoformat(opt.date_to)
+
+        registry = odoo.modules.registry.Registry(dbname)
+        with (
+            registry.cursor() as cr,
+            open(opt.settlement_file, 'rb') as stream,
+            open(opt.report, 'w', encoding='utf-8', newline='') if opt.report
+            else open(sys.stdout.fileno(), 'w', encoding='utf-8', newline='', closefd=False) as report,
+        ):
+            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+            stats = env['payment.transaction']._negdi_reconcile_settlement(
+                stream, report, date_from=date_from, date_to=date_to
+            )
+        print(json.dumps(stats, indent=2), file=sys.stderr)
+        sys.exit(1 if stats['discrepancies'] else 0)
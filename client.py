@@ -0,0 +1,239 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from . import const
+from . import metrics
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .rate_limiter import RateLimiter, RateLimitError
+
+
+_logger = logging.getLogger(__name__)
+
+
+class NEGDiClient:
+    """ Thin HTTP client for the NEGDi API backed by a keep-alive connection pool.
+
+    One client exists per worker process and per API base URL (see :func:`get_client`), so that
+    consecutive ec1000 and ec1098 calls reuse the TCP and TLS connections opened by the previous
+    ones instead of performing a new handshake with the gateway for every request.
+
+    When a circuit breaker is provided, requests are rejected with
+    :class:`~odoo.addons.payment_negdi.circuit_breaker.CircuitOpenError` without contacting the
+    gateway while the breaker is open, and the outcome of every request is reported to it.
+
+    When a rate limiter is provided, every request first waits for a token of its traffic class,
+    see :class:`~odoo.addons.payment_negdi.rate_limiter.RateLimiter`.
+
+    Requests failing transiently are retried within a budget of time, see :meth:`post`.
+
+    The client holds no Odoo state and can be safely shared between threads.
+    """
+
+    def __init__(
+        self, base_url, pool_size=const.NEGDI_POOL_SIZE,
+        connect_timeout=const.NEGDI_CONNECT_TIMEOUT, read_timeout=const.NEGDI_READ_TIMEOUT,
+        max_retries=const.NEGDI_RETRY_MAX_RETRIES, retry_budget=const.NEGDI_RETRY_BUDGET,
+        breaker=None, rate_limiter=None,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.breaker = breaker
+        self.rate_limiter = rate_limiter
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_url(self, endpoint):
+        """ Return the full URL of the provided API endpoint. """
+        return f'{self.base_url}/{endpoint}'
+
+    def post(self, endpoint, payload, read_timeout=None, traffic_class=None, idempotent=None):
+        """ Send a JSON payload to an API endpoint and return the decoded JSON response.
+
+        A request failing transiently is sent again with the same payload after a random delay
+        whose upper bound doubles at each retry (capped exponential backoff with full jitter),
+        as long as the retry fits in the retry budget of the client. The budget of 'checkout'
+        requests, which a customer is waiting for, is capped to their read timeout, so that
+        retrying never holds the customer longer than a single slow attempt. Only the failures that
+        happened before the gateway could receive the request, i.e. the errors of the connection
+        phase and the `NEGDI_RETRY_STATUSES` responses, are retried for non-idempotent requests;
+        idempotent ones are also retried after any other connection error, e.g. a connection
+        aborted once the request was sent, a read timeout or a 5xx response. Requests rejected by
+        the rate limiter or the circuit breaker are not retried.
+
+        :param str endpoint: The API endpoint to call, e.g. `ec1000`.
+        :param dict payload: The JSON-serializable payload to send.
+        :param float read_timeout: The read timeout overriding that of the client, if any.
+        :param str traffic_class: The rate limit class of the request; by default, 'checkout' for
+                                  ec1000 requests and 'background' for the other ones.
+        :param bool idempotent: Whether sending the request twice has no other effect than
+                                sending it once; by default, all requests but ec1000 ones are.
+        :return: The decoded response.
+        :rtype: dict
+        :raise requests.exceptions.RequestException: If the request fails.
+        :raise CircuitOpenError: If the circuit breaker rejected the request.
+        :raise RateLimitError: If the rate limit of the traffic class is reached.
+        :raise json.JSONDecodeError: If the response is not valid JSON.
+        """
+        if idempotent is None:
+            idempotent = endpoint != const.NEGDI_CREATE_ORDER_ENDPOINT
+        traffic_class = traffic_class or (
+            'checkout' if endpoint == const.NEGDI_CREATE_ORDER_ENDPOINT else 'background'
+        )
+        read_timeout = read_timeout or self.read_timeout
+        retry_budget = self.retry_budget
+        if traffic_class == 'checkout':
+            retry_budget = min(retry_budget, read_timeout)
+        deadline = time.monotonic() + retry_budget
+        retries = 0
+        while True:
+            try:
+                return self._send(
+                    endpoint, payload, min(read_timeout, deadline - time.monotonic()), traffic_class
+                )
+            except requests.exceptions.RequestException as error:
+                if retries >= self.max_retries or not self._is_retryable(error, idempotent):
+                    raise
+                delay = random.uniform(0, min(
+                    const.NEGDI_RETRY_MAX_DELAY, const.NEGDI_RETRY_BASE_DELAY * 2 ** retries
+                ))
+                # Leave the next attempt at least the time to connect.
+                if time.monotonic() + delay + self.connect_timeout > deadline:
+                    raise
+                retries += 1
+                _logger.info(
+                    "NEGDi: Retrying the %s request in %.2fs after %s (retry %s of %s).",
+                    endpoint, delay, error.__class__.__name__, retries, self.max_retries,
+                )
+                metrics.inc('negdi_request_retries_total', endpoint=endpoint)
+                time.sleep(delay)
+
+    @staticmethod
+    def _is_retryable(error, idempotent):
+        """ Return whether a failed request can be sent again, see `post`. """
+        if isinstance(error, (CircuitOpenError, RateLimitError, requests.exceptions.SSLError)):
+            return False
+        if isinstance(error, requests.exceptions.ConnectionError):  # Including connect timeouts.
+            return idempotent or NEGDiClient._is_connect_error(error)
+        if isinstance(error, requests.exceptions.Timeout):
+            return idempotent
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            status = error.response.status_code
+            return status in const.NEGDI_RETRY_STATUSES or (idempotent and status >= 500)
+        return False
+
+    @staticmethod
+    def _is_connect_error(error):
+        """ Return whether a connection error happened before the connection was established, and
+        thus before any byte of the request was sent. """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = error.args[0] if error.args else None
+        reason = getattr(reason, 'reason', reason)  # The error wrapped in a `MaxRetryError`.
+        return isinstance(reason, NewConnectionError)
+
+    def _send(self, endpoint, payload, read_timeout, traffic_class):
+        """ Send a request once, see `post`. """
+        if self.rate_limiter:
+            try:
+                self.rate_limiter.acquire(traffic_class)
+            except RateLimitError:
+                metrics.inc('negdi_requests_total', endpoint=endpoint, outcome='rate_limited')
+                raise
+
+        if self.breaker and not self.breaker.allow():
+            metrics.inc('negdi_requests_total', endpoint=endpoint, outcome='circuit_open')
+            raise CircuitOpenError(f"The NEGDi gateway {self.base_url} is temporarily unavailable.")
+
+        start = time.monotonic()
+        success = False
+        outcome = 'connection_error'
+        try:
+            response = self.session.post(
+                self.get_url(endpoint),
+                json=payload,
+                timeout=(self.connect_timeout, read_timeout),
+            )
+            # Client errors mean that the gateway is up and answering.
+            success = response.status_code < 500
+            outcome = 'http_error'
+            response.raise_for_status()
+            outcome = 'json_error'
+            response_data = response.json()
+            outcome = 'success'
+        except requests.exceptions.Timeout:
+            outcome = 'timeout'
+            raise
+        except ValueError:
+            success = False
+            raise
+        finally:
+            duration = time.monotonic() - start
+            if self.breaker:
+                self.breaker.record(success, duration)
+            metrics.inc('negdi_requests_total', endpoint=endpoint, outcome=outcome)
+            metrics.observe(
+                'negdi_request_duration_seconds', duration, endpoint=endpoint, outcome=outcome
+            )
+        return response_data
+
+    def is_available(self):
+        """ Return whether the gateway accepts requests, according to the circuit breaker. """
+        return not (self.breaker and self.breaker.is_open())
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url, dbname=None, **options):
+    """ Return the pooled client of the current process for the provided API base URL.
+
+    Clients are created lazily and kept for the lifetime of the process. A client is rebuilt if
+    it was created with different pooling, timeout or retry options than the provided ones; the
+    stale client is left to the garbage collector so that in-flight requests are not interrupted.
+
+    :param str base_url: The NEGDi API base URL, as returned by `_negdi_get_api_url`.
+    :param str dbname: The database holding the state of the circuit breaker and the rate limits
+                       of the gateway, if the client must use them.
+    :param dict options: The optional `pool_size`, `connect_timeout`, `read_timeout`,
+                         `max_retries` and `retry_budget` of the client.
+    :return: The client.
+    :rtype: NEGDiClient
+    """
+    # The pid is part of the key so that a client created before a fork is never shared with the
+    # forked workers, as their connections would otherwise be multiplexed on the same sockets.
+    key = (os.getpid(), dbname, base_url.rstrip('/'))
+    client = _clients.get(key)
+    if client is None or any(getattr(client, k) != v for k, v in options.items()):
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None or any(getattr(client, k) != v for k, v in options.items()):
+                breaker = client and client.breaker
+                rate_limiter = client and client.rate_limiter
+                if dbname and not breaker:
+                    from odoo import sql_db  # Imported lazily to keep this module usable outside Odoo.
+                    breaker = CircuitBreaker(sql_db.db_connect(dbname).cursor, key[2])
+                    rate_limiter = RateLimiter(sql_db.db_connect(dbname).cursor, key[2])
+                client = _clients[key] = NEGDiClient(
+                    key[2], breaker=breaker, rate_limiter=rate_limiter, **options
+                )
+    return client
@@ -14,6 +14,13 @@ PAYMENT_STATUS_MAPPING = {
     'error': ('Declined', 'Expired', 'System error'), # Add NEGDi failure/error states
 }
 
+# Inverted, case-normalized PAYMENT_STATUS_MAPPING: NEGDi status -> Odoo state
+STATUS_TO_STATE = {
+    status.casefold(): state
+    for state, statuses in PAYMENT_STATUS_MAPPING.items()
+    for status in statuses
+}
+
 # The codes of the payment methods to activate when NEGDi is activated.
 DEFAULT_PAYMENT_METHOD_CODES = {
     # Primary payment methods.
@@ -34,5 +41,128 @@ NEGDI_API_URL_PROD = 'https://payment.negdi.mn/api/pay' # Replace with actual Pr
 NEGDI_CREATE_ORDER_ENDPOINT = 'ec1000'
 NEGDI_INQUIRY_ORDER_ENDPOINT = 'ec1098' # Add Inquiry endpoint
 
+# Odoo states in which a transaction is no longer updated by NEGDi inquiries and notifications.
+# 'error' is not final: a transaction set in error after a communication failure can still be paid.
+NEGDI_FINAL_STATES = ('done', 'cancel')
+
 # Default ordertype for simple redirect
-NEGDI_DEFAULT_ORDER_TYPE = '3dsOrder' # Or 'Non3dsOrder' if CVV only is preferred initially
\ No newline at end of file
+NEGDI_DEFAULT_ORDER_TYPE = '3dsOrder' # Or 'Non3dsOrder' if CVV only is preferred initially
+
+# Sequence whose value versions the NEGDi entries of the registry cache
+NEGDI_CACHE_VERSION_SEQUENCE = 'payment_negdi_cache_version'
+
+# Connection pooling and timeouts (in seconds) of the API client
+NEGDI_POOL_SIZE = 10  # Maximum number of keep-alive connections per worker and per API base URL
+NEGDI_CONNECT_TIMEOUT = 5
+NEGDI_READ_TIMEOUT = 60  # ec1000
+NEGDI_INQUIRY_READ_TIMEOUT = 30  # ec1098
+
+# Retries of the requests failing transiently, with capped exponential backoff and full jitter
+NEGDI_RETRY_MAX_RETRIES = 3  # Maximum number of retries of a request
+NEGDI_RETRY_BASE_DELAY = 0.5  # Upper bound in seconds of the delay before the first retry
+NEGDI_RETRY_MAX_DELAY = 5  # Cap in seconds of the delay before a retry
+NEGDI_RETRY_BUDGET = 90  # Maximum time in seconds spent on a request, retries included
+# (capped to the read timeout for checkout requests)
+# HTTP statuses of the responses of a proxy that could not reach the gateway or of a gateway
+# refusing the request, retried for all requests; other 5xx responses, including the 504 of a proxy
+# that gave up waiting for the gateway, are only retried for idempotent requests
+NEGDI_RETRY_STATUSES = (502, 503)
+
+# Maximum number of deferred return inquiries processed per run of the background worker
+NEGDI_DEFERRED_INQUIRY_BATCH_SIZE = 50
+
+# Concurrent inquiries of the background workers (deferred returns and reconciliation)
+NEGDI_INQUIRY_MAX_WORKERS = 8  # Maximum number of concurrent ec1098 requests
+NEGDI_INQUIRY_CHUNK_SIZE = 100  # Number of processed transactions between two commits
+
+# Defaults of the reconciliation of pending transactions, overridable with system parameters
+NEGDI_RECONCILE_MIN_AGE = 30  # Minimum age in minutes of the transactions to reconcile
+NEGDI_RECONCILE_LIMIT = 20000  # Maximum number of transactions reconciled per run
+NEGDI_RECONCILE_MAX_AGE = 7  # Age in days after which transactions are no longer reconciled
+
+# Number of webhook notifications locked and processed per batch when draining the inbox
+NEGDI_INBOX_BATCH_SIZE = 100
+# Delay in seconds before draining the inbox again when notifications had to be skipped because
+# their transaction was being processed elsewhere
+NEGDI_INBOX_RETRY_DELAY = 5
+
+# Keys of the NEGDi payloads whose value is never written to the logs (compared case-insensitively)
+NEGDI_LOG_REDACTED_KEYS = {
+    'password', 'username', 'cardnumber', 'card_number', 'pan', 'cardholder', 'cvv', 'cvc',
+    'cvv2', 'expiry', 'expirydate', 'expdate', 'ordersign', 'signature', 'token',
+}
+
+# Share of the events logged at INFO level, by event; all events are logged in debug mode
+NEGDI_LOG_SAMPLE_RATES = {
+    'return': 1.0,
+    'webhook': 1.0,
+}
+
+# Circuit breaker of the gateway, shared by all workers (durations in seconds)
+NEGDI_BREAKER_WINDOW = 60  # Sliding window over which the outcome of the requests is counted
+NEGDI_BREAKER_MIN_CALLS = 10  # Minimum number of requests in the window before opening
+NEGDI_BREAKER_ERROR_RATE = 0.5  # Share of failed requests opening the breaker
+NEGDI_BREAKER_SLOW_CALL_DURATION = 10  # Duration above which a request counts as slow
+NEGDI_BREAKER_SLOW_CALL_RATE = 0.8  # Share of slow requests opening the breaker
+NEGDI_BREAKER_OPEN_DURATION = 30  # Time before a probe request is let through
+NEGDI_BREAKER_STATE_TTL = 1  # Time during which a worker reuses the state it read
+NEGDI_BREAKER_FLUSH_INTERVAL = 5  # Time during which a worker keeps its failed requests to itself
+
+# Metrics of the NEGDi round-trips and routes (durations in seconds)
+NEGDI_METRICS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Upper bounds of histograms
+NEGDI_METRICS_FLUSH_INTERVAL = 5  # Time between two snapshots of the metrics of a worker
+NEGDI_METRICS_RETENTION = 86400  # Time after which the snapshot of a stopped worker is dropped
+
+# Time in minutes during which the NEGDi order of a draft transaction can be reused, whether it was
+# created before the customer paid or by an earlier click on the Pay button
+NEGDI_PAYMENT_URL_VALIDITY = 15
+
+# Maximum number of concurrent ec1000 requests when creating NEGDi orders in batch
+NEGDI_ORDER_MAX_WORKERS = 16
+
+# Bus channel subscribed by the payment status page, and type of the notifications sent on it
+NEGDI_STATUS_CHANNEL = 'payment_negdi.status'
+NEGDI_STATUS_NOTIFICATION = 'payment_negdi/status'
+
+# Settlement statements: accepted column names (compared case-insensitively) of each value
+NEGDI_SETTLEMENT_COLUMNS = {
+    'tranid': ('tranid', 'transaction id', 'transaction_id'),
+    'amount': ('amount', 'settled amount', 'settled_amount'),
+    'currency': ('currency',),
+    'status': ('status',),
+    'date': ('date', 'settlement date', 'settlement_date'),
+}
+NEGDI_SETTLEMENT_REQUIRED_COLUMNS = {'tranid', 'amount', 'status'}
+NEGDI_SETTLEMENT_CHUNK_SIZE = 10000  # Number of settlement lines matched per query
+
+# Archive of the NEGDi exchanges, partitioned by month
+NEGDI_EXCHANGE_COMPRESSION_LEVEL = 6  # zlib level of the archived payloads
+NEGDI_EXCHANGE_PARTITIONS_AHEAD = 2  # Number of monthly partitions created in advance
+NEGDI_EXCHANGE_RETENTION_MONTHS = 12  # Default retention, overridable with a system parameter
+
+# Routing of the new orders among the terminals of a provider
+NEGDI_ROUTING_EWMA_ALPHA = 0.2  # Weight of the last request in the moving averages of a terminal
+NEGDI_ROUTING_LATENCY_FLOOR = 0.05  # Latency in seconds below which terminals are equally fast
+NEGDI_ROUTING_MIN_SHARE = 0.05  # Minimal health factor of a failing terminal
+
+# Outbound rate limits of the NEGDi requests shared by all workers, by traffic class: refill rate
+# in requests per second, burst capacity and maximum wait in seconds before failing fast. The
+# limits are stored in the `payment.negdi.rate.limit` records when first used and can be tuned
+# there.
+NEGDI_RATE_LIMITS = {
+    'checkout': (10, 20, 2),  # ec1000 requests of the customers paying
+    'return': (5, 10, 3),  # ec1098 requests of the customers returning from NEGDi
+    # ec1098 requests of the crons and batch ec1000 requests: sized for a reconciliation run of
+    # 20,000 inquiries (about 8 minutes, well within the 30-minute interval of the cron) and a
+    # batch of 1,000 payment links (about 25 seconds)
+    'background': (40, 40, 30),
+}
+# Classes whose spare tokens a class can use when its own budget is exhausted, by priority
+NEGDI_RATE_LIMIT_BORROWING = {
+    'checkout': ('background',),
+    'return': ('background',),
+}
+# Tokens of its own class taken at once by a worker, and time in seconds after which the unused
+# ones are given up, so that most requests consume a token without locking a bucket
+NEGDI_RATE_LIMIT_RESERVATION_SIZE = 3
+NEGDI_RATE_LIMIT_RESERVATION_TTL = 1
@@ -2,7 +2,6 @@
 
 import hmac
 import logging
-import pprint
 
 from werkzeug.exceptions import Forbidden
 
@@ -10,6 +9,11 @@ from odoo import http
 from odoo.exceptions import ValidationError, UserError
 from odoo.http import request
 
+from .. import metrics as negdi_metrics
+from .. import utils as negdi_utils
+from ..const import NEGDI_FINAL_STATES
+from ..rate_limiter import RateLimitError
+
 
 _logger = logging.getLogger(__name__)
 
@@ -17,36 +21,62 @@ _logger = logging.getLogger(__name__)
 class NEGDiController(http.Controller):
     _return_url = '/payment/negdi/return'
     _webhook_url = '/payment/negdi/webhook'
+    _metrics_url = '/payment/negdi/metrics'
 
     @http.route(_return_url, type='http', auth='public', methods=['GET'], csrf=False, save_session=False)
+    @negdi_metrics.route_timer('return')
     def negdi_return_from_checkout(self, **kwargs):
         """ Handle the callback from NEGDi after payment attempt. """
-        _logger.info("NEGDi: Handling return request with data:\n%s", pprint.pformat(kwargs))
+        negdi_utils.log_event(_logger, 'return', kwargs, tranid=kwargs.get('tranid'))
 
         # Extract tranid and checkid from the GET parameters
         tranid = kwargs.get('tranid')
         checkid = kwargs.get('checkid')
 
         if not tranid or not checkid:
-            _logger.warning("NEGDi: Received incomplete return data: %s", kwargs)
+            negdi_utils.log_event(
+                _logger, 'return.incomplete', kwargs, level=logging.WARNING, keys=sorted(kwargs)
+            )
             # Redirect to a generic error or status page if data is missing
             return request.redirect('/payment/status?error=missing_data')
 
         try:
             # Find the Odoo transaction based on the provider_reference (tranid)
             # Use sudo() for access rights, as the user might not be logged in reliably
-            tx_sudo = request.env['payment.transaction'].sudo().search([
-                ('provider_reference', '=', tranid),
-                ('provider_code', '=', 'negdi')
-            ], limit=1)
+            tx_sudo = request.env['payment.transaction'].sudo()._negdi_search_by_tranid(tranid)
 
             if not tx_sudo:
                 _logger.warning("NEGDi: Transaction not found for tranid: %s", tranid)
                 return request.redirect('/payment/status?error=tx_not_found')
 
+            if tx_sudo.state in NEGDI_FINAL_STATES:
+                # The customer refreshed the page or a notification already resolved the
+                # transaction: there is nothing left to ask NEGDi.
+                _logger.info("NEGDi: Tx %s is already final, skipping inquiry.", tx_sudo.reference)
+                return request.redirect('/payment/status')
+
+            if tx_sudo.provider_id._negdi_get_config().deferred_return:
+                # Let the background worker make the inquiry; the status page will pick up the
+                # final state of the transaction once it is processed.
+                _logger.info("NEGDi: Found tx %s, deferring inquiry.", tx_sudo.reference)
+                tx_sudo._negdi_defer_inquiry(checkid)
+                return request.redirect('/payment/status')
+
+            if not tx_sudo._negdi_lock_for_processing():
+                # Another request or worker is already processing this transaction.
+                _logger.info("NEGDi: Tx %s is being processed elsewhere, skipping inquiry.", tx_sudo.reference)
+                return request.redirect('/payment/status')
+
             # Trigger the inquiry and feedback processing within the transaction model
             _logger.info("NEGDi: Found tx %s, initiating inquiry.", tx_sudo.reference)
-            inquiry_response_data = tx_sudo._negdi_make_inquiry_request(check_id=checkid)
+            try:
+                inquiry_response_data = tx_sudo._negdi_make_inquiry_request(
+                    check_id=checkid, traffic_class='return'
+                )
+            except RateLimitError:
+                # NEGDi is saturated: let the background worker inquire when the budget allows it.
+                tx_sudo._negdi_defer_inquiry(checkid)
+                return request.redirect('/payment/status')
             _logger.info("NEGDi: Inquiry successful for tx %s, processing feedback.", tx_sudo.reference)
             tx_sudo._handle_feedback_data('negdi', inquiry_response_data)
 
@@ -66,30 +96,64 @@ class NEGDiController(http.Controller):
         return request.redirect('/payment/status')
     
     @http.route(_webhook_url, type='http', auth='public', methods=['POST'], csrf=False)
+    @negdi_metrics.route_timer('webhook')
     def negdi_webhook(self, **data):
-        """ Process the notification data sent by NEGDi to the webhook.
+        """ Store the notification data sent by NEGDi to the webhook and acknowledge it.
 
-        See https://paymentservices-reference.payfort.com/docs/api/build/index.html#transaction-feedback.
+        The notification is only added to the inbox here; it is processed in the background by
+        `payment.negdi.notification._cron_process_notifications` so that a burst of notifications
+        does not hold HTTP workers for the time of the post-processing of the orders.
 
-        :param dict data: The notification data.
-        :return: The 'SUCCESS' string to acknowledge the notification
+        :param dict data: The notification data, if sent as form data.
+        :return: An empty string to acknowledge the notification
         :rtype: str
         """
-        _logger.info("Notification received from NEGDi with data:\n%s", pprint.pformat(data))
         try:
-            # Check the integrity of the notification.
-            tx_sudo = request.env['payment.transaction'].sudo()._get_tx_from_notification_data(
-                'negdi', data
+            if request.httprequest.mimetype == 'application/json':
+                data = request.get_json_data()
+            notification_data = negdi_utils.normalize_notification_data(data)
+            negdi_utils.log_event(
+                _logger, 'webhook', notification_data,
+                tranid=notification_data['order'].get('tranid'),
+                status=notification_data['order'].get('status'),
             )
-            # self._verify_notification_signature(data, tx_sudo)
-
-            # Handle the notification data.
-            tx_sudo._handle_notification_data('negdi', data)
-        except ValidationError:  # Acknowledge the notification to avoid getting spammed.
-            _logger.exception("Unable to handle the notification data; skipping to acknowledge.")
+            with request.env.cr.savepoint():
+                request.env['payment.negdi.notification'].sudo()._enqueue(notification_data)
+        except Exception:  # Acknowledge the notification to avoid getting spammed.
+            _logger.exception("Unable to store the notification data; skipping to acknowledge.")
 
         return ''  # Acknowledge the notification.
 
+    @http.route(_metrics_url, type='http', auth='public', methods=['GET'], csrf=False, save_session=False)
+    def negdi_metrics(self):
+        """ Expose the NEGDi metrics of all the workers in the Prometheus text format.
+
+        The route is only served to scrapers authenticating with the bearer token set in the
+        `payment_negdi.metrics_token` system parameter.
+
+        :return: The metrics exposition.
+        :rtype: werkzeug.wrappers.Response
+        :raise: :class:`werkzeug.exceptions.Forbidden` if the token is missing or invalid
+        """
+        token = request.env['ir.config_parameter'].sudo().get_param('payment_negdi.metrics_token')
+        authorization = request.httprequest.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(
+            authorization.encode(), f'Bearer {token}'.encode()
+        ):
+            raise Forbidden()
+
+        inbox = request.env['payment.negdi.notification'].sudo()._get_inbox_metrics()
+        body = negdi_metrics.render(gauges={
+            'negdi_inbox_depth': ("Pending webhook notifications in the inbox.", inbox['depth']),
+            'negdi_inbox_lag_seconds': (
+                "Age of the oldest pending webhook notification.", inbox['lag']
+            ),
+            'negdi_inbox_errors': ("Webhook notifications that failed to process.", inbox['errors']),
+        })
+        return request.make_response(
+            body, headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')]
+        )
+
     @staticmethod
     def _verify_notification_signature(notification_data, tx_sudo):
         """ Check that the received signature matches the expected one.
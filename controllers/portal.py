@@ -1,7 +1,6 @@
 # payment_negdi/controllers/portal.py
 
 import logging
-import pprint
 import requests
 import json
 
@@ -20,6 +19,8 @@ from odoo.tools import SQL
 # Ensure this is the correct import for Odoo 18 website_sale payment controller
 from odoo.addons.website_sale.controllers.payment import PaymentPortal
 
+from .. import metrics as negdi_metrics
+
 _logger = logging.getLogger(__name__)
 _logger.info("***** NegdiPaymentPortal Controller File Loaded *****")
 
@@ -27,6 +28,7 @@ _logger.info("***** NegdiPaymentPortal Controller File Loaded *****")
 class NegdiPaymentPortal(PaymentPortal):
 
     @http.route('/shop/payment/transaction/<int:order_id>', type='json', auth='public', website=True)
+    @negdi_metrics.route_timer('checkout')
     def shop_payment_transaction(self, order_id, access_token, **kwargs):
         """
         Override the e-commerce transaction processing route.
@@ -36,53 +38,56 @@ class NegdiPaymentPortal(PaymentPortal):
         _logger.info(">>> ENTERED NegdiPaymentPortal.shop_payment_transaction override for Order %s <<<", order_id)
         tx_sudo = None # Initialize tx_sudo
         try:
+            # Fail fast, before locking the order and creating a transaction, if the NEGDi
+            # gateway is known to be down rather than waiting for the request to time out.
+            provider_sudo = request.env['payment.provider'].sudo().browse(
+                int(kwargs.get('provider_id') or 0)
+            ).exists()
+            if provider_sudo.code == 'negdi' and not provider_sudo._negdi_get_client().is_available():
+                _logger.warning("Shop payment failed for order %s: NEGDi is unavailable.", order_id)
+                raise UserError(_(
+                    "This payment method is temporarily unavailable. Please try again in a few"
+                    " minutes or choose another payment method."
+                ))
+
+            # Repeated clicks on the Pay button and retries send the same key: redirect them to
+            # the order created by the first request. This is checked before locking the sale
+            # order, which the first request may still hold.
+            idempotency_key = kwargs.pop('negdi_idempotency_key', None)
+            if provider_sudo.code == 'negdi' and idempotency_key:
+                tx_sudo = request.env['payment.transaction'].sudo()._negdi_get_idempotent_transaction(
+                    idempotency_key,
+                    self._document_check_access('sale.order', order_id, access_token),
+                    provider_sudo.id,
+                )
+                if tx_sudo and not tx_sudo.negdi_payment_url:
+                    _logger.info("Transaction %s of Order %s is still being created", tx_sudo.reference, order_id)
+                    raise UserError(_("Payment is already being processed for this order. Please wait or refresh."))
+                elif tx_sudo:
+                    _logger.info("Reusing Transaction %s for Order %s (repeated request)", tx_sudo.reference, order_id)
+                    request.session['__website_sale_last_tx_id'] = tx_sudo.id
+                    return {'negdi_redirect_url': tx_sudo.negdi_payment_url}
+
             # --- Start: Logic copied/adapted from original controller ---
-            try:
-                order_sudo = self._document_check_access('sale.order', order_id, access_token)
-                request.env.cr.execute(
-                    'SELECT 1 FROM sale_order WHERE id = %s FOR NO KEY UPDATE NOWAIT', [order_id]
+            order_sudo = self._negdi_lock_order(order_id, access_token, kwargs)
+
+            if provider_sudo.code == 'negdi' and provider_sudo._negdi_get_config().precreate_order:
+                # Pay with the NEGDi order created when the payment step was rendered, if the
+                # cart did not change since then.
+                tx_sudo = request.env['payment.transaction'].sudo()._negdi_get_precreated_transaction(
+                    order_sudo, int(kwargs['provider_id']), int(kwargs['payment_method_id'])
                 )
-            except MissingError:
-                _logger.warning("Shop payment failed for order %s: Order not found.", order_id)
-                raise
-            except AccessError as e:
-                _logger.warning("Shop payment failed for order %s: Access Denied (%s).", order_id, e)
-                raise ValidationError(_("The access token is invalid.")) from e
-            except sql_errors.LockNotAvailable: # Use the imported alias
-                _logger.warning("Shop payment failed for order %s: Order is already locked (concurrent payment attempt?).", order_id)
-                raise UserError(_("Payment is already being processed for this order. Please wait or refresh."))
-
-            if order_sudo.state == "cancel":
-                _logger.warning("Shop payment failed for order %s: Order is cancelled.", order_id)
-                raise ValidationError(_("The order has been cancelled."))
-
-            order_sudo._check_cart_is_ready_to_be_paid()
-            self._validate_transaction_kwargs(kwargs)
-
-            kwargs.update({
-                'partner_id': order_sudo.partner_invoice_id.id,
-                'currency_id': order_sudo.currency_id.id,
-                'sale_order_id': order_id,
-            })
-            if not kwargs.get('amount'):
-                kwargs['amount'] = order_sudo.amount_total
-
-            compare_amounts = order_sudo.currency_id.compare_amounts
-            if compare_amounts(kwargs['amount'], order_sudo.amount_total):
-                 _logger.warning("Amount mismatch for order %s.", order_id)
-                 raise ValidationError(_("The cart has been updated. Please refresh the page."))
-            if compare_amounts(order_sudo.amount_paid, order_sudo.amount_total) == 0 and order_sudo.amount_total > 0:
-                 _logger.warning("Order %s already paid.", order_id)
-                 raise UserError(_("The cart has already been paid. Please refresh the page."))
-
-            if not kwargs.get('provider_id') or not kwargs.get('payment_method_id'):
-                 _logger.error("Missing provider/method ID for order %s.", order_id)
-                 raise ValidationError(_("Payment provider information is missing."))
+                if tx_sudo:
+                    _logger.info("Reusing pre-created Transaction %s for Order %s", tx_sudo.reference, order_id)
+                    tx_sudo.negdi_precreated = False  # The customer may now pay it.
+                    request.session['__website_sale_last_tx_id'] = tx_sudo.id
+                    return {'negdi_redirect_url': tx_sudo.negdi_payment_url}
 
             # *** Create the transaction ***
-            tx_sudo = self._create_transaction(
-                custom_create_values={'sale_order_ids': [Command.set([order_id])]}, **kwargs,
-            )
+            custom_create_values = {'sale_order_ids': [Command.set([order_id])]}
+            if provider_sudo.code == 'negdi':
+                custom_create_values['negdi_idempotency_key'] = idempotency_key
+            tx_sudo = self._create_transaction(custom_create_values=custom_create_values, **kwargs)
             _logger.info("Created Transaction %s (ID: %s) for Order %s", tx_sudo.reference, tx_sudo.id, order_id)
             request.session['__website_sale_last_tx_id'] = tx_sudo.id
             # --- End: Logic copied/adapted from original controller ---
@@ -100,8 +105,16 @@ class NegdiPaymentPortal(PaymentPortal):
         if tx_sudo and tx_sudo.provider_code == 'negdi':
             _logger.info("Processing NEGDi payment for Tx %s (%s)", tx_sudo.id, tx_sudo.reference)
             try:
-                # Call the API request method defined in the transaction model
-                negdi_url = tx_sudo._negdi_make_ec1000_request()
+                if tx_sudo.provider_id._negdi_get_config().release_order_lock:
+                    # Two-phase checkout: persist the transaction and release the sale order lock
+                    # before the blocking API call, then save the NEGDi order in a short
+                    # follow-up transaction committed at the end of the request.
+                    payload = tx_sudo._negdi_prepare_ec1000_payload()
+                    request.env.cr.commit()
+                    negdi_url = tx_sudo._negdi_send_ec1000_request(payload)
+                else:
+                    # Call the API request method defined in the transaction model
+                    negdi_url = tx_sudo._negdi_make_ec1000_request()
                 # Return JSON with the key the frontend will check
                 return {
                     'negdi_redirect_url': negdi_url, # Use the custom key
@@ -122,4 +135,107 @@ class NegdiPaymentPortal(PaymentPortal):
              # Should not happen if transaction creation succeeded, but handle defensively
              _logger.error("Transaction object tx_sudo not available after creation for order %s", order_id)
              return {'error': {'message': _("Failed to initialize payment transaction.")}}
-        # --- End: Provider-specific logic ---
\ No newline at end of file
+        # --- End: Provider-specific logic ---
+
+    @http.route('/shop/payment/negdi/precreate/<int:order_id>', type='json', auth='public', website=True)
+    def shop_payment_negdi_precreate(self, order_id, access_token, **kwargs):
+        """ Create the NEGDi order of the cart while the customer is on the payment step.
+
+        The transaction and its NEGDi order are created with the same parameters as if the
+        customer paid, so that `shop_payment_transaction` only has to redirect them to the NEGDi
+        payment page if they pay with NEGDi before the cart changes.
+
+        :param int order_id: The sale order to pay.
+        :param str access_token: The access token of the sale order.
+        :param dict kwargs: The transaction route parameters.
+        :return: Whether a NEGDi order is ready to be paid.
+        :rtype: dict
+        """
+        kwargs.pop('negdi_idempotency_key', None)  # Only identifies the requests to pay.
+        provider_sudo = request.env['payment.provider'].sudo().browse(
+            int(kwargs.get('provider_id') or 0)
+        ).exists()
+        if (
+            provider_sudo.code != 'negdi'
+            or not provider_sudo._negdi_get_config().precreate_order
+            or not provider_sudo._negdi_get_client().is_available()
+        ):
+            return {'precreated': False}
+
+        try:
+            order_sudo = self._negdi_lock_order(order_id, access_token, kwargs)
+            if request.env['payment.transaction'].sudo()._negdi_get_precreated_transaction(
+                order_sudo, int(kwargs['provider_id']), int(kwargs['payment_method_id'])
+            ):
+                return {'precreated': True}
+
+            tx_sudo = self._create_transaction(
+                custom_create_values={
+                    'sale_order_ids': [Command.set([order_id])], 'negdi_precreated': True,
+                },
+                **kwargs,
+            )
+            payload = tx_sudo._negdi_prepare_ec1000_payload()
+            request.env.cr.commit()  # Release the lock on the order before calling NEGDi.
+            tx_sudo._negdi_send_ec1000_request(payload)
+        except (AccessError, MissingError, UserError, ValidationError) as e:
+            # The order will be created when the customer pays instead.
+            _logger.info("NEGDi: Could not pre-create the payment of order %s: %s", order_id, e)
+            return {'precreated': False}
+        _logger.info("NEGDi: Pre-created Transaction %s for Order %s", tx_sudo.reference, order_id)
+        return {'precreated': True}
+
+    def _negdi_lock_order(self, order_id, access_token, kwargs):
+        """ Check that the sale order can be paid, lock it, and complete the transaction values.
+
+        :param int order_id: The sale order to pay.
+        :param str access_token: The access token of the sale order.
+        :param dict kwargs: The transaction route parameters, updated in place with the values of
+                            the sale order.
+        :return: The sudoed sale order.
+        :rtype: recordset of `sale.order`
+        :raise MissingError, ValidationError, UserError: If the sale order cannot be paid.
+        """
+        try:
+            order_sudo = self._document_check_access('sale.order', order_id, access_token)
+            request.env.cr.execute(
+                'SELECT 1 FROM sale_order WHERE id = %s FOR NO KEY UPDATE NOWAIT', [order_id]
+            )
+        except MissingError:
+            _logger.warning("Shop payment failed for order %s: Order not found.", order_id)
+            raise
+        except AccessError as e:
+            _logger.warning("Shop payment failed for order %s: Access Denied (%s).", order_id, e)
+            raise ValidationError(_("The access token is invalid.")) from e
+        except sql_errors.LockNotAvailable: # Use the imported alias
+            _logger.warning("Shop payment failed for order %s: Order is already locked (concurrent payment attempt?).", order_id)
+            raise UserError(_("Payment is already being processed for this order. Please wait or refresh."))
+
+        if order_sudo.state == "cancel":
+            _logger.warning("Shop payment failed for order %s: Order is cancelled.", order_id)
+            raise ValidationError(_("The order has been cancelled."))
+
+        order_sudo._check_cart_is_ready_to_be_paid()
+        self._validate_transaction_kwargs(kwargs)
+
+        kwargs.update({
+            'partner_id': order_sudo.partner_invoice_id.id,
+            'currency_id': order_sudo.currency_id.id,
+            'sale_order_id': order_id,
+        })
+        if not kwargs.get('amount'):
+            kwargs['amount'] = order_sudo.amount_total
+
+        compare_amounts = order_sudo.currency_id.compare_amounts
+        if compare_amounts(kwargs['amount'], order_sudo.amount_total):
+             _logger.warning("Amount mismatch for order %s.", order_id)
+             raise ValidationError(_("The cart has been updated. Please refresh the page."))
+        if compare_amounts(order_sudo.amount_paid, order_sudo.amount_total) == 0 and order_sudo.amount_total > 0:
+             _logger.warning("Order %s already paid.", order_id)
+             raise UserError(_("The cart has already been paid. Please refresh the page."))
+
+        if not kwargs.get('provider_id') or not kwargs.get('payment_method_id'):
+             _logger.error("Missing provider/method ID for order %s.", order_id)
+             raise ValidationError(_("Payment provider information is missing."))
+
+        return order_sudo
@@ -1,6 +1,11 @@
 -- disable negdi payment provider
 UPDATE payment_provider
-   SET negdi_merchant_identifier = NULL,
-       negdi_access_code = NULL,
-       negdi_sha_request = NULL,
-       negdi_sha_response = NULL;
+   SET negdi_terminal_identifier = NULL,
+       negdi_username = NULL,
+       negdi_password = NULL,
+       negdi_api_url = NULL;
+
+-- disable the negdi terminals
+UPDATE payment_negdi_terminal
+   SET password = '',
+       active = FALSE;
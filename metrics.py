@@ -0,0 +1,249 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" In-process metrics of the NEGDi integration, aggregated across workers.
+
+Every process counts its own observations in memory and periodically writes a snapshot of them to
+its own file in a directory shared by all the workers of the server. The metrics route merges the
+snapshots of all the processes and renders them in the Prometheus text exposition format, so that
+prefork workers never have to coordinate when observing.
+"""
+
+import bisect
+import contextlib
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from . import const
+
+
+_logger = logging.getLogger(__name__)
+
+# Declared metrics: name -> (type, help)
+METRICS = {
+    'negdi_requests_total': (
+        'counter', "Requests sent to the NEGDi API, by endpoint and outcome."
+    ),
+    'negdi_request_retries_total': (
+        'counter', "Retries of the failed requests sent to the NEGDi API, by endpoint."
+    ),
+    'negdi_request_duration_seconds': (
+        'histogram', "Duration of the requests sent to the NEGDi API, by endpoint and outcome."
+    ),
+    'negdi_route_duration_seconds': (
+        'histogram', "Time spent by the workers handling the NEGDi routes, by route."
+    ),
+    'negdi_route_queries_total': (
+        'counter', "Database queries made by the workers handling the NEGDi routes, by route."
+    ),
+    'negdi_route_query_seconds_total': (
+        'counter', "Time spent in database queries by the NEGDi routes, by route."
+    ),
+    'negdi_transaction_states_total': (
+        'counter', "States set on transactions from NEGDi results, by state."
+    ),
+}
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_pid = None  # Process owning the metrics above, which forked workers must not inherit.
+_dirty = False
+_directory = None
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """ Increment a counter.
+
+    :param str name: The name of the counter, as declared in `METRICS`.
+    :param float value: The increment.
+    :param dict labels: The labels of the counter.
+    :return: None
+    """
+    key = (name, _labels_key(labels))
+    with _lock:
+        _check_process()
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """ Record an observation in a histogram with the buckets `NEGDI_METRICS_BUCKETS`.
+
+    :param str name: The name of the histogram, as declared in `METRICS`.
+    :param float value: The observed value.
+    :param dict labels: The labels of the histogram.
+    :return: None
+    """
+    key = (name, _labels_key(labels))
+    buckets = const.NEGDI_METRICS_BUCKETS
+    with _lock:
+        _check_process()
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(buckets) + 2)
+        histogram[bisect.bisect_left(buckets, value)] += 1  # Non-cumulative; +Inf is the last one.
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    """ Observe the duration of the wrapped block in a histogram. """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start, **labels)
+
+
+@contextlib.contextmanager
+def route_timer(route):
+    """ Observe the duration of the wrapped route handler and count the queries it made.
+
+    The queries are those counted by the database cursors on the current thread, as the Odoo
+    server does for its request logs.
+    """
+    thread = threading.current_thread()
+    query_count, query_time = getattr(thread, 'query_count', 0), getattr(thread, 'query_time', 0)
+    try:
+        with timer('negdi_route_duration_seconds', route=route):
+            yield
+    finally:
+        inc('negdi_route_queries_total', getattr(thread, 'query_count', 0) - query_count, route=route)
+        inc(
+            'negdi_route_query_seconds_total', getattr(thread, 'query_time', 0) - query_time,
+            route=route,
+        )
+
+
+def _get_directory():
+    global _directory
+    if _directory is None:
+        from odoo.tools import config  # Imported lazily to keep this module usable outside Odoo.
+        _directory = os.path.join(config['data_dir'], 'negdi_metrics')
+    return _directory
+
+
+def _check_process():
+    """ Reset the metrics inherited from the parent process and start the flushing thread.
+
+    Must be called with the lock held, before recording an observation.
+    """
+    global _pid, _dirty
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _counters.clear()
+        _histograms.clear()
+        threading.Thread(target=_flush_periodically, name='negdi-metrics', daemon=True).start()
+    _dirty = True
+
+
+def _flush_periodically():
+    pid = os.getpid()
+    while _pid == pid:
+        time.sleep(const.NEGDI_METRICS_FLUSH_INTERVAL)
+        if _dirty:
+            flush()
+
+
+def flush():
+    """ Write the snapshot of the metrics of the current process to the shared directory. """
+    global _dirty
+    with _lock:
+        _dirty = False
+        snapshot = {
+            'counters': [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [
+                [name, dict(labels), histogram] for (name, labels), histogram in _histograms.items()
+            ],
+        }
+    try:
+        directory = _get_directory()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(f'{path}.tmp', path)  # Atomic: readers never see a partial snapshot.
+    except OSError:
+        _logger.warning("NEGDi: Unable to write the metrics snapshot.", exc_info=True)
+
+
+def collect():
+    """ Merge the snapshots of all the processes.
+
+    The snapshots of processes that stopped more than `NEGDI_METRICS_RETENTION` seconds ago are
+    deleted; Prometheus handles the resulting decrease of the counters as a reset.
+
+    :return: The merged counters and histograms, keyed by `(name, labels)`.
+    :rtype: tuple
+    """
+    flush()
+    counters, histograms = {}, {}
+    now = time.time()
+    for path in glob.glob(os.path.join(_get_directory(), '*.json')):
+        try:
+            if now - os.path.getmtime(path) > const.NEGDI_METRICS_RETENTION:
+                os.remove(path)
+                continue
+            with open(path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            continue  # The snapshot was replaced or deleted in the meantime.
+        for name, labels, value in snapshot['counters']:
+            key = (name, _labels_key(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, _labels_key(labels))
+            if key in histograms and len(histograms[key]) == len(histogram):
+                histograms[key] = [a + b for a, b in zip(histograms[key], histogram)]
+            else:
+                histograms[key] = list(histogram)
+    return counters, histograms
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def render(gauges=None):
+    """ Render the metrics of all the processes in the Prometheus text exposition format.
+
+    :param dict gauges: Additional gauges computed at scrape time: name -> (help, value).
+    :return: The exposition.
+    :rtype: str
+    """
+    counters, histograms = collect()
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+        if metric_type == 'counter':
+            for (metric_name, labels), value in sorted(counters.items()):
+                if metric_name == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            continue
+        for (metric_name, labels), histogram in sorted(histograms.items()):
+            if metric_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip([*const.NEGDI_METRICS_BUCKETS, '+Inf'], histogram[:-2]):
+                cumulative += count
+                bucket_labels = (*labels, ('le', str(bound)))
+                lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram[-2]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram[-1]}')
+    for name, (help_text, value) in (gauges or {}).items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
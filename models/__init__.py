@@ -1,4 +1,13 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from . import account_move
+from . import ir_websocket
+from . import payment_method
 from . import payment_provider
 from . import payment_transaction
+from . import payment_negdi_breaker
+from . import payment_negdi_exchange
+from . import payment_negdi_notification
+from . import payment_negdi_rate_limit
+from . import payment_negdi_terminal
+from . import sale_order
@@ -0,0 +1,15 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import _, models
+from odoo.exceptions import UserError
+
+
+class AccountMove(models.Model):
+    _inherit = 'account.move'
+
+    def action_negdi_create_payment_links(self):
+        """ Create the NEGDi payment links of the selected customer invoices and show them. """
+        invoices = self.filtered(lambda move: move.state == 'posted' and move.is_sale_document())
+        if not invoices:
+            raise UserError(_("Payment links can only be created for posted customer invoices."))
+        return self.env['payment.transaction']._negdi_action_create_payment_links(invoices)
@@ -0,0 +1,29 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import models
+from odoo.http import request
+
+from odoo.addons.bus.websocket import wsrequest
+from odoo.addons.payment.controllers.post_processing import PaymentPostProcessing
+
+from .. import const
+
+
+class IrWebsocket(models.AbstractModel):
+    _inherit = 'ir.websocket'
+
+    def _build_bus_channel_list(self, channels):
+        """ Override of `bus` to subscribe the payment status page to its NEGDi transaction.
+
+        The page subscribes to the `NEGDI_STATUS_CHANNEL` placeholder, which is replaced by the
+        channel of the transaction monitored by the session, so that a customer can only follow
+        their own transaction.
+        """
+        if const.NEGDI_STATUS_CHANNEL in channels:
+            channels = [channel for channel in channels if channel != const.NEGDI_STATUS_CHANNEL]
+            req = request or wsrequest
+            tx_id = req and req.session.get(PaymentPostProcessing.MONITORED_TX_ID_KEY)
+            tx_sudo = self.env['payment.transaction'].sudo().browse(tx_id).exists()
+            if tx_sudo.provider_code == 'negdi':
+                channels.append(tx_sudo)
+        return super()._build_bus_channel_list(channels)
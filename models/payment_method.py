@@ -0,0 +1,40 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import api, models, tools
+
+
+class PaymentMethod(models.Model):
+    _inherit = 'payment.method'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        methods = super().create(vals_list)
+        self.env['payment.provider']._negdi_clear_cache()
+        return methods
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'code' in vals or 'active' in vals:
+            self.env['payment.provider']._negdi_clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['payment.provider']._negdi_clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache("self.env['payment.provider']._negdi_get_cache_version()")
+    def _negdi_get_method_ids_by_code(self):
+        """ Return the table of active payment method ids by case-normalized code.
+
+        The table is built once per registry, see `payment.provider._negdi_get_cache_version`, and
+        lets the NEGDi notification processing resolve the `paymentmethod` of an order without
+        querying the database, like `_get_from_code` would for each notification. As with
+        `_get_from_code`, archived methods are not matched.
+
+        :return: The payment method ids, by code.
+        :rtype: dict
+        """
+        methods = self.with_context(active_test=True).sudo().search_read([], ['code'])
+        return {method['code'].casefold(): method['id'] for method in methods}
@@ -0,0 +1,31 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import fields, models
+
+
+class PaymentNEGDiBreaker(models.Model):
+    """ Shared state of the NEGDi circuit breakers, see `circuit_breaker.CircuitBreaker`.
+
+    The records are read and updated with plain SQL in independent transactions by the breakers;
+    the model only declares the table and exposes it to administrators.
+    """
+    _name = 'payment.negdi.breaker'
+    _description = "NEGDi Circuit Breaker"
+
+    name = fields.Char(string="Gateway", required=True, readonly=True)
+    state = fields.Selection(
+        string="State",
+        selection=[('closed', "Closed"), ('open', "Open"), ('half_open', "Half-Open")],
+        default='closed',
+        required=True,
+    )
+    opened_at = fields.Datetime(string="Opened At", readonly=True)
+    probe_until = fields.Datetime(string="Probe Deadline", readonly=True)
+    window_start = fields.Datetime(string="Window Start", readonly=True)
+    call_count = fields.Integer(string="Requests", readonly=True)
+    failure_count = fields.Integer(string="Failed Requests", readonly=True)
+    slow_count = fields.Integer(string="Slow Requests", readonly=True)
+
+    _sql_constraints = [
+        ('name_uniq', 'unique(name)', "There can be only one circuit breaker per gateway."),
+    ]
@@ -0,0 +1,210 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import json
+import logging
+import zlib
+
+import psycopg2
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, fields, models
+from odoo.tools import SQL
+
+from .. import utils as negdi_utils
+from ..const import NEGDI_EXCHANGE_COMPRESSION_LEVEL
+from ..const import NEGDI_EXCHANGE_PARTITIONS_AHEAD
+from ..const import NEGDI_EXCHANGE_RETENTION_MONTHS
+
+
+_logger = logging.getLogger(__name__)
+
+
+class PaymentNEGDiExchange(models.Model):
+    """ Append-only archive of the requests sent to and the responses received from NEGDi.
+
+    The table is not managed by the ORM: it is partitioned by month of `create_date` so that the
+    exchanges past the retention period are pruned by dropping whole partitions, see
+    `_cron_manage_partitions`. The exchanges are inserted with plain SQL by `_record`; their
+    redacted payload is stored compressed in the `data` column, which has no field and is only
+    decompressed when reading `payload`.
+    """
+    _name = 'payment.negdi.exchange'
+    _description = "NEGDi Exchange"
+    _auto = False
+    _log_access = False
+    _order = 'create_date desc, id desc'
+    _rec_name = 'tranid'
+
+    create_date = fields.Datetime(string="Date", readonly=True)
+    kind = fields.Selection(
+        string="Kind",
+        selection=[('ec1000', "Order Creation"), ('ec1098', "Inquiry"), ('webhook', "Webhook")],
+        readonly=True,
+    )
+    tranid = fields.Char(string="NEGDi Transaction ID", readonly=True)
+    reference = fields.Char(string="Reference", readonly=True)
+    status = fields.Char(string="Status", readonly=True)
+    payload = fields.Text(string="Payload", compute='_compute_payload')
+
+    def init(self):
+        """ Create the partitioned table, its default partition and the upcoming partitions. """
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS payment_negdi_exchange (
+                id serial,
+                create_date timestamp NOT NULL DEFAULT (now() at time zone 'UTC'),
+                kind varchar NOT NULL,
+                tranid varchar,
+                reference varchar,
+                status varchar,
+                data bytea NOT NULL,
+                PRIMARY KEY (id, create_date)
+            ) PARTITION BY RANGE (create_date)
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS payment_negdi_exchange_tranid_index
+                ON payment_negdi_exchange (tranid)
+        """)
+        # Receives the exchanges of the months without partition, if the cron did not run.
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS payment_negdi_exchange_default
+                PARTITION OF payment_negdi_exchange DEFAULT
+        """)
+        self._create_partitions()
+
+    #=== COMPUTE METHODS ===#
+
+    def _compute_payload(self):
+        self.env.cr.execute(
+            "SELECT id, data FROM payment_negdi_exchange WHERE id = ANY(%s)", [self.ids]
+        )
+        data = dict(self.env.cr.fetchall())
+        for exchange in self:
+            compressed = data.get(exchange.id)
+            exchange.payload = compressed and json.dumps(
+                json.loads(zlib.decompress(compressed)), indent=2, ensure_ascii=False
+            )
+
+    #=== BUSINESS METHODS ===#
+
+    @api.model
+    def _record(
+        self, kind, request_data=None, response_data=None, error=None, tranid=None, reference=None,
+        status=None,
+    ):
+        """ Archive an exchange with NEGDi.
+
+        The credentials and card data are redacted before the payload is compressed. A failure to
+        archive is logged and does not interrupt the payment flow.
+
+        :param str kind: The kind of exchange: 'ec1000', 'ec1098' or 'webhook'.
+        :param dict request_data: The payload sent to NEGDi, if any.
+        :param dict response_data: The data received from NEGDi, if any.
+        :param str error: The error that interrupted the exchange, if any.
+        :param str tranid: The NEGDi transaction id, if known.
+        :param str reference: The reference of the transaction, if known.
+        :param str status: The NEGDi status of the order, if any.
+        :return: None
+        """
+        document = {'request': request_data, 'response': response_data, 'error': error}
+        data = zlib.compress(
+            json.dumps(
+                negdi_utils.redact({key: value for key, value in document.items() if value}),
+                separators=(',', ':'), ensure_ascii=False, default=str,
+            ).encode(),
+            NEGDI_EXCHANGE_COMPRESSION_LEVEL,
+        )
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("""
+                    INSERT INTO payment_negdi_exchange (kind, tranid, reference, status, data)
+                         VALUES (%s, %s, %s, %s, %s)
+                """, [kind, tranid and str(tranid), reference, status, psycopg2.Binary(data)])
+        except psycopg2.Error:
+            _logger.exception("NEGDi: Could not archive the %s exchange of %s.", kind, reference or tranid)
+
+    @api.model
+    def _cron_manage_partitions(self):
+        """ Create the partitions of the upcoming months and drop those past the retention period.
+
+        The retention period, in months, is read from the `payment_negdi.exchange_retention_months`
+        system parameter.
+
+        :return: None
+        """
+        self._create_partitions()
+        retention = int(self.env['ir.config_parameter'].sudo().get_param(
+            'payment_negdi.exchange_retention_months', NEGDI_EXCHANGE_RETENTION_MONTHS
+        ))
+        self._drop_partitions(self._get_current_month() - relativedelta(months=retention))
+
+    @api.model
+    def _get_current_month(self):
+        return fields.Date.today().replace(day=1)
+
+    @api.model
+    def _get_partitions(self):
+        """ Return the monthly partitions of the archive.
+
+        :return: The name of each partition, by first day of its month.
+        :rtype: dict
+        """
+        self.env.cr.execute("""
+            SELECT child.relname
+              FROM pg_inherits
+              JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+             WHERE pg_inherits.inhparent = 'payment_negdi_exchange'::regclass
+               AND child.relname != 'payment_negdi_exchange_default'
+        """)
+        return {
+            fields.Date.to_date(f'{name[-7:-3]}-{name[-2:]}-01'): name
+            for name, in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def _create_partitions(self):
+        """ Create the partitions of the current month and of the next ones.
+
+        The exchanges of a new partition's month already stored in the default partition are
+        moved to it before it is attached.
+
+        :return: None
+        """
+        partitions = self._get_partitions()
+        current_month = self._get_current_month()
+        for offset in range(NEGDI_EXCHANGE_PARTITIONS_AHEAD + 1):
+            month = current_month + relativedelta(months=offset)
+            if month in partitions:
+                continue
+            name = SQL.identifier(f'payment_negdi_exchange_y{month.year:04d}m{month.month:02d}')
+            bounds = (str(month), str(month + relativedelta(months=1)))
+            self.env.cr.execute(SQL(
+                "CREATE TABLE %s (LIKE payment_negdi_exchange INCLUDING DEFAULTS)", name
+            ))
+            self.env.cr.execute(SQL("""
+                WITH moved AS (
+                    DELETE FROM payment_negdi_exchange_default
+                          WHERE create_date >= %s AND create_date < %s
+                      RETURNING *
+                )
+                INSERT INTO %s SELECT * FROM moved
+            """, *bounds, name))
+            self.env.cr.execute(SQL(
+                "ALTER TABLE payment_negdi_exchange ATTACH PARTITION %s FOR VALUES FROM (%s) TO (%s)",
+                name, *bounds,
+            ))
+            _logger.info("NEGDi: Created the exchange archive partition of %s.", month)
+
+    @api.model
+    def _drop_partitions(self, before):
+        """ Drop the partitions of the months before a date and the matching default exchanges.
+
+        :param datetime.date before: The first day of the first month to keep.
+        :return: None
+        """
+        for month, name in sorted(self._get_partitions().items()):
+            if month < before:
+                self.env.cr.execute(SQL("DROP TABLE %s", SQL.identifier(name)))
+                _logger.info("NEGDi: Dropped the exchange archive partition of %s.", month)
+        self.env.cr.execute(
+            "DELETE FROM payment_negdi_exchange_default WHERE create_date < %s", [before]
+        )
@@ -0,0 +1,184 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import json
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+from odoo.exceptions import ValidationError
+
+from ..const import NEGDI_FINAL_STATES
+from ..const import NEGDI_INBOX_BATCH_SIZE, NEGDI_INBOX_RETRY_DELAY
+
+
+_logger = logging.getLogger(__name__)
+
+
+class PaymentNEGDiNotification(models.Model):
+    """ Inbox of the notifications received on the NEGDi webhook.
+
+    The webhook only stores the raw payload and acknowledges it; the notifications are processed
+    later, in batches, by `_cron_process_notifications`. Several workers can drain the inbox at
+    the same time as the batches are selected with `FOR UPDATE SKIP LOCKED`.
+    """
+    _name = 'payment.negdi.notification'
+    _description = "NEGDi Webhook Notification"
+    _order = 'id'
+
+    dedupe_key = fields.Char(string="Deduplication Key", required=True, readonly=True)
+    tranid = fields.Char(string="NEGDi Transaction ID", readonly=True, index=True)
+    status = fields.Char(string="NEGDi Status", readonly=True)
+    payload = fields.Json(string="Payload", readonly=True)
+    state = fields.Selection(
+        string="State",
+        selection=[('pending', "Pending"), ('done', "Processed"), ('error', "Failed")],
+        default='pending',
+        required=True,
+        readonly=True,
+        index=True,
+    )
+    processed_at = fields.Datetime(string="Processed At", readonly=True)
+    error_message = fields.Text(string="Error Message", readonly=True)
+
+    _sql_constraints = [
+        ('dedupe_key_uniq', 'unique(dedupe_key)', "This notification was already received."),
+    ]
+
+    #=== BUSINESS METHODS ===#
+
+    @api.model
+    def _enqueue(self, notification_data):
+        """ Store a notification in the inbox, unless the same one was already received.
+
+        The insertion is a single statement bypassing the ORM to keep the webhook as fast as
+        possible; duplicates (same tranid and status) are silently dropped.
+
+        :param dict notification_data: The normalized notification data.
+        :return: Whether the notification was added to the inbox.
+        :rtype: bool
+        """
+        order_data = notification_data['order']
+        tranid = order_data.get('tranid') or order_data.get('ordernum')
+        if not tranid:
+            raise ValidationError("NEGDi: Notification data missing 'tranid' and 'ordernum'.")
+        status = order_data.get('status') or ''
+        self.env['payment.negdi.exchange']._record(
+            'webhook', request_data=notification_data, tranid=tranid,
+            reference=order_data.get('ordernum'), status=status,
+        )
+        self.env.cr.execute("""
+            INSERT INTO payment_negdi_notification
+                        (dedupe_key, tranid, status, payload, state,
+                         create_uid, create_date, write_uid, write_date)
+                 VALUES (%(key)s, %(tranid)s, %(status)s, %(payload)s, 'pending',
+                         %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC')
+            ON CONFLICT (dedupe_key) DO NOTHING
+        """, {
+            'key': f'{tranid}:{status}',
+            'tranid': str(tranid),
+            'status': status,
+            'payload': json.dumps(notification_data),
+            'uid': self.env.uid,
+        })
+        if not self.env.cr.rowcount:
+            return False
+        self.env.ref('payment_negdi.cron_negdi_process_notifications').sudo()._trigger()
+        return True
+
+    @api.model
+    def _cron_process_notifications(self, batch_size=NEGDI_INBOX_BATCH_SIZE):
+        """ Drain the inbox by batches and commit after each of them.
+
+        If notifications were skipped because their transaction was being processed elsewhere, a
+        new run is scheduled shortly after rather than waiting for the next scheduled one.
+
+        :param int batch_size: The number of notifications locked and processed per batch.
+        :return: None
+        """
+        skipped = False
+        while True:
+            batch = self._lock_pending_batch(batch_size)
+            if not batch:
+                break
+            processed_count = batch._process()
+            skipped = skipped or processed_count < len(batch)
+            self.env.cr.commit()
+            if len(batch) < batch_size or not processed_count:
+                break
+        if skipped:
+            self.env.ref('payment_negdi.cron_negdi_process_notifications')._trigger(
+                fields.Datetime.now() + timedelta(seconds=NEGDI_INBOX_RETRY_DELAY)
+            )
+
+        metrics = self._get_inbox_metrics()
+        _logger.info(
+            "NEGDi: Notification inbox drained, %(depth)d pending (lag %(lag).1fs), "
+            "%(errors)d failed.", metrics,
+        )
+
+    @api.model
+    def _lock_pending_batch(self, batch_size):
+        """ Lock and return the oldest pending notifications not locked by another worker. """
+        self.env.cr.execute("""
+            SELECT id
+              FROM payment_negdi_notification
+             WHERE state = 'pending'
+          ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [batch_size])
+        return self.browse(row[0] for row in self.env.cr.fetchall())
+
+    def _process(self):
+        """ Process the notifications on their transactions.
+
+        Notifications whose transaction is being processed by another request or worker are left
+        pending for a later batch.
+
+        :return: The number of notifications processed or failed.
+        :rtype: int
+        """
+        PaymentTransaction = self.env['payment.transaction'].sudo()
+        processed_count = 0
+        for notification in self:
+            values = {'state': 'done', 'processed_at': fields.Datetime.now()}
+            try:
+                with self.env.cr.savepoint():
+                    tx_sudo = PaymentTransaction._get_tx_from_notification_data(
+                        'negdi', notification.payload
+                    )
+                    if tx_sudo.state not in NEGDI_FINAL_STATES:
+                        if not tx_sudo._negdi_lock_for_processing():
+                            # The transaction is being processed elsewhere; retry in a later batch.
+                            continue
+                        tx_sudo._handle_notification_data('negdi', notification.payload)
+            except ValidationError as e:
+                _logger.warning(
+                    "NEGDi: Unable to handle notification %s: %s", notification.dedupe_key, e
+                )
+                values.update(state='error', error_message=str(e))
+            except Exception as e:
+                _logger.exception("NEGDi: Error handling notification %s", notification.dedupe_key)
+                values.update(state='error', error_message=str(e))
+            notification.write(values)
+            processed_count += 1
+        return processed_count
+
+    @api.model
+    def _get_inbox_metrics(self):
+        """ Return the depth of the inbox and the age of its oldest pending notification.
+
+        :return: The `depth` (number of pending notifications), `lag` (age in seconds of the
+                 oldest pending notification) and `errors` (number of failed notifications).
+        :rtype: dict
+        """
+        self.env.cr.execute("""
+            SELECT COUNT(*) FILTER (WHERE state = 'pending'),
+                   COALESCE(EXTRACT(EPOCH FROM (now() at time zone 'UTC')
+                            - MIN(create_date) FILTER (WHERE state = 'pending')), 0),
+                   COUNT(*) FILTER (WHERE state = 'error')
+              FROM payment_negdi_notification
+             WHERE state != 'done'
+        """)
+        depth, lag, errors = self.env.cr.fetchone()
+        return {'depth': depth, 'lag': float(lag), 'errors': errors}
@@ -0,0 +1,47 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import fields, models
+
+
+class PaymentNEGDiRateLimit(models.Model):
+    """ Shared token bucket of a traffic class of NEGDi requests, see `rate_limiter.RateLimiter`.
+
+    The records are created, read and updated with plain SQL in independent transactions by the
+    rate limiters; the model declares the table and lets administrators tune the limits.
+    """
+    _name = 'payment.negdi.rate.limit'
+    _description = "NEGDi Rate Limit"
+    _rec_name = 'traffic_class'
+
+    gateway = fields.Char(string="Gateway", required=True, readonly=True)
+    traffic_class = fields.Selection(
+        string="Traffic Class",
+        selection=[
+            ('checkout', "Checkout"), ('return', "Customer Return"), ('background', "Background"),
+        ],
+        required=True,
+        readonly=True,
+    )
+    rate = fields.Float(
+        string="Requests per Second",
+        help="The rate at which the budget refills. The Background class paces the reconciliation "
+             "of the pending transactions and the batch payment links: lowering it spares the "
+             "gateway but slows them down, e.g. below 11 requests per second, a run of 20,000 "
+             "inquiries lasts longer than the 30-minute interval of the reconciliation.",
+        required=True,
+    )
+    capacity = fields.Integer(string="Burst Capacity", required=True)
+    max_wait = fields.Float(
+        string="Maximum Wait",
+        help="The time in seconds a request waits for the budget to refill before failing.",
+        required=True,
+    )
+    tokens = fields.Float(string="Available Requests", readonly=True)
+    updated_at = fields.Datetime(string="Updated At", readonly=True)
+
+    _sql_constraints = [
+        (
+            'gateway_traffic_class_uniq', 'unique(gateway, traffic_class)',
+            "There can be only one rate limit per gateway and traffic class.",
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import api, fields, models
+
+
+class PaymentNEGDiTerminal(models.Model):
+    """ Merchant terminal of a NEGDi provider, see `routing.TerminalRouter`.
+
+    The new orders of a provider are spread over its active terminals; a provider without
+    terminals uses its own credentials. Terminals are archived rather than deleted, as the
+    inquiries of their transactions keep using their credentials.
+    """
+    _name = 'payment.negdi.terminal'
+    _description = "NEGDi Terminal"
+    _order = 'provider_id, id'
+
+    provider_id = fields.Many2one(
+        string="Provider", comodel_name='payment.provider', required=True, ondelete='cascade'
+    )
+    name = fields.Char(string="Terminal ID", required=True)
+    username = fields.Char(string="Merchant Username", required=True)
+    password = fields.Char(string="Merchant Password", required=True)
+    weight = fields.Integer(
+        string="Weight",
+        help="The share of the orders sent through this terminal, relative to the other "
+             "terminals of the provider, when they are equally fast and reliable.",
+        default=1,
+        required=True,
+    )
+    active = fields.Boolean(string="Active", default=True)
+
+    _sql_constraints = [
+        ('weight_positive', 'CHECK(weight > 0)', "The weight of a terminal must be positive."),
+    ]
+
+    #=== CRUD METHODS ===#
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        terminals = super().create(vals_list)
+        self.env['payment.provider']._negdi_clear_cache()
+        return terminals
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env['payment.provider']._negdi_clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['payment.provider']._negdi_clear_cache()
+        return res
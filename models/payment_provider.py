@@ -1,15 +1,85 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import dataclasses
 import hashlib
 import logging
 
-from odoo import fields, models
+from odoo import _, api, fields, models, tools
+from odoo.exceptions import ValidationError
 
 from .. import const
+from ..client import get_client
+from ..routing import get_router
+from ..controllers.main import NEGDiController
 
 
 _logger = logging.getLogger(__name__)
 
+try:
+    from cryptography.hazmat.primitives import serialization
+except ImportError:
+    serialization = None
+
+
+@dataclasses.dataclass(frozen=True)
+class NEGDiTerminal:
+    """ Credentials of a NEGDi merchant terminal. """
+    id: int  # The id of the `payment.negdi.terminal`, or 0 for the credentials of the provider.
+    terminal_id: str
+    username: str = dataclasses.field(repr=False)
+    password: str = dataclasses.field(repr=False)
+    weight: int = 1
+    active: bool = True
+
+    @property
+    def has_credentials(self):
+        return bool(self.terminal_id and self.username and self.password)
+
+
+@dataclasses.dataclass(frozen=True)
+class NEGDiConfig:
+    """ Snapshot of the configuration of a NEGDi provider used to communicate with NEGDi. """
+    api_url: str
+    create_order_url: str
+    inquiry_order_url: str
+    terminal_id: str
+    username: str = dataclasses.field(repr=False)
+    password: str = dataclasses.field(repr=False)
+    order_type: str
+    pool_size: int
+    connect_timeout: float
+    read_timeout: float
+    inquiry_read_timeout: float
+    retry_budget: float
+    release_order_lock: bool
+    deferred_return: bool
+    precreate_order: bool
+    terminals: tuple  # The terminals of the provider, active or not, see `_negdi_get_config`.
+
+    @property
+    def has_credentials(self):
+        return bool(self.routable_terminals)
+
+    @property
+    def routable_terminals(self):
+        """ The terminals through which new orders can be created. """
+        return tuple(
+            terminal for terminal in self.terminals
+            if terminal.active and terminal.has_credentials
+        )
+
+    def get_terminal(self, terminal_id):
+        """ Return the terminal with the given id, or that of the provider's own credentials.
+
+        :param int terminal_id: The id of the `payment.negdi.terminal`, if any.
+        :return: The terminal.
+        :rtype: NEGDiTerminal
+        """
+        return next(
+            (terminal for terminal in self.terminals if terminal.id == (terminal_id or 0)),
+            NEGDiTerminal(0, self.terminal_id, self.username, self.password),
+        )
+
 
 class PaymentProvider(models.Model):
     _inherit = 'payment.provider'
@@ -40,13 +110,125 @@ class PaymentProvider(models.Model):
         groups='base.group_system',
         # required_if_provider='negdi', # Make required if verification is mandatory
     )
+    negdi_api_url = fields.Char(
+        string="NEGDi Custom API URL",
+        help="The base URL of the NEGDi API to use instead of the test or production one, e.g. "
+             "that of a local NEGDi simulator.",
+        groups='base.group_system',
+    )
+    negdi_release_order_lock = fields.Boolean(
+        string="Release Order Lock Before Calling NEGDi",
+        help="Commit the transaction and release the lock on the sale order before creating the "
+             "NEGDi order, so that a slow gateway does not keep the order locked.",
+    )
+    negdi_deferred_return = fields.Boolean(
+        string="Defer NEGDi Return Inquiry",
+        help="Redirect customers returning from NEGDi to the payment status page immediately and "
+             "check the transaction status with NEGDi in the background.",
+    )
+    negdi_precreate_order = fields.Boolean(
+        string="Pre-create NEGDi Orders",
+        help="Create the NEGDi order in the background as soon as the customer reaches the payment "
+             "step with NEGDi selected, so that paying only redirects them to NEGDi.",
+    )
+    negdi_pool_size = fields.Integer(
+        string="NEGDi Connection Pool Size",
+        help="The maximum number of keep-alive connections kept open to NEGDi by each worker.",
+        default=const.NEGDI_POOL_SIZE,
+    )
+    negdi_connect_timeout = fields.Float(
+        string="NEGDi Connect Timeout",
+        help="The time in seconds to wait for the connection to NEGDi to be established.",
+        default=const.NEGDI_CONNECT_TIMEOUT,
+    )
+    negdi_read_timeout = fields.Float(
+        string="NEGDi Read Timeout",
+        help="The time in seconds to wait for NEGDi to answer an order creation request.",
+        default=const.NEGDI_READ_TIMEOUT,
+    )
+    negdi_inquiry_read_timeout = fields.Float(
+        string="NEGDi Inquiry Read Timeout",
+        help="The time in seconds to wait for NEGDi to answer a transaction status inquiry.",
+        default=const.NEGDI_INQUIRY_READ_TIMEOUT,
+    )
+    negdi_retry_budget = fields.Float(
+        string="NEGDi Retry Budget",
+        help="The maximum time in seconds spent on a request to NEGDi, including the retries of "
+             "the attempts failing because of a network or gateway error. The order creations "
+             "of the customers are never retried for longer than the read timeout.",
+        default=const.NEGDI_RETRY_BUDGET,
+    )
+    negdi_terminal_ids = fields.One2many(
+        string="NEGDi Terminals",
+        comodel_name='payment.negdi.terminal',
+        inverse_name='provider_id',
+        help="The merchant terminals over which the new orders are spread. The credentials of the "
+             "provider are used if none of them is active.",
+        context={'active_test': False},
+        groups='base.group_system',
+    )
+
+
+    #=== CRUD METHODS ===#
+
+    def init(self):
+        super().init()
+        self.env.cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {const.NEGDI_CACHE_VERSION_SEQUENCE}")
+
+    def write(self, vals):
+        res = super().write(vals)
+        if any(provider.code == 'negdi' for provider in self):
+            self._negdi_clear_cache()
+        return res
+
+    #=== CACHE METHODS ===#
+
+    @api.model
+    def _negdi_get_cache_version(self):
+        """ Return the version of the NEGDi entries of the registry cache.
+
+        The configurations and public keys of the providers and the payment method table are
+        cached with this version in their key, so that `_negdi_clear_cache` invalidates them
+        without clearing the whole registry cache, which all the workers would have to rebuild.
+        The version is read once per database transaction.
+
+        :return: The cache version.
+        :rtype: int
+        """
+        data = self.env.cr.precommit.data
+        if 'payment_negdi.cache_version' not in data:
+            self.env.cr.execute(f"SELECT last_value FROM {const.NEGDI_CACHE_VERSION_SEQUENCE}")
+            data['payment_negdi.cache_version'] = self.env.cr.fetchone()[0]
+        return data['payment_negdi.cache_version']
+
+    @api.model
+    def _negdi_clear_cache(self):
+        """ Invalidate the NEGDi entries of the registry cache, see `_negdi_get_cache_version`.
 
+        The version is increased for the current transaction, and again once it is committed so
+        that the other workers do not keep the entries they would build in the meantime from the
+        former values.
+
+        :return: None
+        """
+        cr = self.env.cr
+
+        def increase_version():
+            cr.execute("SELECT nextval(%s)", [const.NEGDI_CACHE_VERSION_SEQUENCE])
+            return cr.fetchone()[0]
+
+        cr.precommit.data['payment_negdi.cache_version'] = increase_version()
+        if 'payment_negdi.cache_version' not in cr.postcommit.data:
+            cr.postcommit.data['payment_negdi.cache_version'] = True
+            cr.postcommit.add(increase_version)
 
     #=== BUSINESS METHODS ===#
 
     def _negdi_get_api_url(self):
         """ Return the API URL according to the provider state. """
         self.ensure_one()
+        if self.sudo().negdi_api_url:
+            return self.sudo().negdi_api_url.rstrip('/')
         if self.state == 'enabled':
             # Assume the URL in spec is TEST. Replace const.NEGDI_ENDPOINT_PROD later.
             # You might want a dedicated field on the provider form to choose test/prod explicitly.
@@ -57,12 +239,143 @@ class PaymentProvider(models.Model):
     def _get_negdi_urls(self):
         """ NEGDi URL getter."""
         self.ensure_one()
-        base_url = self._negdi_get_api_url()
+        config = self._negdi_get_config()
         return {
-            'negdi_create_order_url': f"{base_url}/{const.NEGDI_CREATE_ORDER_ENDPOINT}",
-            'negdi_inquiry_order_url': f"{base_url}/{const.NEGDI_INQUIRY_ORDER_ENDPOINT}", # Add inquiry URL
+            'negdi_create_order_url': config.create_order_url,
+            'negdi_inquiry_order_url': config.inquiry_order_url,
         }
 
+    def _negdi_get_return_url(self):
+        """ Return the URL to which NEGDi redirects the customer after the payment.
+
+        The URL is built on every call from the base URL of the provider, which is that of its
+        website when there is one, so that a change of domain is picked up immediately.
+
+        :return: The return URL.
+        :rtype: str
+        """
+        self.ensure_one()
+        return self.get_base_url() + NEGDiController._return_url
+
+    @tools.ormcache('self.id', 'self._negdi_get_cache_version()')
+    def _negdi_get_config(self):
+        """ Return the snapshot of the configuration of the provider used to communicate with NEGDi.
+
+        The snapshot is built once per registry and invalidated when the provider or one of its
+        terminals is written, so that the requests sent to NEGDi neither read the restricted
+        credential fields nor build the URLs again, and use a consistent configuration. The return
+        URL is not part of it as it depends on the website domain, see `_negdi_get_return_url`.
+
+        :return: The configuration.
+        :rtype: NEGDiConfig
+        """
+        self.ensure_one()
+        provider = self.sudo()
+        api_url = provider._negdi_get_api_url()
+        terminals = tuple(
+            NEGDiTerminal(
+                id=terminal.id,
+                terminal_id=terminal.name,
+                username=terminal.username,
+                password=terminal.password,
+                weight=terminal.weight,
+                active=terminal.active,
+            )
+            for terminal in provider.with_context(active_test=False).negdi_terminal_ids
+        )
+        if not any(terminal.active and terminal.has_credentials for terminal in terminals):
+            # The credentials of the provider act as its single terminal; the archived terminals
+            # are kept for the inquiries of the orders created through them.
+            terminals += (NEGDiTerminal(
+                0, provider.negdi_terminal_identifier, provider.negdi_username,
+                provider.negdi_password,
+            ),)
+        return NEGDiConfig(
+            api_url=api_url,
+            create_order_url=f'{api_url}/{const.NEGDI_CREATE_ORDER_ENDPOINT}',
+            inquiry_order_url=f'{api_url}/{const.NEGDI_INQUIRY_ORDER_ENDPOINT}',
+            terminal_id=provider.negdi_terminal_identifier,
+            username=provider.negdi_username,
+            password=provider.negdi_password,
+            order_type=const.NEGDI_DEFAULT_ORDER_TYPE,
+            pool_size=provider.negdi_pool_size or const.NEGDI_POOL_SIZE,
+            connect_timeout=provider.negdi_connect_timeout or const.NEGDI_CONNECT_TIMEOUT,
+            read_timeout=provider.negdi_read_timeout or const.NEGDI_READ_TIMEOUT,
+            inquiry_read_timeout=(
+                provider.negdi_inquiry_read_timeout or const.NEGDI_INQUIRY_READ_TIMEOUT
+            ),
+            retry_budget=provider.negdi_retry_budget or const.NEGDI_RETRY_BUDGET,
+            release_order_lock=provider.negdi_release_order_lock,
+            deferred_return=provider.negdi_deferred_return,
+            precreate_order=provider.negdi_precreate_order,
+            terminals=terminals,
+        )
+
+    def _negdi_get_client(self):
+        """ Return the pooled API client of the current worker for this provider.
+
+        :return: The client bound to the API base URL of the provider.
+        :rtype: NEGDiClient
+        """
+        self.ensure_one()
+        config = self._negdi_get_config()
+        return get_client(
+            config.api_url,
+            dbname=self.env.cr.dbname,
+            pool_size=config.pool_size,
+            connect_timeout=config.connect_timeout,
+            read_timeout=config.read_timeout,
+            retry_budget=config.retry_budget,
+        )
+
+    def _negdi_select_terminal(self):
+        """ Return the terminal through which the next order of the provider is created.
+
+        See `routing.TerminalRouter` for the selection among several terminals.
+
+        :return: The terminal.
+        :rtype: NEGDiTerminal
+        :raise ValidationError: If the provider has no terminal with credentials.
+        """
+        self.ensure_one()
+        terminals = self._negdi_get_config().routable_terminals
+        if not terminals:
+            raise ValidationError(_("The NEGDi payment provider is missing required credentials."))
+        if len(terminals) == 1:
+            return terminals[0]
+        return self._negdi_get_router().pick(terminals)
+
+    def _negdi_get_router(self):
+        """ Return the terminal router of the current worker.
+
+        :return: The router.
+        :rtype: TerminalRouter
+        """
+        return get_router(self.env.cr.dbname)
+
+    @tools.ormcache('self.id', 'self._negdi_get_cache_version()')
+    def _negdi_get_public_key(self):
+        """ Return the parsed NEGDi public key of the provider, if configured.
+
+        The parsed key is cached per registry and invalidated when the public key is written, so
+        that verifying a notification does not parse the PEM again.
+
+        :return: The public key, or None if not configured.
+        :rtype: cryptography.hazmat.primitives.asymmetric.rsa.RSAPublicKey
+        :raise ValidationError: If the key cannot be loaded.
+        """
+        self.ensure_one()
+        public_key_pem = self.sudo().negdi_public_key
+        if not public_key_pem:
+            return None
+        if serialization is None:
+            raise ValidationError(_("Signature verification requires the 'cryptography' library."))
+        try:
+            return serialization.load_pem_public_key(public_key_pem.encode('utf-8'))
+        except ValueError as e:
+            _logger.error("NEGDi: Unable to load the public key of provider %s: %s", self.id, e)
+            raise ValidationError(_("The NEGDi Public Key is invalid."))
+
     def _negdi_calculate_signature(self, data, incoming=True):
         """ Compute the signature for the provided data according to the NEGDi documentation.
 
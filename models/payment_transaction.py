@@ -1,9 +1,14 @@
 # payment_negdi/models/payment_transaction.py
 
 import logging
-import pprint
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import timedelta
 import json # Import json
-import base64 # For signature verification later
+import base64
+import binascii
+import psycopg2
 import requests # Import requests
 from requests.exceptions import RequestException # Import specific exceptions
 
@@ -11,12 +16,28 @@ from werkzeug import urls
 
 from odoo import _, api, models, fields
 from odoo.exceptions import UserError,ValidationError
+from odoo.fields import Command
+from odoo.tools import sql
 from odoo.addons.payment import utils as payment_utils
 
+from .. import metrics as negdi_metrics
+from .. import settlement as negdi_settlement
 from .. import utils as negdi_utils
-from ..const import PAYMENT_STATUS_MAPPING
-from ..const import NEGDI_DEFAULT_ORDER_TYPE
+from ..const import NEGDI_CREATE_ORDER_ENDPOINT
+from ..const import NEGDI_INQUIRY_ORDER_ENDPOINT
+from ..const import NEGDI_DEFERRED_INQUIRY_BATCH_SIZE
+from ..const import NEGDI_FINAL_STATES
+from ..const import NEGDI_INQUIRY_CHUNK_SIZE
+from ..const import NEGDI_INQUIRY_MAX_WORKERS
+from ..const import NEGDI_ORDER_MAX_WORKERS
+from ..const import NEGDI_PAYMENT_URL_VALIDITY
+from ..const import NEGDI_RECONCILE_LIMIT
+from ..const import NEGDI_RECONCILE_MAX_AGE
+from ..const import NEGDI_RECONCILE_MIN_AGE
+from ..const import NEGDI_SETTLEMENT_CHUNK_SIZE
+from ..const import NEGDI_STATUS_NOTIFICATION
 from ..controllers.main import NEGDiController
+from ..rate_limiter import RateLimitError
 
 
 
@@ -27,7 +48,6 @@ _logger.info("***** payment_negdi PaymentTransaction Model File Loaded *****") #
 try:
     from cryptography.hazmat.primitives import hashes
     from cryptography.hazmat.primitives.asymmetric import padding
-    from cryptography.hazmat.primitives import serialization
     from cryptography.exceptions import InvalidSignature
     SIGNATURE_VERIFICATION_SUPPORTED = True
 except ImportError:
@@ -42,10 +62,87 @@ class PaymentTransaction(models.Model):
         readonly=True, # Usually set by the system, not user
         copy=False,
         groups="base.group_user", # Adjust group visibility if needed
+        index='btree_not_null',
         help="Technical field storing the Check ID returned by NEGDi during transaction creation."
     )
+    negdi_payment_url = fields.Char(
+        string="NEGDi Payment URL",
+        readonly=True,
+        copy=False,
+        help="Technical field storing the URL of the NEGDi payment page of the transaction.",
+    )
+    negdi_precreated = fields.Boolean(
+        string="NEGDi Pre-created",
+        readonly=True,
+        copy=False,
+        help="Technical field set on the transactions whose NEGDi order was created while the "
+             "customer was on the payment step and that were not handed to them yet.",
+    )
+    negdi_idempotency_key = fields.Char(
+        string="NEGDi Idempotency Key",
+        readonly=True,
+        copy=False,
+        index='btree_not_null',
+        help="Technical field storing the key sent by the payment form with the payment request "
+             "that created the transaction, so that repeating the request reuses it.",
+    )
+    negdi_terminal_id = fields.Many2one(
+        string="NEGDi Terminal",
+        comodel_name='payment.negdi.terminal',
+        readonly=True,
+        copy=False,
+        ondelete='restrict',
+        index='btree_not_null',
+        help="The terminal through which the NEGDi order was created, whose credentials are used "
+             "to inquire about it. Not set if the credentials of the provider were used.",
+    )
+    negdi_approval_code = fields.Char(
+        string="NEGDi Approval Code",
+        readonly=True,
+        copy=False,
+        help="The approval code of the card issuer received with the NEGDi result of the payment.",
+    )
+    negdi_inquiry_requested_at = fields.Datetime(
+        string="NEGDi Inquiry Requested At",
+        readonly=True,
+        copy=False,
+        index='btree_not_null',
+        help="Technical field set when the customer returned from NEGDi and the status inquiry "
+             "was deferred to the background worker.",
+    )
+
+    def init(self):
+        """ Guarantee that a NEGDi tranid identifies a single transaction.
 
+        NEGDi transactions are the only ones with a `negdi_check_id`, which allows a partial
+        index restricted to them; `provider_code` is not stored and cannot be part of it. The
+        index also serves the tranid lookups of the return route and the notifications.
+        """
+        super().init()
+        if sql.index_exists(self.env.cr, 'payment_transaction_negdi_tranid_uniq'):
+            return
+        self.env.cr.execute("""
+            SELECT provider_reference
+              FROM payment_transaction
+             WHERE negdi_check_id IS NOT NULL
+          GROUP BY provider_reference
+            HAVING COUNT(*) > 1
+             LIMIT 10
+        """)
+        duplicates = [row[0] for row in self.env.cr.fetchall()]
+        if duplicates:
+            _logger.warning(
+                "NEGDi: Cannot enforce unique tranids, duplicated tranids found: %s. A non-unique"
+                " index is created instead.", duplicates,
+            )
+        self.env.cr.execute(f"""
+            CREATE {'' if duplicates else 'UNIQUE'} INDEX IF NOT EXISTS
+                   payment_transaction_negdi_tranid_uniq
+                ON payment_transaction (provider_reference)
+             WHERE negdi_check_id IS NOT NULL
+        """)
 
+    # === CRUD METHODS === #
 
     @api.model
     def _compute_reference(self, provider_code, prefix=None, separator='-', **kwargs):
@@ -68,27 +165,122 @@ class PaymentTransaction(models.Model):
 
         return super()._compute_reference(provider_code, prefix=prefix, separator=separator, **kwargs)
 
+    # === ACTION METHODS === #
+    def action_view_negdi_exchanges(self):
+        """ Return the action showing the archived NEGDi exchanges of the transaction.
+
+        :return: The exchanges list action.
+        :rtype: dict
+        """
+        self.ensure_one()
+        domain = [('reference', '=', self.reference)]
+        if self.provider_reference:
+            domain = ['|', ('tranid', '=', self.provider_reference), *domain]
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _("NEGDi Exchanges"),
+            'res_model': 'payment.negdi.exchange',
+            'view_mode': 'list,form',
+            'domain': domain,
+        }
+
     # === Helper to make API Call (Keep this method) ===
     def _negdi_make_ec1000_request(self):
-        # ... (Keep the full implementation of this method from previous versions) ...
-        # It should perform the requests.post call and return the negdi_url
-        # Ensure it handles errors correctly (logging and raising ValidationError)
+        """ Create the NEGDi order of the transaction and return the URL of the payment page.
+
+        :return: The `negdiurl` to redirect the customer to.
+        :rtype: str
+        :raise ValidationError: If the order could not be created; the transaction is set in error.
+        """
         self.ensure_one()
         if self.provider_code != 'negdi':
              # Should not happen if called correctly, but good practice
              return None
 
-        provider = self.provider_id
-        if not all([provider.negdi_terminal_identifier, provider.negdi_username, provider.negdi_password]):
+        payload = self._negdi_prepare_ec1000_payload()
+        return self._negdi_send_ec1000_request(payload)
+
+    @api.model
+    def _negdi_get_idempotent_transaction(self, idempotency_key, sale_order, provider_id):
+        """ Return the draft transaction created by an earlier request with the same key, if any.
+
+        The transaction is only returned if it was created for the current amount and currency of
+        the sale order with the same provider less than `NEGDI_PAYMENT_URL_VALIDITY` minutes ago.
+        Its `negdi_payment_url` is not set yet if the earlier request is still waiting for NEGDi.
+
+        :param str idempotency_key: The key sent by the payment form.
+        :param recordset sale_order: The sale order to pay, as a `sale.order` record.
+        :param int provider_id: The provider selected by the customer.
+        :return: The transaction to pay, if any.
+        :rtype: recordset of `payment.transaction`
+        """
+        expiry = fields.Datetime.now() - timedelta(minutes=NEGDI_PAYMENT_URL_VALIDITY)
+        txs = self.search([
+            ('negdi_idempotency_key', '=', idempotency_key),
+            ('sale_order_ids', 'in', sale_order.ids),
+            ('provider_id', '=', provider_id),
+            ('state', '=', 'draft'),
+            ('create_date', '>=', expiry),
+        ], order='id desc')
+        return txs.filtered(
+            lambda tx: tx.currency_id == sale_order.currency_id
+            and not tx.currency_id.compare_amounts(tx.amount, sale_order.amount_total)
+        )[:1]
+
+    @api.model
+    def _negdi_get_precreated_transaction(self, sale_order, provider_id, payment_method_id):
+        """ Return the draft transaction whose NEGDi order can still be used to pay the sale order.
+
+        Only the pre-created transactions that were not handed to the customer yet are considered,
+        as the customer may be paying the others on the NEGDi payment page. A NEGDi order is
+        reusable if it was created for the current amount and currency of the order, with the same
+        provider and payment method, less than `NEGDI_PAYMENT_URL_VALIDITY` minutes ago. The other
+        pre-created NEGDi orders of the sale order are discarded by canceling their transaction.
+
+        :param recordset sale_order: The sale order to pay, as a `sale.order` record.
+        :param int provider_id: The provider selected by the customer.
+        :param int payment_method_id: The payment method selected by the customer.
+        :return: The reusable transaction, if any.
+        :rtype: recordset of `payment.transaction`
+        """
+        txs = self.search([
+            ('sale_order_ids', 'in', sale_order.ids),
+            ('provider_id', '=', provider_id),
+            ('state', '=', 'draft'),
+            ('negdi_precreated', '=', True),
+            ('negdi_payment_url', '!=', False),
+        ], order='id desc')
+        expiry = fields.Datetime.now() - timedelta(minutes=NEGDI_PAYMENT_URL_VALIDITY)
+        reusable_tx = txs.filtered(
+            lambda tx: tx.payment_method_id.id == payment_method_id
+            and tx.currency_id == sale_order.currency_id
+            and not tx.currency_id.compare_amounts(tx.amount, sale_order.amount_total)
+            and tx.create_date >= expiry
+        )[:1]
+        if stale_txs := txs - reusable_tx:
+            _logger.info(
+                "NEGDi: Discarding the pre-created orders of txs %s.", stale_txs.mapped('reference')
+            )
+            stale_txs._set_canceled(state_message=_("The order was updated before the payment."))
+        return reusable_tx
+
+    def _negdi_prepare_ec1000_payload(self):
+        """ Build the ec1000 payload of the transaction.
+
+        This step reads everything the request needs from the database, so that the call itself
+        (see `_negdi_send_ec1000_request`) can be made after the current transaction is committed.
+
+        :return: The ec1000 payload.
+        :rtype: dict
+        :raise ValidationError: If the provider credentials are missing.
+        """
+        self.ensure_one()
+        config = self.provider_id._negdi_get_config()
+        if not config.has_credentials:
              self._set_error(_("Configuration error: NEGDi credentials missing."))
              raise ValidationError(_("The NEGDi payment provider is missing required credentials."))
-
-        api_urls = provider._get_negdi_urls()
-        api_url = api_urls.get('negdi_create_order_url')
-        if not api_url:
-             self._set_error(_("Configuration error: NEGDi Create Order URL missing."))
-             raise ValidationError("NEGDi: Provider not configured correctly (missing URL).")
-        
+        terminal = self.provider_id._negdi_select_terminal()
+        self.negdi_terminal_id = terminal.id or False
 
         # --- Determine the description ---
         # Use the name of the first linked Sale Order if available,
@@ -103,112 +295,828 @@ class PaymentTransaction(models.Model):
             _logger.info("NEGDi: No linked Sale Order found for tx %s, using reference '%s'", self.reference, ordernum)
         # --- End Determine description ---
 
-        payload = {
-            'ordertype': NEGDI_DEFAULT_ORDER_TYPE,
-            'terminalid': provider.negdi_terminal_identifier,
-            'username': provider.negdi_username,
-            'password': provider.negdi_password,
-            # Ensure get_base_url() is available or construct appropriately
-            'returnurl': self.get_base_url() + '/payment/negdi/return',
+        return {
+            'ordertype': config.order_type,
+            'terminalid': terminal.terminal_id,
+            'username': terminal.username,
+            'password': terminal.password,
+            'returnurl': self.provider_id._negdi_get_return_url(),
             'amount': self.amount,
             'currency': self.currency_id.name,
             'ordernum': ordernum,
             'description': self.reference,
         }
 
-        _logger.info("NEGDi: Sending ec1000 request for %s to %s:\n%s", self.reference, api_url, pprint.pformat(payload))
-        headers = {'Content-Type': 'application/json'}
-        try:
-            response = requests.post(api_url, headers=headers, json=payload, timeout=60)
-            response.raise_for_status()
-            response_data = response.json()
-            _logger.info("NEGDi: Received ec1000 response for %s:\n%s", self.reference, pprint.pformat(response_data))
-
-            order_data = response_data.get('order', {})
-            negdi_url = order_data.get('negdiurl')
+    def _negdi_send_ec1000_request(self, payload):
+        """ Send the ec1000 request and save the created NEGDi order on the transaction.
 
-            if not negdi_url:
-                 _logger.error("NEGDi: 'negdiurl' not found in response for %s.", self.reference)
-                 self._set_error(_("NEGDi: Payment URL missing in API response."))
-                 raise ValidationError(_("NEGDi: Could not get payment URL. Please try again."))
+        A request failing transiently is retried by the client with the same payload, and thus the
+        same `ordernum`, see `NEGDiClient.post`.
 
-            # Store tranid/checkid if needed later for verification/inquiry
+        :param dict payload: The payload returned by `_negdi_prepare_ec1000_payload`.
+        :return: The `negdiurl` to redirect the customer to.
+        :rtype: str
+        :raise ValidationError: If the order could not be created; the transaction is set in error.
+        """
+        self.ensure_one()
+        client = self.provider_id._negdi_get_client()
+        api_url = client.get_url(NEGDI_CREATE_ORDER_ENDPOINT)
+        negdi_utils.log_event(_logger, 'ec1000.request', payload, reference=self.reference, url=api_url)
+        try:
+            response_data = self.provider_id._negdi_get_router().call(
+                self.negdi_terminal_id.id, client.post, NEGDI_CREATE_ORDER_ENDPOINT, payload
+            )
+        except Exception as e:  # Mapped to the error shown to the customer.
+            self._negdi_archive_exchange('ec1000', payload, error=e)
+            raise self._negdi_handle_ec1000_error(e)
+        self._negdi_archive_exchange('ec1000', payload, response_data)
 
-            self.provider_reference = order_data.get('tranid')
-            # Example: Store checkid in metadata (adjust if needed)
-            checkid = order_data.get('checkid')
-            if checkid:
-                self.negdi_check_id = checkid
+        values = self._negdi_get_ec1000_values(response_data)
+        self.write(values)
+        return values['negdi_payment_url']
 
-            return negdi_url
+    def _negdi_handle_ec1000_error(self, error):
+        """ Set the transaction in error after a failed ec1000 request.
 
-        except requests.exceptions.Timeout:
+        :param Exception error: The error raised by the request.
+        :return: The error to show to the customer.
+        :rtype: ValidationError
+        """
+        self.ensure_one()
+        if isinstance(error, requests.exceptions.Timeout):
             _logger.warning("NEGDi: Timeout during API request for %s", self.reference)
             self._set_error(_("NEGDi: Communication timeout."))
-            raise ValidationError(_("The payment provider timed out. Please try again."))
-        except requests.exceptions.RequestException as e:
-            _logger.error("NEGDi: API request failed for %s: %s", self.reference, e)
-            self._set_error(_("NEGDi: Communication error: %s", e))
-            raise ValidationError(_("Could not connect to the payment provider. Please try again."))
-        except json.JSONDecodeError as e:
-            _logger.error("NEGDi: Failed to decode JSON response for %s: %s", self.reference, e)
+            return ValidationError(_("The payment provider timed out. Please try again."))
+        if isinstance(error, RateLimitError):
+            _logger.warning("NEGDi: Order of %s rejected by the rate limit.", self.reference)
+            self._set_error(_("NEGDi: Too many requests."))
+            return ValidationError(_("The payment provider is busy. Please try again in a moment."))
+        if isinstance(error, json.JSONDecodeError):  # Includes that of `requests`.
+            _logger.error("NEGDi: Failed to decode JSON response for %s: %s", self.reference, error)
             self._set_error(_("NEGDi: Invalid response received."))
-            raise ValidationError(_("Received an invalid response from the payment provider."))
-        except Exception as e:
-            _logger.error("NEGDi: Unexpected error during API request for %s: %s", self.reference, e, exc_info=True)
-            self._set_error(_("NEGDi: Unexpected error: %s", e))
-            raise ValidationError(_("An unexpected error occurred."))
+            return ValidationError(_("Received an invalid response from the payment provider."))
+        if isinstance(error, requests.exceptions.RequestException):
+            _logger.error("NEGDi: API request failed for %s: %s", self.reference, error)
+            self._set_error(_("NEGDi: Communication error: %s", error))
+            return ValidationError(_("Could not connect to the payment provider. Please try again."))
+        _logger.error(
+            "NEGDi: Unexpected error during API request for %s: %s", self.reference, error,
+            exc_info=error,
+        )
+        self._set_error(_("NEGDi: Unexpected error: %s", error))
+        return ValidationError(_("An unexpected error occurred."))
 
-    def _negdi_make_inquiry_request(self, check_id):
-        """ Makes the server-to-server request to NEGDi's ec1098 endpoint. """
+    def _negdi_get_ec1000_values(self, response_data):
+        """ Return the values to save on the transaction from the ec1000 response.
+
+        :param dict response_data: The ec1000 response.
+        :return: The `provider_reference`, `negdi_check_id` and `negdi_payment_url` values.
+        :rtype: dict
+        :raise ValidationError: If the response has no payment URL, tranid or checkid; the
+                                transaction is set in error.
+        """
         self.ensure_one()
-        provider = self.provider_id
-        if not all([provider.negdi_terminal_identifier, provider.negdi_username, provider.negdi_password]):
-             # Don't set error here, just raise validation for calling method
-             raise ValidationError(_("Cannot perform inquiry: NEGDi credentials missing."))
+        order_data = response_data.get('order', {})
+        negdi_utils.log_event(
+            _logger, 'ec1000.response', response_data, reference=self.reference,
+            tranid=order_data.get('tranid'),
+        )
+        negdi_url = order_data.get('negdiurl')
 
-        api_urls = provider._get_negdi_urls()
-        inquiry_url = api_urls.get('negdi_inquiry_order_url')
-        if not inquiry_url:
-             raise ValidationError("Cannot perform inquiry: NEGDi Inquiry URL missing.")
+        if not negdi_url:
+             _logger.error("NEGDi: 'negdiurl' not found in response for %s.", self.reference)
+             self._set_error(_("NEGDi: Payment URL missing in API response."))
+             raise ValidationError(_("NEGDi: Could not get payment URL. Please try again."))
+        # The checkid identifies the NEGDi transactions, see `_negdi_search_by_tranid`.
+        if not order_data.get('tranid') or not order_data.get('checkid'):
+             _logger.error("NEGDi: 'tranid' or 'checkid' not found in response for %s.", self.reference)
+             self._set_error(_("NEGDi: Transaction identifiers missing in API response."))
+             raise ValidationError(_("NEGDi: Could not create the payment. Please try again."))
 
-        if not self.provider_reference:
-             raise ValidationError("Cannot perform inquiry: Transaction is missing the NEGDi tranid (provider_reference).")
-        if not check_id:
-             raise ValidationError("Cannot perform inquiry: Check ID is missing.")
+        # Store tranid/checkid for the inquiry made when the customer returns
+        return {
+            'provider_reference': order_data['tranid'],
+            'negdi_check_id': order_data['checkid'],
+            'negdi_payment_url': negdi_url,
+        }
 
-        payload = {
-            # Payload for ec1098 (based on Page 13)
-            'tranid': int(self.provider_reference), # Ensure it's an integer if required by API
-            'checkid': check_id,
-            # Add username/password if required by ec1098 API (spec doesn't show them here, but maybe needed)
-            # 'username': provider.negdi_username,
-            # 'password': provider.negdi_password,
+    def _negdi_create_orders(self, max_workers=NEGDI_ORDER_MAX_WORKERS):
+        """ Create the NEGDi orders of the transactions concurrently, e.g. to send payment links.
+
+        The payloads are built and the responses are processed in the current thread, as the
+        environment is not thread-safe; only the ec1000 requests run in the thread pool. The
+        created orders are saved on the transactions in a single flush. A failed order does not
+        prevent the others from being created: its transaction is set in error.
+
+        :param int max_workers: The maximum number of concurrent ec1000 requests.
+        :return: The result of each transaction, by id: the `url` of the NEGDi payment page, or the
+                 `error` message.
+        :rtype: dict
+        """
+        results = {}
+        payloads = {}
+        for tx in self:
+            try:
+                payloads[tx] = tx._negdi_prepare_ec1000_payload()
+            except ValidationError as e:
+                results[tx.id] = {'error': e.args[0]}
+        clients = {provider: provider._negdi_get_client() for provider in self.provider_id}
+        router = self.provider_id[:1]._negdi_get_router()
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='negdi_ec1000') as executor:
+            futures = {
+                executor.submit(
+                    router.call, tx.negdi_terminal_id.id,
+                    clients[tx.provider_id].post, NEGDI_CREATE_ORDER_ENDPOINT, payload,
+                    traffic_class='background',
+                ): tx
+                for tx, payload in payloads.items()
+            }
+            for future in as_completed(futures):
+                tx = futures[future]
+                error = future.exception()
+                tx._negdi_archive_exchange(
+                    'ec1000', payloads[tx], None if error else future.result(), error
+                )
+                if error:
+                    results[tx.id] = {'error': tx._negdi_handle_ec1000_error(error).args[0]}
+                    continue
+                response_data = future.result()
+                try:
+                    values = tx._negdi_get_ec1000_values(response_data)
+                except ValidationError as e:
+                    results[tx.id] = {'error': e.args[0]}
+                    continue
+                tx.update(values)  # Written with the other transactions when flushing.
+                results[tx.id] = {'url': values['negdi_payment_url']}
+        self.flush_recordset()
+        return results
+
+    @api.model
+    def _negdi_create_payment_links(self, documents):
+        """ Create a NEGDi transaction and order for the amount due of each document.
+
+        :param recordset documents: The invoices or sale orders to pay, as `account.move` or
+                                    `sale.order` records.
+        :return: The created transactions, and the result of each document, by id: the `url` of
+                 the NEGDi payment page, or the `error` message.
+        :rtype: tuple
+        """
+        results = {}
+        vals_list = []
+        providers = {}
+        for document in documents:
+            company = document.company_id
+            if company not in providers:
+                providers[company] = self.env['payment.provider'].sudo().search([
+                    ('code', '=', 'negdi'),
+                    ('state', '!=', 'disabled'),
+                    ('company_id', '=', company.id),
+                ], limit=1)
+            provider = providers[company]
+            if document._name == 'account.move':
+                amount, partner = document.amount_residual, document.partner_id
+                link_values = {'invoice_ids': [Command.set(document.ids)]}
+            else:
+                amount = document.amount_total - document.amount_paid
+                partner = document.partner_invoice_id
+                link_values = {'sale_order_ids': [Command.set(document.ids)]}
+            if not provider:
+                results[document.id] = {'error': _("No NEGDi provider is enabled for %s.", company.name)}
+            elif document.currency_id.compare_amounts(amount, 0) <= 0:
+                results[document.id] = {'error': _("There is nothing to pay.")}
+            else:
+                vals_list.append(({
+                    'provider_id': provider.id,
+                    'payment_method_id': provider.payment_method_ids.filtered('active')[:1].id,
+                    'amount': amount,
+                    'currency_id': document.currency_id.id,
+                    'partner_id': partner.id,
+                    'operation': 'online_redirect',
+                    **link_values,
+                }, link_values))
+        txs = self.sudo().browse()
+        for vals, link_values in vals_list:
+            # The transactions are created one by one so that each reference is computed once the
+            # previous ones exist, as the NEGDi references of the same second share their prefix.
+            txs |= self.sudo().create(
+                dict(vals, reference=self._compute_reference('negdi', **link_values))
+            )
+        tx_results = txs._negdi_create_orders()
+        for tx in txs:
+            results[(tx.invoice_ids or tx.sale_order_ids).id] = tx_results[tx.id]
+        _logger.info(
+            "NEGDi: Created %d payment links out of %d documents.",
+            sum('url' in result for result in results.values()), len(documents),
+        )
+        return txs, results
+
+    @api.model
+    def _negdi_action_create_payment_links(self, documents):
+        """ Create the NEGDi payment links of the documents and return the action showing them.
+
+        :param recordset documents: The invoices or sale orders to pay.
+        :return: The action opening the created transactions, preceded by a notification listing
+                 the documents whose link could not be created, if any.
+        :rtype: dict
+        """
+        txs, results = self._negdi_create_payment_links(documents)
+        action = {
+            'type': 'ir.actions.act_window',
+            'name': _("NEGDi Payment Links"),
+            'res_model': 'payment.transaction',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', txs.ids)],
+            'context': {'create': False},
+        }
+        errors = [
+            f"{document.display_name}: {results[document.id]['error']}"
+            for document in documents if 'error' in results[document.id]
+        ]
+        if not errors:
+            return action
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Some payment links could not be created"),
+                'message': '\n'.join(errors),
+                'type': 'warning',
+                'sticky': True,
+                'next': action,
+            },
         }
 
-        _logger.info("NEGDi: Sending ec1098 Inquiry request for %s (tranid: %s):\n%s",
-                     self.reference, self.provider_reference, pprint.pformat(payload))
-        headers = {'Content-Type': 'application/json'}
+    def _negdi_make_inquiry_request(self, check_id, traffic_class='background'):
+        """ Makes the server-to-server request to NEGDi's ec1098 endpoint.
+
+        :param str check_id: The checkid of the NEGDi order.
+        :param str traffic_class: The rate limit class of the request, see `const.NEGDI_RATE_LIMITS`.
+        :return: The ec1098 response.
+        :rtype: dict
+        :raise RateLimitError: If the rate limit of the traffic class is reached.
+        :raise ValidationError: If the inquiry failed.
+        """
+        self.ensure_one()
+        client = self.provider_id._negdi_get_client()
+        payload = self._negdi_prepare_inquiry_payload(check_id)
+
+        negdi_utils.log_event(
+            _logger, 'ec1098.request', payload, reference=self.reference,
+            tranid=self.provider_reference,
+        )
         try:
-            response = requests.post(inquiry_url, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()
-            response_data = response.json()
-            _logger.info("NEGDi: Received ec1098 Inquiry response for %s:\n%s",
-                         self.reference, pprint.pformat(response_data))
+            try:
+                response_data = client.post(
+                    NEGDI_INQUIRY_ORDER_ENDPOINT, payload,
+                    read_timeout=self.provider_id._negdi_get_config().inquiry_read_timeout,
+                    traffic_class=traffic_class,
+                )
+            except Exception as e:
+                self._negdi_archive_exchange('ec1098', payload, error=e)
+                raise
+            self._negdi_archive_exchange('ec1098', payload, response_data)
+            negdi_utils.log_event(
+                _logger, 'ec1098.response', response_data, reference=self.reference,
+                status=(response_data.get('order') or {}).get('status'),
+            )
             return response_data # Return the full response data
-        except Timeout:
+        except RateLimitError:
+            _logger.warning("NEGDi: Inquiry of %s delayed by the rate limit.", self.reference)
+            raise
+        except requests.exceptions.Timeout:
             _logger.warning("NEGDi: Timeout during Inquiry API request for %s", self.reference)
             raise ValidationError(_("NEGDi: Communication timeout during status check."))
+        except json.JSONDecodeError as e:  # Includes that of `requests`.
+            _logger.error("NEGDi: Failed to decode Inquiry JSON response for %s: %s", self.reference, e)
+            raise ValidationError(_("Received an invalid response during status check."))
         except RequestException as e:
             _logger.error("NEGDi: Inquiry API request failed for %s: %s", self.reference, e)
             raise ValidationError(_("NEGDi: Communication error during status check: %s", e))
-        except json.JSONDecodeError as e:
-            _logger.error("NEGDi: Failed to decode Inquiry JSON response for %s: %s", self.reference, e)
-            raise ValidationError(_("Received an invalid response during status check."))
         except Exception as e:
             _logger.error("NEGDi: Unexpected error during Inquiry API request for %s: %s", self.reference, e, exc_info=True)
             raise ValidationError(_("An unexpected error occurred during status check."))
 
+    def _negdi_prepare_inquiry_payload(self, check_id):
+        """ Build the ec1098 payload of the transaction.
+
+        :param str check_id: The checkid of the NEGDi order.
+        :return: The ec1098 payload.
+        :rtype: dict
+        :raise ValidationError: If the credentials, the tranid or the checkid are missing.
+        """
+        self.ensure_one()
+        # Inquire with the credentials of the terminal through which the order was created.
+        terminal = self.provider_id._negdi_get_config().get_terminal(self.negdi_terminal_id.id)
+        if not terminal.has_credentials:
+             # Don't set error here, just raise validation for calling method
+             raise ValidationError(_("Cannot perform inquiry: NEGDi credentials missing."))
+        if not self.provider_reference:
+             raise ValidationError("Cannot perform inquiry: Transaction is missing the NEGDi tranid (provider_reference).")
+        if not check_id:
+             raise ValidationError("Cannot perform inquiry: Check ID is missing.")
+
+        return {
+            # Payload for ec1098 (based on Page 13)
+            'tranid': int(self.provider_reference), # Ensure it's an integer if required by API
+            'checkid': check_id,
+            'terminalid': terminal.terminal_id,
+            'username': terminal.username,
+            'password': terminal.password,
+        }
+
+    def _negdi_run_inquiries(self, max_workers=NEGDI_INQUIRY_MAX_WORKERS, chunk_size=NEGDI_INQUIRY_CHUNK_SIZE):
+        """ Make the ec1098 inquiries of the transactions concurrently and process the responses.
+
+        Only the HTTP calls run in the thread pool; the payloads are built and the responses are
+        processed in the current thread, as the environment is not thread-safe. Transactions are
+        submitted through a sliding window of `2 * max_workers` in-flight inquiries and their
+        responses are verified as soon as they arrive, so a slow inquiry only holds one thread.
+        The verified results are applied together every `chunk_size` transactions, see
+        `_negdi_apply_results`, and committed once all the inquiries of the chunk are processed.
+
+        :param int max_workers: The maximum number of concurrent inquiries.
+        :param int chunk_size: The number of processed transactions between two commits.
+        Transactions already final or being processed elsewhere are skipped without an inquiry,
+        see `_negdi_lock_for_processing`.
+
+        :return: The run statistics: `processed`, `skipped`, `failed`, the failures by `errors`
+                 type, `duration` in seconds and `throughput` in transactions per second.
+        :rtype: dict
+        """
+        stats = {'processed': 0, 'skipped': 0, 'failed': 0, 'errors': defaultdict(int)}
+        start = time.monotonic()
+        txs_to_submit = iter(self)
+        clients = {}
+        results = []  # The verified (transaction, order result) pairs not applied yet
+
+        def apply_results():
+            if not results:
+                return
+            try:
+                with self.env.cr.savepoint():
+                    self.browse(tx.id for tx, _order_data in results)._negdi_apply_results(
+                        [order_data for _tx, order_data in results]
+                    )
+                stats['processed'] += len(results)
+            except Exception:
+                # Apply the results one by one to isolate the failing ones.
+                for tx, order_data in results:
+                    try:
+                        with self.env.cr.savepoint():
+                            tx._negdi_apply_results([order_data])
+                        stats['processed'] += 1
+                    except Exception:
+                        stats['failed'] += 1
+                        stats['errors']['processing'] += 1
+                        _logger.exception("NEGDi: Error processing the inquiry of tx %s", tx.reference)
+            results.clear()
+
+        def submit_next(executor, futures):
+            for tx in txs_to_submit:
+                if not tx._negdi_lock_for_processing():
+                    stats['skipped'] += 1
+                    continue
+                try:
+                    payload = tx._negdi_prepare_inquiry_payload(tx.negdi_check_id)
+                except ValidationError as e:
+                    _logger.warning("NEGDi: Cannot reconcile tx %s: %s", tx.reference, e)
+                    stats['failed'] += 1
+                    stats['errors']['configuration'] += 1
+                    continue
+                provider = tx.provider_id
+                if provider.id not in clients:
+                    clients[provider.id] = (
+                        provider._negdi_get_client(), provider._negdi_get_config().inquiry_read_timeout
+                    )
+                client, read_timeout = clients[provider.id]
+                future = executor.submit(
+                    client.post, NEGDI_INQUIRY_ORDER_ENDPOINT, payload, read_timeout=read_timeout
+                )
+                futures[future] = tx, payload
+                return True
+            return False
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='negdi_inquiry') as executor:
+            futures = {}
+            submitted = 0  # The transactions locked since the last commit
+            exhausted = False
+            while True:
+                # The commit releases the locks of the transactions: the window is drained before
+                # committing a complete chunk, so that no inquiry is in flight at that time.
+                while not exhausted and len(futures) < 2 * max_workers and submitted < chunk_size:
+                    if submit_next(executor, futures):
+                        submitted += 1
+                    else:
+                        exhausted = True
+                if not futures:
+                    apply_results()
+                    self.env.cr.commit()
+                    submitted = 0
+                    if exhausted:
+                        break
+                    continue
+                done, _not_done = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tx, payload = futures.pop(future)
+                    error = future.exception()
+                    tx._negdi_archive_exchange(
+                        'ec1098', payload, None if error else future.result(), error
+                    )
+                    try:
+                        response_data = future.result()
+                        with self.env.cr.savepoint():
+                            order_data = tx._negdi_check_notification_data(response_data)
+                        if order_data:
+                            results.append((tx, order_data))
+                        else:
+                            stats['processed'] += 1
+                    except RateLimitError:
+                        stats['failed'] += 1
+                        stats['errors']['rate_limited'] += 1
+                        _logger.info("NEGDi: Inquiry of %s delayed by the rate limit.", tx.reference)
+                    except requests.exceptions.Timeout:
+                        stats['failed'] += 1
+                        stats['errors']['timeout'] += 1
+                        _logger.warning("NEGDi: Timeout during Inquiry API request for %s", tx.reference)
+                    except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+                        stats['failed'] += 1
+                        stats['errors']['communication'] += 1
+                        _logger.warning("NEGDi: Inquiry API request failed for %s: %s", tx.reference, e)
+                    except Exception as e:
+                        stats['failed'] += 1
+                        stats['errors']['processing'] += 1
+                        _logger.exception("NEGDi: Error processing the inquiry of tx %s", tx.reference)
+
+        stats['errors'] = dict(stats['errors'])
+        stats['duration'] = time.monotonic() - start
+        stats['throughput'] = (stats['processed'] + stats['failed']) / (stats['duration'] or 1)
+        return stats
+
+    @api.model
+    def _cron_negdi_reconcile_pending_transactions(self):
+        """ Resolve the NEGDi transactions still in draft or pending after a configurable age.
+
+        These are mostly transactions whose customer never came back through the return route.
+        Transactions older than the maximum age are left out, so that those that never resolve do
+        not take the place of the newer ones in every run. The minimum age (in minutes), the
+        maximum age (in days), the number of concurrent inquiries and the maximum number of
+        transactions per run are read from the `payment_negdi.reconcile_min_age`,
+        `payment_negdi.reconcile_max_age`, `payment_negdi.reconcile_max_workers` and
+        `payment_negdi.reconcile_limit` system parameters.
+
+        :return: None
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        min_age = int(ICP.get_param('payment_negdi.reconcile_min_age', NEGDI_RECONCILE_MIN_AGE))
+        max_age = int(ICP.get_param('payment_negdi.reconcile_max_age', NEGDI_RECONCILE_MAX_AGE))
+        max_workers = int(ICP.get_param(
+            'payment_negdi.reconcile_max_workers', NEGDI_INQUIRY_MAX_WORKERS
+        ))
+        limit = int(ICP.get_param('payment_negdi.reconcile_limit', NEGDI_RECONCILE_LIMIT))
+
+        now = fields.Datetime.now()
+        domain = [
+            ('provider_code', '=', 'negdi'),
+            ('state', 'in', ('draft', 'pending')),
+            ('provider_reference', '!=', False),
+            ('negdi_check_id', '!=', False),
+            ('create_date', '<', now - timedelta(minutes=min_age)),
+            ('create_date', '>=', now - timedelta(days=max_age)),
+        ]
+        txs = self.search(domain, order='id', limit=limit)
+        if not txs:
+            return
+        total = len(txs) if len(txs) < limit else self.search_count(domain)
+
+        stats = txs._negdi_run_inquiries(max_workers=max_workers)
+        _logger.info(
+            "NEGDi: Reconciled %d transactions (%d failed: %s) in %.1fs (%.1f tx/s).",
+            stats['processed'], stats['failed'], stats['errors'], stats['duration'],
+            stats['throughput'],
+        )
+        # The transactions skipped, failed or beyond the limit are left to the next runs.
+        self.env['ir.cron']._notify_progress(
+            done=stats['processed'], remaining=total - stats['processed']
+        )
+
+    def _negdi_archive_exchange(self, kind, request_data, response_data=None, error=None):
+        """ Archive a request sent to NEGDi for the transaction and its outcome.
+
+        See `payment.negdi.exchange._record`.
+
+        :param str kind: The endpoint of the request: 'ec1000' or 'ec1098'.
+        :param dict request_data: The payload of the request.
+        :param dict response_data: The response, if the request succeeded.
+        :param Exception error: The error raised by the request, if it failed.
+        :return: None
+        """
+        self.ensure_one()
+        order_data = response_data.get('order') if isinstance(response_data, dict) else None
+        order_data = order_data if isinstance(order_data, dict) else {}
+        self.env['payment.negdi.exchange'].sudo()._record(
+            kind,
+            request_data=request_data,
+            response_data=response_data,
+            error=error and f'{type(error).__name__}: {error}',
+            tranid=order_data.get('tranid') or self.provider_reference,
+            reference=self.reference,
+            status=order_data.get('status'),
+        )
+
+    def _negdi_search_by_tranid(self, tranid):
+        """ Return the NEGDi transaction of the provided tranid.
+
+        The domain matches the predicate of the unique partial index on NEGDi references (see
+        `init`) so that the lookup is served by that index.
+
+        :param str|int tranid: The NEGDi tranid, stored as `provider_reference`.
+        :return: The transaction, if any.
+        :rtype: recordset of `payment.transaction`
+        """
+        return self.search([
+            # Convert to string as provider_reference is Char in Odoo
+            ('provider_reference', '=', str(tranid)),
+            ('negdi_check_id', '!=', False),
+            ('provider_code', '=', 'negdi'),
+        ], limit=1)
+
+    def _negdi_lock_for_processing(self):
+        """ Lock the transactions that are not final yet and not being processed by another
+        request or worker.
+
+        This is the single-flight guard of the NEGDi flows: the rows are locked with `SKIP LOCKED`
+        until the end of the current database transaction, so concurrent handlers of the same
+        tranid (a refreshed return page, a webhook racing with the return, a background inquiry)
+        make at most one inquiry and one state transition.
+
+        :return: The locked transactions.
+        :rtype: recordset of `payment.transaction`
+        """
+        if not self:
+            return self
+        try:
+            with self.env.cr.savepoint():
+                self.env.cr.execute("""
+                    SELECT id
+                      FROM payment_transaction
+                     WHERE id IN %s
+                       AND state NOT IN %s
+                       FOR NO KEY UPDATE SKIP LOCKED
+                """, [tuple(self.ids), NEGDI_FINAL_STATES])
+                locked_ids = {row[0] for row in self.env.cr.fetchall()}
+        except psycopg2.errors.SerializationFailure:
+            # The transactions were updated by a concurrent handler since the start of the current
+            # database transaction, which means that they were already processed.
+            return self.browse()
+        return self.filtered(lambda tx: tx.id in locked_ids)
+
+    # === DEFERRED INQUIRY METHODS === #
+    def _negdi_defer_inquiry(self, check_id):
+        """ Queue the status inquiry of the transaction for the background worker.
+
+        :param str check_id: The checkid received with the customer return.
+        :return: None
+        """
+        self.ensure_one()
+        values = {'negdi_inquiry_requested_at': fields.Datetime.now()}
+        if check_id and not self.negdi_check_id:
+            values['negdi_check_id'] = check_id
+        self.write(values)
+        self.env.ref('payment_negdi.cron_negdi_process_deferred_inquiries').sudo()._trigger()
+
+    @api.model
+    def _cron_negdi_process_deferred_inquiries(self):
+        """ Run the status inquiries deferred by the return route, oldest first.
+
+        The inquiries are made concurrently and a failed one does not roll back the others. A
+        failed inquiry is not retried here: the transaction is left to the reconciliation of
+        pending transactions.
+
+        :return: None
+        """
+        txs = self.search(
+            [('negdi_inquiry_requested_at', '!=', False), ('provider_code', '=', 'negdi')],
+            order='negdi_inquiry_requested_at, id',
+            limit=NEGDI_DEFERRED_INQUIRY_BATCH_SIZE + 1,
+        )
+        if len(txs) > NEGDI_DEFERRED_INQUIRY_BATCH_SIZE:
+            # Process the next batch in a new run rather than holding the cron lock for too long.
+            self.env.ref('payment_negdi.cron_negdi_process_deferred_inquiries')._trigger()
+            txs = txs[:NEGDI_DEFERRED_INQUIRY_BATCH_SIZE]
+
+        txs.negdi_inquiry_requested_at = False
+        self.env.cr.commit()
+        txs._negdi_run_inquiries()
+
+    # === STATUS NOTIFICATION METHODS === #
+    def _update_state(self, allowed_states, target_state, state_message):
+        """ Override of `payment` to push the new state of NEGDi transactions to their status page.
+
+        The notifications are sent on the bus once the transaction is committed, so that the
+        payment status page can fetch the final state without waiting for its next poll.
+        """
+        txs_to_process = super()._update_state(allowed_states, target_state, state_message)
+        txs_to_process.filtered(lambda tx: tx.provider_code == 'negdi')._negdi_notify_status()
+        return txs_to_process
+
+    def _negdi_notify_status(self):
+        """ Send the state of the transactions on their bus channel.
+
+        See `ir.websocket._build_bus_channel_list` for the subscription to these channels.
+
+        :return: None
+        """
+        self.env['bus.bus']._sendmany([
+            (tx, NEGDI_STATUS_NOTIFICATION, {'state': tx.state}) for tx in self
+        ])
+
+    # === SETTLEMENT RECONCILIATION METHODS === #
+    @api.model
+    def _negdi_reconcile_settlement(
+        self, stream, report, date_from=None, date_to=None, chunk_size=NEGDI_SETTLEMENT_CHUNK_SIZE
+    ):
+        """ Match a NEGDi settlement statement against the NEGDi transactions and report the
+        discrepancies.
+
+        The statement is read by chunks, which are loaded into a temporary table and matched by
+        tranid with a single query each; only the chunk being matched and its discrepancies are
+        held in memory. The discrepancies are:
+
+        - `invalid`: the line could not be parsed;
+        - `missing_in_odoo`: no NEGDi transaction has the tranid of the line;
+        - `duplicate`: the tranid was already settled by a previous line;
+        - `amount`, `currency`: the settled amount or currency differs from the transaction's;
+        - `state`: the NEGDi status of the line does not match the state of the transaction, as
+          set by `_process_notification_data`;
+        - `missing_in_file`: a NEGDi transaction confirmed within the settlement period is not
+          settled by the statement. The period is given by `date_from` and `date_to` or, if not
+          given, by the dates of the lines; this check is skipped if neither is known.
+
+        :param stream: The settlement statement, as a binary file object.
+        :param report: The file object, opened in text mode with `newline=''`, receiving the CSV
+                       discrepancy report.
+        :param datetime.date date_from: The first day of the settlement period.
+        :param datetime.date date_to: The last day of the settlement period.
+        :param int chunk_size: The number of lines matched per query.
+        :return: The number of read `lines`, of lines `matched` with a transaction, and of
+                 `discrepancies` by kind.
+        :rtype: dict
+        :raise UserError: If the statement cannot be read.
+        """
+        stats = {'lines': 0, 'matched': 0, 'discrepancies': defaultdict(int)}
+        discrepancies = self._negdi_get_settlement_discrepancies(
+            stream, stats, date_from, date_to, chunk_size
+        )
+        try:
+            negdi_settlement.write_report(report, discrepancies)
+        except negdi_settlement.SettlementError as error:
+            raise UserError(_("The settlement file cannot be read: %s", error)) from error
+        stats['discrepancies'] = dict(stats['discrepancies'])
+        _logger.info("NEGDi: Reconciled settlement statement: %s", stats)
+        return stats
+
+    @api.model
+    def _negdi_get_settlement_discrepancies(self, stream, stats, date_from, date_to, chunk_size):
+        """ Yield the discrepancies between a settlement statement and the NEGDi transactions.
+
+        See `_negdi_reconcile_settlement`.
+
+        :param stream: The settlement statement, as a binary file object.
+        :param dict stats: The statistics of the reconciliation, updated in place.
+        :param datetime.date date_from: The first day of the settlement period, if known.
+        :param datetime.date date_to: The last day of the settlement period, if known.
+        :param int chunk_size: The number of lines matched per query.
+        :return: The discrepancies, as dicts with keys among `settlement.REPORT_COLUMNS`.
+        :rtype: iterator of dict
+        """
+        def count(discrepancy):
+            stats['discrepancies'][discrepancy['kind']] += 1
+            return discrepancy
+
+        cr = self.env.cr
+        cr.execute("DROP TABLE IF EXISTS negdi_settlement_line")
+        cr.execute("""
+            CREATE TEMPORARY TABLE negdi_settlement_line (
+                line integer PRIMARY KEY,
+                tranid varchar NOT NULL,
+                amount numeric NOT NULL,
+                currency varchar,
+                status varchar NOT NULL,
+                state varchar,
+                date date
+            ) ON COMMIT DROP
+        """)
+        cr.execute("CREATE INDEX ON negdi_settlement_line (tranid)")
+
+        invalid_lines = []
+        first_date = last_date = None
+        for chunk in negdi_settlement.read_chunks(stream, chunk_size, invalid_lines):
+            for error in invalid_lines:
+                yield count({'kind': 'invalid', 'line': error.line, 'message': str(error)})
+            invalid_lines.clear()
+
+            cr.execute("""
+                INSERT INTO negdi_settlement_line (line, tranid, amount, currency, status, state, date)
+                     SELECT *
+                       FROM unnest(%s::int[], %s::varchar[], %s::numeric[], %s::varchar[],
+                                   %s::varchar[], %s::varchar[], %s::date[])
+            """, [list(values) for values in zip(*chunk)])
+            # Keep the planner informed of the growing table for the duplicate lookups.
+            cr.execute("ANALYZE negdi_settlement_line")
+            cr.execute("""
+                SELECT *
+                  FROM (
+                        SELECT line.line, line.tranid,
+                               line.amount AS settlement_amount,
+                               line.currency AS settlement_currency,
+                               line.status AS settlement_status,
+                               line.state AS settlement_state,
+                               tx.id AS tx_id, tx.reference,
+                               tx.amount AS odoo_amount,
+                               currency.name AS odoo_currency,
+                               tx.state AS odoo_state,
+                               round(line.amount - tx.amount, currency.decimal_places) != 0
+                                   AS amount_mismatch,
+                               EXISTS (
+                                   SELECT 1
+                                     FROM negdi_settlement_line previous
+                                    WHERE previous.tranid = line.tranid
+                                      AND previous.line < line.line
+                               ) AS duplicate
+                          FROM negdi_settlement_line line
+                     LEFT JOIN payment_transaction tx
+                            ON tx.provider_reference = line.tranid
+                           AND tx.negdi_check_id IS NOT NULL
+                     LEFT JOIN res_currency currency ON currency.id = tx.currency_id
+                         WHERE line.line BETWEEN %s AND %s
+                       ) matches
+                 WHERE tx_id IS NULL
+                    OR duplicate
+                    OR amount_mismatch
+                    OR settlement_currency != odoo_currency
+                    OR settlement_state IS DISTINCT FROM odoo_state
+              ORDER BY line
+            """, [chunk[0].line, chunk[-1].line])
+            rows = cr.dictfetchall()
+
+            stats['lines'] += len(chunk)
+            stats['matched'] += len(chunk) - sum(1 for row in rows if not row['tx_id'])
+            if dates := {line.date for line in chunk if line.date} | {first_date, last_date} - {None}:
+                first_date, last_date = min(dates), max(dates)
+            for row in rows:
+                if not row['tx_id']:
+                    yield count(dict(row, kind='missing_in_odoo'))
+                    continue
+                if row['duplicate']:
+                    yield count(dict(row, kind='duplicate'))
+                if row['amount_mismatch']:
+                    yield count(dict(row, kind='amount'))
+                if row['settlement_currency'] and row['settlement_currency'] != row['odoo_currency']:
+                    yield count(dict(row, kind='currency'))
+                if row['settlement_state'] != row['odoo_state']:
+                    message = None if row['settlement_state'] else "Unknown NEGDi status."
+                    yield count(dict(row, kind='state', message=message))
+        for error in invalid_lines:
+            yield count({'kind': 'invalid', 'line': error.line, 'message': str(error)})
+
+        date_from = date_from or first_date
+        date_to = date_to or last_date
+        if not (date_from and date_to):
+            _logger.info("NEGDi: Unknown settlement period, skipping the search for unsettled txs.")
+            return
+        last_id = 0
+        while True:
+            cr.execute("""
+                SELECT tx.id AS tx_id, tx.reference, tx.provider_reference AS tranid,
+                       tx.amount AS odoo_amount, currency.name AS odoo_currency,
+                       tx.state AS odoo_state
+                  FROM payment_transaction tx
+                  JOIN payment_provider provider ON provider.id = tx.provider_id
+                  JOIN res_currency currency ON currency.id = tx.currency_id
+                 WHERE provider.code = 'negdi'
+                   AND tx.state = 'done'
+                   AND tx.last_state_change >= %(date_from)s
+                   AND tx.last_state_change < %(date_to)s
+                   AND tx.id > %(last_id)s
+                   AND NOT EXISTS (
+                       SELECT 1 FROM negdi_settlement_line line WHERE line.tranid = tx.provider_reference
+                   )
+              ORDER BY tx.id
+                 LIMIT %(limit)s
+            """, {
+                'date_from': date_from,
+                'date_to': date_to + timedelta(days=1),
+                'last_id': last_id,
+                'limit': chunk_size,
+            })
+            rows = cr.dictfetchall()
+            for row in rows:
+                yield count(dict(row, kind='missing_in_file'))
+            if len(rows) < chunk_size:
+                break
+            last_id = rows[-1]['tx_id']
+
     # === RENDERING METHODS (Modified) === #
     def _get_specific_rendering_values(self, processing_values):
         """ Override of payment. For NEGDi API flow, we don't need specific rendering values here."""
@@ -235,7 +1143,8 @@ class PaymentTransaction(models.Model):
         except ValidationError as e:
             # Log validation errors (e.g., tx not found, bad signature) but don't crash controller
             _logger.warning(
-                "NEGDi: Validation error handling feedback data: %s. Data: %s", e, data
+                "NEGDi: Validation error handling feedback data: %s. Data: %s", e,
+                negdi_utils.LazyLogRecord(data),
             )
         # Let the standard flow redirect the user via /payment/status
 
@@ -252,10 +1161,7 @@ class PaymentTransaction(models.Model):
         # Use tranid from the inquiry response as the primary identifier
         provider_ref = order_data.get('tranid')
         if provider_ref:
-            # Convert to string as provider_reference is Char in Odoo
-            tx = self.search([
-                ('provider_reference', '=', str(provider_ref)), ('provider_code', '=', 'negdi')
-            ])
+            tx = self._negdi_search_by_tranid(provider_ref)
         else:
             # Fallback to ordernum if tranid is missing in response (less ideal)
             reference = order_data.get('ordernum') # This should match Odoo's tx reference
@@ -265,14 +1171,9 @@ class PaymentTransaction(models.Model):
 
         if not tx:
             raise ValidationError(
-                "NEGDi: No transaction found matching Inquiry response data.", notification_data
+                "NEGDi: No transaction found matching Inquiry response data (tranid: %s, ordernum: %s)."
+                % (order_data.get('tranid'), order_data.get('ordernum'))
             )
-        if len(tx) > 1:
-             _logger.warning("NEGDi: Multiple transactions found for Inquiry response: %s", provider_ref or reference)
-             # Maybe return the latest one? Or raise error? Depends on business logic.
-             # Returning the first one for now.
-             # raise ValidationError("NEGDi: Multiple transactions found for Inquiry response.")
-
         return tx
 
     def _process_notification_data(self, notification_data):
@@ -280,30 +1181,54 @@ class PaymentTransaction(models.Model):
         if self.provider_code != 'negdi':
             return super()._process_notification_data(notification_data)
 
+        order_data = self._negdi_check_notification_data(notification_data)
+        if order_data:
+            self._negdi_apply_results([order_data])
+
+    def _negdi_check_notification_data(self, notification_data):
+        """ Return the order result of an inquiry response or a notification, once verified.
+
+        The transaction is set in error if the result is invalid or its signature is wrong.
+
+        :param dict notification_data: The inquiry response or the notification.
+        :return: The `order` object to apply, or None if there is nothing to apply.
+        :rtype: dict
+        """
+        self.ensure_one()
+        if self.state in NEGDI_FINAL_STATES:
+            _logger.info(
+                "NEGDi: Ignoring notification for tx %s, already in final state '%s'.",
+                self.reference, self.state,
+            )
+            return None
+
         # 'notification_data' is the response dict from _negdi_make_inquiry_request
         order_data = notification_data.get('order')
         if not isinstance(order_data, dict):
-             _logger.warning("NEGDi: Received invalid Inquiry data for tx %s: %s", self.reference, notification_data)
+             negdi_utils.log_event(
+                 _logger, 'notification.invalid', notification_data, level=logging.WARNING,
+                 reference=self.reference,
+             )
              self._set_error("NEGDi: Invalid Inquiry response received.")
-             return # Don't process further
-
-        # --- Signature Verification (Optional but Recommended) ---
-        # signature_b64 = notification_data.get('ordersign')
-        # public_key_pem = self.provider_id.negdi_public_key
-        # if signature_b64 and public_key_pem and SIGNATURE_VERIFICATION_SUPPORTED:
-        #     try:
-        #         # Prepare data exactly as NEGDi signed it (likely the JSON string of the 'order' object)
-        #         # IMPORTANT: Ensure encoding (e.g., UTF-8) and format match what NEGDi signs
-        #         signed_data_string = json.dumps(order_data, separators=(',', ':'), sort_keys=True) # Example format, verify with NEGDi
-        #         self._negdi_verify_signature(signature_b64, signed_data_string.encode('utf-8'))
-        #         _logger.info("NEGDi: Signature verified successfully for tx %s", self.reference)
-        #     except (ValidationError, InvalidSignature) as e:
-        #         _logger.warning("NEGDi: Invalid signature for tx %s: %s", self.reference, e)
-        #         self._set_error("NEGDi: " + _("Received notification with invalid signature."))
-        #         return # Stop processing if signature is invalid
-        # elif signature_b64 and not public_key_pem:
-        #     _logger.warning("NEGDi: Received signature but Public Key is not configured for tx %s.", self.reference)
-        #     # Decide whether to proceed without verification or set an error/pending state
+             return None # Don't process further
+
+        # --- Signature Verification ---
+        # Mandatory as soon as the NEGDi public key is configured on the provider.
+        signature_b64 = notification_data.get('ordersign')
+        try:
+            public_key = self.provider_id._negdi_get_public_key()
+            if public_key:
+                if not signature_b64:
+                    raise ValidationError(_("Received notification with missing signature."))
+                # The canonical signed bytes are built once per notification.
+                self._negdi_verify_signature(signature_b64, negdi_utils.get_signed_bytes(order_data))
+                _logger.info("NEGDi: Signature verified successfully for tx %s", self.reference)
+            elif signature_b64:
+                _logger.warning("NEGDi: Received signature but Public Key is not configured for tx %s.", self.reference)
+        except ValidationError as e:
+            _logger.warning("NEGDi: Invalid signature for tx %s: %s", self.reference, e)
+            self._set_error("NEGDi: " + _("Received notification with invalid signature."))
+            return None # Stop processing if signature is invalid
         # --- End Signature Verification ---
 
         # Update provider reference again just in case (should match)
@@ -314,71 +1239,110 @@ class PaymentTransaction(models.Model):
             # Decide if this is an error or just update
             # self.provider_reference = str(provider_ref)
 
-        # Update payment method based on inquiry response if available (Page 13)
-        payment_method_code = order_data.get('paymentmethod') # e.g., 'Card', 'QR'
-        if payment_method_code:
-             payment_method = self.env['payment.method']._get_from_code(payment_method_code.lower())
-             if payment_method and self.payment_method_id != payment_method:
-                  self.payment_method_id = payment_method
-
-        # Update the payment state based on the Inquiry status (Page 17 mapping)
-        status = order_data.get('status')
-        if not status:
+        if not order_data.get('status'):
             _logger.warning("NEGDi: Inquiry response missing status for tx %s.", self.reference)
             self._set_error("NEGDi: " + _("Received Inquiry data with missing payment status."))
-            return
+            return None
+        return order_data
+
+    def _negdi_apply_results(self, orders_data):
+        """ Apply verified NEGDi order results to the transactions, writing each one at most once.
 
-        if status in PAYMENT_STATUS_MAPPING['done']:
-            _logger.info("NEGDi: Setting transaction %s to DONE based on status '%s'", self.reference, status)
-            self._set_done()
-            # Optionally write approval code if available
+        The result of a transaction is turned into a diff against its current state and fields:
+        a result matching them, e.g. a replayed inquiry, is skipped without any write. The other
+        fields of the results are written first, grouped by values, and the transactions reaching
+        the same state are then updated together. Both writes stay in the cache until the next
+        flush, so that the whole batch is written in a single flush.
+
+        :param list orders_data: The `order` objects of the inquiry responses or notifications, in
+                                 the order of the transactions, as returned by
+                                 `_negdi_check_notification_data`.
+        :return: The transactions that were updated.
+        :rtype: recordset of `payment.transaction`
+        """
+        txs_by_transition = defaultdict(list)  # (state, state message) -> transactions
+        result_values = {}  # Fields of the results to write, by transaction id
+        for tx, order_data, (state, payment_method_id) in zip(
+            self, orders_data, self._negdi_resolve_order_results(orders_data)
+        ):
+            status = order_data.get('status')
+            state_message = None
+            if state == 'error':
+                error_detail = order_data.get('detail', "Unknown error from provider.")
+                state_message = f"NEGDi: {status} - {error_detail}"
+            elif state is None:
+                _logger.warning("NEGDi: Received unknown status '%s' for tx %s.", status, tx.reference)
+                state = 'error'
+                state_message = "NEGDi: " + _("Received unknown transaction status: %s", status)
+
+            values = {}
+            if payment_method_id and tx.payment_method_id.id != payment_method_id:
+                values['payment_method_id'] = payment_method_id
             approval_code = order_data.get('approvalCode')
-            if approval_code:
-                 self.write({'narration': f"Approval Code: {approval_code}"}) # Example: store in narration
-        elif status in PAYMENT_STATUS_MAPPING['pending']:
-            _logger.info("NEGDi: Setting transaction %s to PENDING based on status '%s'", self.reference, status)
-            self._set_pending()
-        elif status in PAYMENT_STATUS_MAPPING['cancel']:
-             _logger.info("NEGDi: Setting transaction %s to CANCEL based on status '%s'", self.reference, status)
-             self._set_canceled() # Use Odoo's cancel state
-        elif status in PAYMENT_STATUS_MAPPING['error']:
-             _logger.warning("NEGDi: Setting transaction %s to ERROR based on status '%s'", self.reference, status)
-             error_detail = order_data.get('detail', "Unknown error from provider.") # Get detail if available
-             self._set_error(f"NEGDi: {status} - {error_detail}")
-        else:
-            # Handle unknown statuses
-            _logger.warning("NEGDi: Received unknown status '%s' for tx %s.", status, self.reference)
-            self._set_error("NEGDi: " + _("Received unknown transaction status: %s", status))
-
-    # --- Signature Verification Helper (Implement if needed) ---
-    # def _negdi_verify_signature(self, signature_b64, data_bytes):
-    #     self.ensure_one()
-    #     if not SIGNATURE_VERIFICATION_SUPPORTED:
-    #         raise ValidationError(_("Signature verification requires the 'cryptography' library."))
-    #
-    #     public_key_pem = self.provider_id.negdi_public_key
-    #     if not public_key_pem:
-    #         raise ValidationError(_("Cannot verify signature: NEGDi Public Key is not configured."))
-    #
-    #     try:
-    #         public_key = serialization.load_pem_public_key(public_key_pem.encode('utf-8'))
-    #         signature_bytes = base64.b64decode(signature_b64)
-    #
-    #         # Use padding and hash algorithm matching NEGDi (likely PSS or PKCS1v15 with SHA256)
-    #         # This requires confirmation from NEGDi documentation
-    #         padding_algo = padding.PKCS1v15() # Or padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH)
-    #         hasher = hashes.SHA256()
-    #
-    #         public_key.verify(
-    #             signature_bytes,
-    #             data_bytes,
-    #             padding_algo,
-    #             hasher
-    #         )
-    #         # If verify() doesn't raise an exception, the signature is valid
-    #         return True
-    #     except InvalidSignature:
-    #         raise ValidationError(_("Invalid signature."))
-    #     except Exception as e:
-    #         _logger.error("NEGDi: Error during signature verification for tx %s: %s", self.reference, e, exc_info=True)
-    #         raise ValidationError(_("An error occurred during signature verification."))
\ No newline at end of file
+            if approval_code and tx.negdi_approval_code != approval_code:
+                values['negdi_approval_code'] = approval_code
+            if tx.state == state and (tx.state_message or None) != state_message:
+                values['state_message'] = state_message
+            if values:
+                result_values[tx.id] = values
+            if tx.state != state:
+                txs_by_transition[state, state_message].append(tx.id)
+
+        updated_txs = self.browse()
+        tx_ids_by_values = defaultdict(list)
+        for tx_id, values in result_values.items():
+            tx_ids_by_values[frozenset(values.items())].append(tx_id)
+        for values, tx_ids in tx_ids_by_values.items():
+            self.browse(tx_ids).write(dict(values))
+            updated_txs |= self.browse(tx_ids)
+
+        set_state_methods = {
+            'done': '_set_done', 'pending': '_set_pending', 'cancel': '_set_canceled',
+            'error': '_set_error',
+        }
+        for (state, state_message), tx_ids in txs_by_transition.items():
+            txs = self.browse(tx_ids)
+            _logger.info("NEGDi: Setting transactions %s to %s.", txs.mapped('reference'), state)
+            processed_txs = getattr(txs, set_state_methods[state])(state_message=state_message)
+            updated_txs |= processed_txs
+            negdi_metrics.inc('negdi_transaction_states_total', len(processed_txs), state=state)
+        return updated_txs
+
+    @api.model
+    def _negdi_resolve_order_results(self, orders_data):
+        """ Resolve the Odoo state and payment method of NEGDi order results.
+
+        The resolution only uses the precompiled status table and the cached payment method
+        table, so it makes no query and can be used for thousands of inquiry results at once.
+
+        :param list orders_data: The `order` objects of inquiry responses or notifications.
+        :return: The `(state, payment_method_id)` pairs, in the same order; each item is None if
+                 the status or the payment method is unknown.
+        :rtype: list
+        """
+        method_ids = self.env['payment.method']._negdi_get_method_ids_by_code()
+        return [(
+            negdi_utils.get_transaction_state(order_data.get('status')),
+            method_ids.get((order_data.get('paymentmethod') or '').casefold()),  # e.g., 'Card', 'QR'
+        ) for order_data in orders_data]
+
+    # --- Signature Verification Helper ---
+    def _negdi_verify_signature(self, signature_b64, data_bytes):
+        """ Verify the `ordersign` RSA signature of NEGDi with the public key of the provider.
+
+        :param str signature_b64: The base64-encoded signature.
+        :param bytes data_bytes: The signed bytes, as returned by `utils.get_signed_bytes`.
+        :return: None
+        :raise ValidationError: If the key is not configured or the signature is invalid.
+        """
+        self.ensure_one()
+        public_key = self.provider_id._negdi_get_public_key()
+        if not public_key:
+            raise ValidationError(_("Cannot verify signature: NEGDi Public Key is not configured."))
+
+        try:
+            signature_bytes = base64.b64decode(signature_b64, validate=True)
+            # NEGDi signs with PKCS#1 v1.5 padding and SHA-256.
+            public_key.verify(signature_bytes, data_bytes, padding.PKCS1v15(), hashes.SHA256())
+        except (InvalidSignature, binascii.Error, ValueError):
+            raise ValidationError(_("Invalid signature."))
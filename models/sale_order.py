@@ -0,0 +1,15 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import _, models
+from odoo.exceptions import UserError
+
+
+class SaleOrder(models.Model):
+    _inherit = 'sale.order'
+
+    def action_negdi_create_payment_links(self):
+        """ Create the NEGDi payment links of the selected sale orders and show them. """
+        orders = self.filtered(lambda order: order.state != 'cancel')
+        if not orders:
+            raise UserError(_("Payment links cannot be created for canceled sale orders."))
+        return self.env['payment.transaction']._negdi_action_create_payment_links(orders)
@@ -0,0 +1,164 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+import threading
+import time
+
+import requests
+
+from . import const
+
+
+_logger = logging.getLogger(__name__)
+
+
+class RateLimitError(requests.exceptions.RequestException):
+    """ Raised instead of sending a request when the rate limit of its traffic class is reached. """
+
+
+class RateLimiter:
+    """ Token-bucket rate limiter of the NEGDi gateway shared by all the workers using the same
+    database.
+
+    Each traffic class (see `const.NEGDI_RATE_LIMITS`) has its own bucket in the
+    `payment_negdi_rate_limit` table, refilled at `rate` tokens per second up to `capacity`
+    tokens. A request consumes a token of its class, or of one of the classes it can borrow from
+    (see `const.NEGDI_RATE_LIMIT_BORROWING`), so that checkouts use the spare budget of the
+    background inquiries during a burst but not the other way around. When no token is
+    available, the caller sleeps until the next token is due, as long as its total wait stays
+    within the `max_wait` of its class; it fails fast otherwise.
+
+    Workers take up to `reservation_size` tokens of their own class at once and consume them
+    locally for `reservation_ttl` seconds, so that most requests do not lock a bucket; borrowed
+    tokens are taken one at a time. Each bucket is locked on its own, in a short, independent
+    database transaction, and the bucket of a lending class only when the own bucket of the
+    request is exhausted. Database errors never block requests.
+    """
+
+    def __init__(
+        self, cursor_factory, key,
+        reservation_size=const.NEGDI_RATE_LIMIT_RESERVATION_SIZE,
+        reservation_ttl=const.NEGDI_RATE_LIMIT_RESERVATION_TTL,
+    ):
+        """
+        :param callable cursor_factory: The function returning a new database cursor.
+        :param str key: The identifier of the limited gateway, e.g. its base URL.
+        """
+        self.cursor_factory = cursor_factory
+        self.key = key
+        self.reservation_size = reservation_size
+        self.reservation_ttl = reservation_ttl
+        self._lock = threading.Lock()
+        self._reservations = {}  # The tokens reserved by the process and their expiry, by class
+        self._rows_ensured = False
+
+    def _execute(self, query, params):
+        with self.cursor_factory() as cr:
+            cr.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+            if not self._rows_ensured:
+                for traffic_class, (rate, capacity, max_wait) in const.NEGDI_RATE_LIMITS.items():
+                    cr.execute("""
+                        INSERT INTO payment_negdi_rate_limit (gateway, traffic_class, rate,
+                                                              capacity, max_wait, tokens,
+                                                              updated_at)
+                             VALUES (%s, %s, %s, %s, %s, %s, now() at time zone 'UTC')
+                        ON CONFLICT (gateway, traffic_class) DO NOTHING
+                    """, [self.key, traffic_class, rate, capacity, max_wait, capacity])
+            cr.execute(query, params)
+            result = cr.fetchone() if cr.description else None
+            cr.commit()
+            self._rows_ensured = True
+            return result
+
+    def _take(self, traffic_class, count):
+        """ Consume up to `count` available tokens of the bucket of a class.
+
+        :param str traffic_class: The class of the bucket.
+        :param int count: The maximum number of tokens to consume.
+        :return: The number of consumed tokens, the time in seconds until the next token of the
+                 class is due, and the maximum wait of the class; None if the class is unknown.
+        :rtype: tuple
+        """
+        return self._execute("""
+            WITH bucket AS (
+                SELECT id, rate, max_wait,
+                       LEAST(capacity, tokens + rate * EXTRACT(
+                           EPOCH FROM (now() at time zone 'UTC') - updated_at
+                       )) AS available
+                  FROM payment_negdi_rate_limit
+                 WHERE gateway = %(key)s AND traffic_class = %(class)s
+                   FOR UPDATE
+            ), taken AS (
+                SELECT id, LEAST(FLOOR(GREATEST(available, 0)), %(count)s) AS tokens
+                  FROM bucket
+            )
+            UPDATE payment_negdi_rate_limit
+               SET tokens = bucket.available - taken.tokens,
+                   updated_at = now() at time zone 'UTC'
+              FROM bucket
+              JOIN taken ON taken.id = bucket.id
+             WHERE payment_negdi_rate_limit.id = bucket.id
+         RETURNING taken.tokens::int,
+                   (1 - bucket.available) / NULLIF(bucket.rate, 0),
+                   bucket.max_wait
+        """, {'key': self.key, 'class': traffic_class, 'count': count})
+
+    def _use_reservation(self, traffic_class):
+        """ Consume a token reserved by the process for a class, if any is left. """
+        with self._lock:
+            count, expiry = self._reservations.get(traffic_class, (0, 0))
+            if not count or expiry <= time.monotonic():
+                return False
+            self._reservations[traffic_class] = (count - 1, expiry)
+            return True
+
+    def _try_acquire(self, traffic_class):
+        """ Consume a token of the class or of a class it borrows from, if one is available.
+
+        :param str traffic_class: The traffic class of the request.
+        :return: Whether a token was consumed, the time in seconds until the next token of the
+                 class is due, and the maximum wait of the class; None if the class is unknown.
+        :rtype: tuple
+        """
+        if self._use_reservation(traffic_class):
+            return True, None, None
+        result = self._take(traffic_class, self.reservation_size)
+        if not result:
+            return None
+        taken, wait, max_wait = result
+        if taken:
+            with self._lock:
+                self._reservations[traffic_class] = (
+                    taken - 1, time.monotonic() + self.reservation_ttl
+                )
+            return True, wait, max_wait
+        for lending_class in const.NEGDI_RATE_LIMIT_BORROWING.get(traffic_class, ()):
+            lent = self._take(lending_class, 1)
+            if lent and lent[0]:
+                return True, wait, max_wait
+        return False, wait, max_wait
+
+    def acquire(self, traffic_class):
+        """ Wait for a token of the traffic class within its maximum wait.
+
+        :param str traffic_class: The traffic class of the request.
+        :return: None
+        :raise RateLimitError: If no token is available within the maximum wait of the class.
+        """
+        deadline = None
+        while True:
+            try:
+                result = self._try_acquire(traffic_class)
+            except Exception:
+                _logger.exception("NEGDi: Unable to read the rate limit of %s.", traffic_class)
+                return
+            if not result or result[0]:  # Unknown classes are not limited.
+                return
+            _acquired, wait, max_wait = result
+            now = time.monotonic()
+            deadline = deadline or now + max_wait
+            if wait is None or now + wait > deadline:
+                raise RateLimitError(
+                    f"The NEGDi request rate limit of {traffic_class} is reached; try again later."
+                )
+            time.sleep(wait)
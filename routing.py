@@ -0,0 +1,119 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" Selection of the NEGDi merchant terminal of new orders among the terminals of a provider.
+
+Terminals are picked by smooth weighted round-robin: each terminal receives a share of the orders
+proportional to its effective weight, and the picks of the terminals are interleaved rather than
+grouped. The effective weight of a terminal is its configured weight, divided by its recent
+latency and reduced by its recent error rate, both tracked as exponentially weighted moving
+averages of the ec1000 requests sent through the current worker. A failing terminal keeps a
+minimal share of the orders so that its recovery is noticed.
+
+This module does not depend on Odoo so that it can be used and benchmarked on its own.
+"""
+
+import os
+import threading
+import time
+
+from .const import NEGDI_ROUTING_EWMA_ALPHA
+from .const import NEGDI_ROUTING_LATENCY_FLOOR
+from .const import NEGDI_ROUTING_MIN_SHARE
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+class TerminalRouter:
+    """ Thread-safe picker of the terminal of new orders, see the module documentation.
+
+    The terminals are identified by their `id` and weighted by their `weight` attributes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}  # Moving average of the request durations, by terminal
+        self._error_rates = {}  # Moving average of the failed requests (0 or 1), by terminal
+        self._current_weights = {}  # State of the smooth weighted round-robin, by terminal
+
+    def pick(self, terminals):
+        """ Return the terminal of the next order.
+
+        :param list terminals: The terminals to pick from.
+        :return: The picked terminal.
+        """
+        with self._lock:
+            known_latencies = [
+                self._latencies[terminal.id] for terminal in terminals
+                if terminal.id in self._latencies
+            ]
+            # Terminals without requests yet are assumed to be as fast as the others on average.
+            default_latency = (
+                sum(known_latencies) / len(known_latencies) if known_latencies
+                else NEGDI_ROUTING_LATENCY_FLOOR
+            )
+            total_weight = 0
+            picked = None
+            for terminal in terminals:
+                weight = self._get_effective_weight(terminal, default_latency)
+                self._current_weights[terminal.id] = self._current_weights.get(terminal.id, 0) + weight
+                total_weight += weight
+                if picked is None or (
+                    self._current_weights[terminal.id] > self._current_weights[picked.id]
+                ):
+                    picked = terminal
+            self._current_weights[picked.id] -= total_weight
+            return picked
+
+    def _get_effective_weight(self, terminal, default_latency):
+        latency = max(self._latencies.get(terminal.id, default_latency), NEGDI_ROUTING_LATENCY_FLOOR)
+        health = max(1 - self._error_rates.get(terminal.id, 0), NEGDI_ROUTING_MIN_SHARE)
+        return terminal.weight * health / latency
+
+    def record(self, terminal_id, duration, success):
+        """ Update the moving averages of a terminal with the outcome of a request.
+
+        :param int terminal_id: The id of the terminal of the request.
+        :param float duration: The duration of the request, in seconds.
+        :param bool success: Whether the request succeeded.
+        :return: None
+        """
+        with self._lock:
+            for averages, value in (
+                (self._latencies, duration), (self._error_rates, 0 if success else 1)
+            ):
+                previous = averages.get(terminal_id)
+                averages[terminal_id] = value if previous is None else (
+                    previous + NEGDI_ROUTING_EWMA_ALPHA * (value - previous)
+                )
+
+    def call(self, terminal_id, func, *args, **kwargs):
+        """ Call a function sending a request through a terminal and record its outcome.
+
+        :param int terminal_id: The id of the terminal of the request.
+        :param callable func: The function sending the request.
+        :return: The result of the function.
+        """
+        start = time.monotonic()
+        success = False
+        try:
+            result = func(*args, **kwargs)
+            success = True
+            return result
+        finally:
+            self.record(terminal_id, time.monotonic() - start, success)
+
+
+def get_router(dbname):
+    """ Return the terminal router of the current process for a database.
+
+    :param str dbname: The database of the terminals.
+    :return: The router.
+    :rtype: TerminalRouter
+    """
+    key = (os.getpid(), dbname)
+    router = _routers.get(key)
+    if router is None:
+        with _routers_lock:
+            router = _routers.setdefault(key, TerminalRouter())
+    return router
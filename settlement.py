@@ -0,0 +1,170 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+""" Parsing of the NEGDi settlement statements and writing of the reconciliation reports.
+
+The statements are CSV files with a header line; the column names are matched case-insensitively
+and in any order. A statement can hold hundreds of thousands of lines: it is read as a stream and
+returned in chunks, so that only one chunk is in memory at a time. The matching against the
+transactions is done in the database by `payment.transaction._negdi_reconcile_settlement`.
+
+This module does not depend on Odoo so that it can be used and benchmarked on its own.
+"""
+
+import csv
+import datetime
+import decimal
+import io
+from collections import namedtuple
+
+from .const import NEGDI_SETTLEMENT_COLUMNS
+from .const import NEGDI_SETTLEMENT_REQUIRED_COLUMNS
+from .const import STATUS_TO_STATE
+
+
+# A settlement line. `state` is the Odoo state matching the NEGDi status, if any.
+SettlementLine = namedtuple(
+    'SettlementLine', ['line', 'tranid', 'amount', 'currency', 'status', 'state', 'date']
+)
+
+# Columns of the discrepancy reports.
+REPORT_COLUMNS = [
+    'kind', 'line', 'tranid', 'reference',
+    'settlement_amount', 'odoo_amount',
+    'settlement_currency', 'odoo_currency',
+    'settlement_status', 'settlement_state', 'odoo_state',
+    'message',
+]
+
+
+class SettlementError(ValueError):
+    """ Raised when a settlement statement cannot be read at all. """
+
+
+class InvalidLine(ValueError):
+    """ Raised when a line of a settlement statement cannot be parsed. """
+
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+
+
+class _SemicolonDialect(csv.excel):
+    delimiter = ';'
+
+
+def read_chunks(stream, chunk_size, invalid_lines=None):
+    """ Parse a settlement statement and yield its lines by chunks.
+
+    :param stream: The statement, as a binary file object.
+    :param int chunk_size: The maximum number of lines per chunk.
+    :param list invalid_lines: A list receiving the `InvalidLine` errors of the lines that could
+                               not be parsed. If not given, the first error is raised instead.
+    :return: The chunks of parsed lines.
+    :rtype: iterator of list of `SettlementLine`
+    :raise SettlementError: If the header of the statement is missing or incomplete.
+    :raise InvalidLine: If a line is invalid and `invalid_lines` is not given.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        yield from _read_chunks(text, chunk_size, invalid_lines)
+    finally:
+        text.detach()  # Leave the stream open for the caller.
+
+
+def _read_chunks(text, chunk_size, invalid_lines):
+    first_line = text.readline()
+    if not first_line.strip():
+        raise SettlementError("The settlement file is empty.")
+    dialect = 'excel-tab' if '\t' in first_line else 'excel'
+    if dialect == 'excel' and first_line.count(';') > first_line.count(','):
+        dialect = _SemicolonDialect
+    header = [name.strip().casefold() for name in next(csv.reader([first_line], dialect))]
+    positions = {}
+    for column, aliases in NEGDI_SETTLEMENT_COLUMNS.items():
+        position = next((header.index(alias) for alias in aliases if alias in header), None)
+        if position is not None:
+            positions[column] = position
+    if missing := NEGDI_SETTLEMENT_REQUIRED_COLUMNS - positions.keys():
+        raise SettlementError(
+            f"The settlement file is missing the columns: {', '.join(sorted(missing))}."
+        )
+
+    chunk = []
+    # The header is line 1; the line numbers are only exact for rows without line breaks.
+    for line, row in enumerate(csv.reader(text, dialect), start=2):
+        if not row or not any(row):
+            continue
+        try:
+            chunk.append(_parse_row(line, row, positions))
+        except InvalidLine as error:
+            if invalid_lines is None:
+                raise
+            invalid_lines.append(error)
+            continue
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _parse_row(line, row, positions):
+    """ Parse a row of a settlement statement.
+
+    :param int line: The line number of the row.
+    :param list row: The values of the row.
+    :param dict positions: The position of each known column in the row.
+    :return: The parsed line.
+    :rtype: SettlementLine
+    :raise InvalidLine: If a required value is missing or malformed.
+    """
+    def get(column):
+        position = positions.get(column)
+        if position is None or position >= len(row):
+            return None
+        return row[position].strip() or None
+
+    tranid = get('tranid')
+    if not tranid:
+        raise InvalidLine(line, "Missing tranid.")
+    try:
+        amount = decimal.Decimal(get('amount').replace(' ', '').replace(',', '.'))
+    except (AttributeError, decimal.InvalidOperation):
+        raise InvalidLine(line, f"Invalid amount: {get('amount')!r}.") from None
+    status = get('status')
+    if not status:
+        raise InvalidLine(line, "Missing status.")
+    date = get('date')
+    if date:
+        try:
+            date = datetime.date.fromisoformat(date[:10])
+        except ValueError:
+            raise InvalidLine(line, f"Invalid date: {date!r}.") from None
+    currency = get('currency')
+    return SettlementLine(
+        line=line,
+        tranid=tranid,
+        amount=amount,
+        currency=currency and currency.upper(),
+        status=status,
+        state=STATUS_TO_STATE.get(status.casefold()),
+        date=date,
+    )
+
+
+def write_report(stream, discrepancies):
+    """ Write discrepancies to a CSV report.
+
+    :param stream: The report, as a text file object opened with `newline=''`.
+    :param discrepancies: The discrepancies, as dicts with keys among `REPORT_COLUMNS`.
+    :type discrepancies: iterable of dict
+    :return: The number of written discrepancies.
+    :rtype: int
+    """
+    writer = csv.DictWriter(stream, REPORT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for discrepancy in discrepancies:
+        writer.writerow(discrepancy)
+        count += 1
+    return count
@@ -12,7 +12,8 @@ paymentForm.include({
     // #=== DOM MANIPULATION ===#
 
     /**
-     * Prepare the inline form of Adyen for direct payment.
+     * Pre-create the NEGDi order of the cart when NEGDi is selected, so that paying only has to
+     * redirect the customer to NEGDi.
      *
      * @override method from payment.payment_form
      * @private
@@ -23,11 +24,52 @@ paymentForm.include({
      * @param {string} flow - The online payment flow of the selected payment option
      * @return {void}
      */
-    
+    async _prepareInlineForm(providerId, providerCode, paymentOptionId, paymentMethodCode, flow) {
+        const orderMatch = this.paymentContext['transactionRoute']?.match(
+            /^\/shop\/payment\/transaction\/(\d+)/
+        );
+        if (providerCode === 'negdi' && orderMatch) {
+            // Not awaited: the customer must not wait for NEGDi to choose how to pay. The server
+            // ignores the call if the provider does not pre-create orders.
+            // The payment context is only updated with the selected option when the form is
+            // submitted.
+            this.negdiPrecreation = rpc(`/shop/payment/negdi/precreate/${orderMatch[1]}`, {
+                ...this._prepareTransactionRouteParams(),
+                'provider_id': providerId,
+                'payment_method_id': paymentOptionId,
+                'token_id': null,
+                'flow': flow,
+            }).catch(() => {}); // The order is created when the customer pays instead.
+        }
+        return this._super(...arguments);
+    },
 
     // #=== PAYMENT FLOW ===#
 
+    /**
+     * Identify the payment requests of the page so that repeated clicks on the Pay button and
+     * retries reuse the NEGDi order created by the first one.
+     *
+     * @override method from payment.payment_form
+     * @private
+     * @return {object} The extended transaction route params.
+     */
+    _prepareTransactionRouteParams() {
+        const transactionRouteParams = this._super(...arguments);
+        if (this.paymentContext['transactionRoute']?.startsWith('/shop/payment/transaction/')) {
+            // `crypto.randomUUID` is only available in secure contexts.
+            this.negdiIdempotencyKey ??= crypto.randomUUID?.()
+                ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+            transactionRouteParams['negdi_idempotency_key'] = this.negdiIdempotencyKey;
+        }
+        return transactionRouteParams;
+    },
+
     async _initiatePaymentFlow(providerCode, paymentOptionId, paymentMethodCode, flow) {
+        if (providerCode === 'negdi' && this.negdiPrecreation) {
+            // Wait for the pre-creation to release the order so that it can be reused.
+            await this.negdiPrecreation;
+        }
         // Create a transaction and retrieve its processing values.
         await rpc(
             this.paymentContext['transactionRoute'],
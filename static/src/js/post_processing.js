@@ -0,0 +1,87 @@
+/** @odoo-module **/
+
+import paymentPostProcessing from '@payment/js/post_processing';
+
+// Delays in milliseconds of the fallback polling of NEGDi transactions, doubled after each poll.
+const NEGDI_POLL_INITIAL_DELAY = 2000;
+const NEGDI_POLL_MAX_DELAY = 60000;
+
+paymentPostProcessing.include({
+
+    /**
+     * Follow NEGDi transactions through the bus once the first poll identified the provider.
+     *
+     * @override method from payment.post_processing
+     * @private
+     * @param {string} providerCode - The code of the provider of the monitored transaction.
+     * @return {string[]} The final states of the transaction.
+     */
+    _getFinalStates(providerCode) {
+        if (providerCode === 'negdi' && !this.negdiSubscribed) {
+            this.negdiSubscribed = true;
+            this.negdiPollCount = 0;
+            this.call('bus_service', 'subscribe', 'payment_negdi/status', () => this._negdiPollNow());
+            // Replaced by the channel of the monitored transaction on the server.
+            this.call('bus_service', 'addChannel', 'payment_negdi.status');
+        }
+        return this._super(...arguments);
+    },
+
+    /**
+     * Schedule the polls of NEGDi transactions ourselves so that a notification can run the next
+     * one immediately.
+     *
+     * @override method from payment.post_processing
+     * @private
+     * @return {void}
+     */
+    _poll() {
+        if (!this.negdiSubscribed) {
+            return this._super(...arguments);
+        }
+        this.negdiSuperPoll = this._super.bind(this);
+        this._updateTimeout();
+        clearTimeout(this.negdiPollTimer);
+        this.negdiPollTimer = setTimeout(() => this._negdiPollNow(), this.timeout);
+    },
+
+    /**
+     * Poll with an exponential backoff, as the bus notifies the state changes of NEGDi
+     * transactions.
+     *
+     * @override method from payment.post_processing
+     * @private
+     * @return {void}
+     */
+    _updateTimeout() {
+        if (!this.negdiSubscribed) {
+            return this._super(...arguments);
+        }
+        if (this.negdiPollImmediately) {
+            this.negdiPollImmediately = false;
+            this.timeout = 0;
+            return;
+        }
+        this.timeout = Math.min(
+            NEGDI_POLL_INITIAL_DELAY * 2 ** this.negdiPollCount, NEGDI_POLL_MAX_DELAY
+        );
+        this.negdiPollCount++;
+    },
+
+    /**
+     * Run the next poll now, or right after the poll in progress if any.
+     *
+     * @private
+     * @return {void}
+     */
+    _negdiPollNow() {
+        this.negdiPollImmediately = true;
+        if (this.negdiPollTimer) {
+            clearTimeout(this.negdiPollTimer);
+            this.negdiPollTimer = null;
+            this.negdiSuperPoll();
+        }
+        // Otherwise, a poll is in progress and the flag makes the next one immediate.
+    },
+
+});
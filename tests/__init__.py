@@ -3,3 +3,11 @@
 from . import common
 from . import test_payment_transaction
 from . import test_processing_flows
+from . import test_client
+from . import test_utils
+from . import test_circuit_breaker
+from . import test_metrics
+from . import test_settlement
+from . import test_exchange
+from . import test_routing
+from . import test_rate_limiter
@@ -10,34 +10,31 @@ class NEGDiCommon(PaymentHttpCommon):
         super().setUpClass()
 
         cls.negdi = cls._prepare_provider('negdi', update_values={
-            'negdi_merchant_identifier': '123456abc',
-            'negdi_access_code': 'dummy',
-            'negdi_sha_request': 'dummy',
-            'negdi_sha_response': 'dummy',
+            'negdi_terminal_identifier': '90000001',
+            'negdi_username': 'merchant',
+            'negdi_password': 'dummy',
         })
 
         cls.provider = cls.negdi
 
+        cls.tranid = '202400001'
+        cls.check_id = 'a1b2c3d4'
+        cls.ec1000_response = {
+            'order': {
+                'tranid': int(cls.tranid),
+                'checkid': cls.check_id,
+                'negdiurl': f'https://negdi.test/checkout/{cls.tranid}',
+            },
+        }
         cls.notification_data = {
-            'access_code': cls.provider.negdi_access_code,
-            'amount': cls.amount,
-            'authorization_code': '123456',
-            'card_holder_name': 'Mitchell',
-            'card_number': '************1111',
-            'command': 'PURCHASE',
-            'currency': 'USD',
-            'customer_email': '	admin@yourcompany.example.com',
-            'customer_ip': '123.456.78.90',
-            'eci': 'ECOMMERCE',
-            'expiry_date': '2212',
-            'fort_id': '169996210006464984',
-            'language': 'en',
-            'merchant_identifier': cls.provider.negdi_merchant_identifier,
-            'merchant_reference': cls.reference,
-            'payment_option': 'VISA',
-            'response_code': '14000',
-            'response_message': 'Success',
-            'signature': '6d2bb7904ac6141a0c10375c70fd417616c740bb1ddab862a224777880aa3600',
-            'status': '14',
-            'token_name': '123abc456def789',
+            'order': {
+                'tranid': int(cls.tranid),
+                'checkid': cls.check_id,
+                'ordernum': cls.reference,
+                'amount': cls.amount,
+                'currency': 'USD',
+                'status': 'Approved',
+                'paymentmethod': 'Card',
+                'approvalCode': '123456',
+            },
         }
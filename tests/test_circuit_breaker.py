@@ -0,0 +1,112 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.payment_negdi.circuit_breaker import CircuitBreaker
+
+
+class _SharedCursor:
+    """ Cursor factory result running the breaker queries in the test transaction. """
+
+    def __init__(self, cr):
+        self.cr = cr
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        pass
+
+    def execute(self, query, params=None):
+        if not query.startswith('SET TRANSACTION'):  # Not allowed once the transaction started.
+            self.cr.execute(query, params)
+
+    def fetchone(self):
+        return self.cr.fetchone()
+
+    @property
+    def description(self):
+        return self.cr.description
+
+    def commit(self):
+        pass
+
+
+@tagged('post_install', '-at_install')
+class TestCircuitBreaker(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker(
+            lambda: _SharedCursor(self.env.cr), 'http://negdi.test/api/pay',
+            min_calls=3, error_rate=0.5, slow_call_duration=5, open_duration=30, state_ttl=0,
+        )
+
+    def _expire_open_duration(self):
+        self.env.cr.execute("""
+            UPDATE payment_negdi_breaker SET opened_at = opened_at - interval '1 minute'
+             WHERE name = %s
+        """, [self.breaker.key])
+
+    def test_breaker_opens_when_error_rate_is_exceeded(self):
+        """ Test that requests are rejected once too many of them failed. """
+        for success in (True, False, False):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(success, 0.1)
+        self.assertTrue(self.breaker.is_open())
+        self.assertFalse(self.breaker.allow())
+
+    def test_slow_requests_open_the_breaker(self):
+        """ Test that successful but slow requests count against the gateway. """
+        self.breaker.slow_call_rate = 0.5
+        for _i in range(3):
+            self.breaker.allow()
+            self.breaker.record(True, 6)
+        self.assertTrue(self.breaker.is_open())
+
+    def test_single_probe_closes_the_breaker(self):
+        """ Test that a single probe is let through after the open duration and that its success
+        closes the breaker. """
+        for _i in range(3):
+            self.breaker.allow()
+            self.breaker.record(False, 0.1)
+        self._expire_open_duration()
+        self.assertTrue(self.breaker.allow())  # The probe.
+        other_worker_breaker = CircuitBreaker(
+            self.breaker.cursor_factory, self.breaker.key, state_ttl=0
+        )
+        self.assertFalse(other_worker_breaker.allow())
+        self.breaker.record(True, 0.1)
+        self.assertFalse(self.breaker.is_open())
+        self.assertTrue(other_worker_breaker.allow())
+
+    def test_failed_probe_reopens_the_breaker(self):
+        """ Test that a failed probe keeps rejecting requests for another open duration. """
+        for _i in range(3):
+            self.breaker.allow()
+            self.breaker.record(False, 0.1)
+        self._expire_open_duration()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(False, 0.1)
+        self.assertTrue(self.breaker.is_open())
+
+    def test_outcomes_are_written_in_batches(self):
+        """ Test that healthy requests are only counted in the process and that the outcomes are
+        added to the shared window once a request failed and the flush interval elapsed. """
+        self.breaker.min_calls = 10
+
+        def get_shared_counts():
+            self.env.cr.execute("""
+                SELECT call_count, failure_count FROM payment_negdi_breaker WHERE name = %s
+            """, [self.breaker.key])
+            return self.env.cr.fetchone()
+
+        for success in (True, True, True, True, True, False):
+            self.breaker.allow()
+            self.breaker.record(success, 0.1)
+        self.assertEqual(get_shared_counts(), (0, 0))
+        self.breaker._flushed_at -= self.breaker.flush_interval
+        self.breaker.allow()
+        self.breaker.record(False, 0.1)
+        self.assertEqual(get_shared_counts(), (7, 2))
+        self.assertFalse(self.breaker.is_open())
@@ -0,0 +1,140 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from http.client import RemoteDisconnected
+from unittest.mock import Mock, patch
+
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from odoo.tests import tagged
+from odoo.tests.common import BaseCase
+
+from odoo.addons.payment_negdi import const
+from odoo.addons.payment_negdi.client import NEGDiClient, get_client
+from odoo.addons.payment_negdi.rate_limiter import RateLimitError
+
+
+@tagged('post_install', '-at_install')
+class TestNEGDiClient(BaseCase):
+
+    def test_client_is_shared_per_base_url(self):
+        """ Test that the same pooled client is returned for the same API base URL. """
+        client = get_client('http://negdi.test/api/pay')
+        self.assertIs(get_client('http://negdi.test/api/pay/'), client)
+        self.assertIsNot(get_client('http://other.negdi.test/api/pay'), client)
+
+    def test_client_is_rebuilt_when_options_change(self):
+        """ Test that changing the pooling options of a base URL yields a new client. """
+        client = get_client('http://negdi.test/api/pay', pool_size=2)
+        new_client = get_client('http://negdi.test/api/pay', pool_size=3)
+        self.assertIsNot(new_client, client)
+        self.assertEqual(new_client.pool_size, 3)
+
+    def test_post_uses_split_timeouts(self):
+        """ Test that requests are sent with separate connect and read timeouts. """
+        client = NEGDiClient('http://negdi.test/api/pay', connect_timeout=2, read_timeout=20)
+        with patch.object(client.session, 'post') as post_mock:
+            post_mock.return_value.status_code = 200
+            client.post(const.NEGDI_INQUIRY_ORDER_ENDPOINT, {'tranid': 1}, read_timeout=10)
+        post_mock.assert_called_once_with(
+            'http://negdi.test/api/pay/ec1098', json={'tranid': 1}, timeout=(2, 10)
+        )
+
+    def _post_with_failures(self, client, endpoint, failures):
+        """ Send a request with the client, failing with the provided errors before succeeding.
+
+        :return: The mock of the session's `post` method.
+        """
+        def post(*_args, **_kwargs):
+            if failures:
+                raise failures.pop(0)
+            response = Mock(status_code=200)
+            response.json.return_value = {'order': {}}
+            return response
+
+        # Skip the backoff delays.
+        with (
+            patch.object(client.session, 'post', side_effect=post) as post_mock,
+            patch('odoo.addons.payment_negdi.client.random.uniform', return_value=0),
+        ):
+            client.post(endpoint, {'ordernum': 'S00001'})
+        return post_mock
+
+    def _http_error(self, status_code):
+        return requests.exceptions.HTTPError(response=Mock(status_code=status_code))
+
+    def _connect_error(self):
+        """ Return the error raised by requests when the connection cannot be established. """
+        return requests.exceptions.ConnectionError(MaxRetryError(
+            None, '/ec1000', NewConnectionError(None, "Failed to establish a new connection")
+        ))
+
+    def _aborted_connection_error(self):
+        """ Return the error raised by requests when the gateway closes the connection after
+        the request was sent. """
+        return requests.exceptions.ConnectionError(ProtocolError(
+            "Connection aborted.", RemoteDisconnected("Remote end closed connection")
+        ))
+
+    def test_transient_failures_are_retried_with_the_same_payload(self):
+        """ Test that the failures of the connection phase and unavailable gateways are retried
+        for order creations. """
+        client = NEGDiClient('http://negdi.test/api/pay')
+        post_mock = self._post_with_failures(client, const.NEGDI_CREATE_ORDER_ENDPOINT, [
+            self._connect_error(), requests.exceptions.ConnectTimeout(), self._http_error(502),
+        ])
+        self.assertEqual(post_mock.call_count, 4)
+        self.assertTrue(all(
+            call.kwargs['json'] == {'ordernum': 'S00001'} for call in post_mock.call_args_list
+        ))
+
+    def test_order_creations_are_not_retried_once_sent(self):
+        """ Test that a request the gateway may have processed is only retried if idempotent. """
+        client = NEGDiClient('http://negdi.test/api/pay')
+        for failure in (
+            requests.exceptions.ReadTimeout(), self._http_error(500), self._http_error(504),
+            self._aborted_connection_error(),
+        ):
+            with self.assertRaises(type(failure)):
+                self._post_with_failures(client, const.NEGDI_CREATE_ORDER_ENDPOINT, [failure])
+            post_mock = self._post_with_failures(
+                client, const.NEGDI_INQUIRY_ORDER_ENDPOINT, [failure]
+            )
+            self.assertEqual(post_mock.call_count, 2)
+
+    def test_retries_are_bounded(self):
+        """ Test that a request is retried at most `max_retries` times and within its budget. """
+        client = NEGDiClient('http://negdi.test/api/pay', max_retries=2)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self._post_with_failures(
+                client, const.NEGDI_INQUIRY_ORDER_ENDPOINT,
+                [requests.exceptions.ConnectionError() for _i in range(3)],
+            )
+        client = NEGDiClient('http://negdi.test/api/pay', connect_timeout=5, retry_budget=4)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self._post_with_failures(
+                client, const.NEGDI_INQUIRY_ORDER_ENDPOINT, [requests.exceptions.ConnectionError()]
+            )
+
+    def test_checkout_retries_are_bounded_by_the_read_timeout(self):
+        """ Test that the retries of a checkout request do not exceed its read timeout, while the
+        background requests use the whole retry budget. """
+        client = NEGDiClient(
+            'http://negdi.test/api/pay', connect_timeout=5, read_timeout=4, retry_budget=90
+        )
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self._post_with_failures(
+                client, const.NEGDI_CREATE_ORDER_ENDPOINT, [self._connect_error()]
+            )
+        post_mock = self._post_with_failures(
+            client, const.NEGDI_INQUIRY_ORDER_ENDPOINT, [self._connect_error()]
+        )
+        self.assertEqual(post_mock.call_count, 2)
+
+    def test_rejected_requests_are_not_retried(self):
+        """ Test that a request rejected by the rate limiter is not sent again. """
+        rate_limiter = Mock(acquire=Mock(side_effect=RateLimitError()))
+        client = NEGDiClient('http://negdi.test/api/pay', rate_limiter=rate_limiter)
+        with self.assertRaises(RateLimitError):
+            self._post_with_failures(client, const.NEGDI_INQUIRY_ORDER_ENDPOINT, [])
+        self.assertEqual(rate_limiter.acquire.call_count, 1)
@@ -0,0 +1,40 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import datetime
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from odoo.addons.payment_negdi.client import NEGDiClient
+from odoo.addons.payment_negdi.tests.common import NEGDiCommon
+
+
+@tagged('post_install', '-at_install')
+class TestNEGDiExchange(NEGDiCommon):
+
+    def test_exchanges_are_archived_redacted(self):
+        """ Test that an ec1000 exchange is archived without credentials and can be found by
+        tranid. """
+        tx = self._create_transaction(flow='redirect')
+        with patch.object(NEGDiClient, 'post', return_value=self.ec1000_response):
+            tx._negdi_make_ec1000_request()
+
+        exchange = self.env['payment.negdi.exchange'].search([('tranid', '=', self.tranid)])
+        self.assertEqual(len(exchange), 1)
+        self.assertEqual((exchange.kind, exchange.reference), ('ec1000', tx.reference))
+        self.assertIn(self.check_id, exchange.payload)
+        self.assertNotIn('dummy', exchange.payload)  # The password of the provider.
+
+    def test_partitions_past_the_retention_are_dropped(self):
+        """ Test that the monthly partitions are created ahead and dropped in bulk after the
+        retention period. """
+        Exchange = self.env['payment.negdi.exchange']
+        month = datetime.date(2000, 1, 1)
+        with patch.object(type(Exchange), '_get_current_month', return_value=month):
+            Exchange._create_partitions()
+        self.assertIn(month, Exchange._get_partitions())
+
+        Exchange._drop_partitions(datetime.date(2000, 2, 1))
+        partitions = Exchange._get_partitions()
+        self.assertNotIn(month, partitions)
+        self.assertIn(datetime.date(2000, 2, 1), partitions)
@@ -0,0 +1,58 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+import requests
+
+from odoo.tests import tagged
+from odoo.tests.common import BaseCase
+
+from odoo.addons.payment_negdi import const, metrics
+from odoo.addons.payment_negdi.client import NEGDiClient
+
+
+@tagged('post_install', '-at_install')
+class TestNEGDiMetrics(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        for name, value in (('_directory', directory), ('_counters', {}), ('_histograms', {})):
+            patcher = patch.object(metrics, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.directory = directory
+
+    def test_request_outcomes_are_counted(self):
+        """ Test that the client counts its requests by endpoint and outcome. """
+        client = NEGDiClient('http://negdi.test/api/pay', max_retries=0)
+        with patch.object(client.session, 'post') as post_mock:
+            post_mock.return_value.status_code = 200
+            post_mock.return_value.json.return_value = {}
+            client.post(const.NEGDI_CREATE_ORDER_ENDPOINT, {})
+            post_mock.side_effect = requests.exceptions.ReadTimeout()
+            with self.assertRaises(requests.exceptions.Timeout):
+                client.post(const.NEGDI_INQUIRY_ORDER_ENDPOINT, {})
+        counters, histograms = metrics.collect()
+        self.assertEqual(counters[
+            ('negdi_requests_total', (('endpoint', 'ec1000'), ('outcome', 'success')))
+        ], 1)
+        self.assertEqual(counters[
+            ('negdi_requests_total', (('endpoint', 'ec1098'), ('outcome', 'timeout')))
+        ], 1)
+        self.assertEqual(histograms[
+            ('negdi_request_duration_seconds', (('endpoint', 'ec1000'), ('outcome', 'success')))
+        ][-1], 1)
+
+    def test_snapshots_of_all_workers_are_merged(self):
+        """ Test that the metrics of the other worker processes are added to the exposition. """
+        metrics.inc('negdi_transaction_states_total', state='done')
+        with open(os.path.join(self.directory, '0.json'), 'w') as file:
+            json.dump({
+                'counters': [['negdi_transaction_states_total', {'state': 'done'}, 2]],
+                'histograms': [],
+            }, file)
+        self.assertIn('negdi_transaction_states_total{state="done"} 3\n', metrics.render())
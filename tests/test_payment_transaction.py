@@ -1,9 +1,25 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import base64
+import itertools
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import psycopg2
+import requests
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from odoo.exceptions import ValidationError
+from odoo.fields import Command
 from odoo.tests import tagged
 from odoo.tools import mute_logger
 
 from odoo.addons.payment import utils as payment_utils
+from odoo.addons.payment.controllers.post_processing import PaymentPostProcessing
+from .. import utils as negdi_utils
+from ..client import NEGDiClient
+from ..const import NEGDI_STATUS_CHANNEL
 from ..controllers.main import NEGDiController
 from ..tests.common import NEGDiCommon
 
@@ -17,52 +33,25 @@ class TestPaymentTransaction(NEGDiCommon):
             reference = self.env['payment.transaction']._compute_reference('negdi', prefix=prefix)
             self.assertRegex(reference, r'^[\w-]+$')
 
-    def test_no_item_missing_from_rendering_values(self):
-        """ Test that the rendered values are conform to the transaction fields. """
+    def test_no_item_missing_from_ec1000_payload(self):
+        """ Test that the ec1000 payload is conform to the transaction and provider fields. """
         self.env['ir.config_parameter'].set_param('web.base.url', 'http://127.0.0.1:8069')
         self.patch(self, 'base_url', lambda: 'http://127.0.0.1:8069')
 
         tx = self._create_transaction(flow='redirect')
 
-        converted_amount = payment_utils.to_minor_currency_units(self.amount, self.currency)
         expected_values = {
-            'command': 'PURCHASE',
-            'access_code': self.provider.negdi_access_code,
-            'merchant_identifier': self.provider.negdi_merchant_identifier,
-            'merchant_reference': tx.reference,
-            'payment_option': 'UNKNOWN',
-            'amount': str(converted_amount),
+            'ordertype': '3dsOrder',
+            'terminalid': self.provider.negdi_terminal_identifier,
+            'username': self.provider.negdi_username,
+            'password': self.provider.negdi_password,
+            'returnurl': self._build_url(NEGDiController._return_url),
+            'amount': tx.amount,
             'currency': self.currency.name,
-            'language': tx.partner_lang[:2],
-            'customer_email': tx.partner_id.email_normalized,
-            'return_url': self._build_url(NEGDiController._return_url),
-            'signature': 'c9b9f35a607606c045f8882e762a4a4a35572cf230fe1cd45fa18d7c8681aeb9',
-            'api_url': self.provider._negdi_get_api_url(),
+            'ordernum': tx.reference,
+            'description': tx.reference,
         }
-        self.assertEqual(tx._get_specific_rendering_values(None), expected_values)
-
-    @mute_logger('odoo.addons.payment.models.payment_transaction')
-    def test_no_input_missing_from_redirect_form(self):
-        """ Test that the no key is not omitted from the rendering values. """
-        tx = self._create_transaction(flow='redirect')
-        expected_input_keys = [
-            'command',
-            'access_code',
-            'merchant_identifier',
-            'merchant_reference',
-            'amount',
-            'currency',
-            'language',
-            'customer_email',
-            'signature',
-            'payment_option',
-            'return_url',
-        ]
-        processing_values = tx._get_processing_values()
-        form_info = self._extract_values_from_html_form(processing_values['redirect_form_html'])
-        self.assertEqual(form_info['action'], 'https://sbcheckout.payfort.com/FortAPI/paymentPage')
-        self.assertEqual(form_info['method'], 'post')
-        self.assertListEqual(list(form_info['inputs'].keys()), expected_input_keys)
+        self.assertEqual(tx._negdi_prepare_ec1000_payload(), expected_values)
 
     def test_processing_notification_data_confirms_transaction(self):
         """ Test that the transaction state is set to 'done' when the notification data indicate a
@@ -70,3 +59,548 @@ class TestPaymentTransaction(NEGDiCommon):
         tx = self._create_transaction(flow='redirect')
         tx._process_notification_data(self.notification_data)
         self.assertEqual(tx.state, 'done')
+
+    def test_ec1000_payload_is_prepared_without_calling_negdi(self):
+        """ Test that preparing the ec1000 payload does not contact NEGDi, so that the two-phase
+        checkout can commit between the preparation and the call. """
+        tx = self._create_transaction(flow='redirect')
+        with patch.object(NEGDiClient, 'post') as post_mock:
+            payload = tx._negdi_prepare_ec1000_payload()
+        self.assertEqual(post_mock.call_count, 0)
+        self.assertEqual(payload['terminalid'], self.provider.negdi_terminal_identifier)
+        self.assertEqual(payload['description'], tx.reference)
+
+    def test_ec1000_response_saves_negdi_order(self):
+        """ Test that the tranid and checkid of the created NEGDi order are saved on the
+        transaction. """
+        tx = self._create_transaction(flow='redirect')
+        with patch.object(NEGDiClient, 'post', return_value=self.ec1000_response):
+            negdi_url = tx._negdi_send_ec1000_request(tx._negdi_prepare_ec1000_payload())
+        self.assertEqual(negdi_url, self.ec1000_response['order']['negdiurl'])
+        self.assertEqual(tx.provider_reference, self.tranid)
+        self.assertEqual(tx.negdi_check_id, self.check_id)
+
+    @mute_logger('odoo.addons.payment_negdi.models.payment_transaction')
+    def test_ec1000_response_without_checkid_is_rejected(self):
+        """ Test that an order without checkid sets the transaction in error, as the transaction
+        could not be found by its tranid afterwards. """
+        tx = self._create_transaction(flow='redirect')
+        response = {'order': dict(self.ec1000_response['order'], checkid=None)}
+        with (
+            patch.object(NEGDiClient, 'post', return_value=response),
+            self.assertRaises(ValidationError),
+        ):
+            tx._negdi_send_ec1000_request(tx._negdi_prepare_ec1000_payload())
+        self.assertEqual(tx.state, 'error')
+
+    @mute_logger('odoo.addons.payment_negdi.models.payment_transaction')
+    def test_non_json_response_is_reported_as_invalid(self):
+        """ Test that a response that is not JSON is reported as an invalid response rather than a
+        communication error, although `requests` raises it as a `RequestException`. """
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'<html>Maintenance</html>'
+        tx = self._create_transaction(
+            flow='redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
+        with patch.object(NEGDiClient, 'post', side_effect=lambda *_args, **_kw: response.json()):
+            with self.assertRaisesRegex(ValidationError, "invalid response"):
+                tx._negdi_make_inquiry_request(check_id=self.check_id)
+            with self.assertRaisesRegex(ValidationError, "invalid response"):
+                tx._negdi_send_ec1000_request(tx._negdi_prepare_ec1000_payload())
+        self.assertEqual(tx.state, 'error')
+        self.assertEqual(tx.state_message, "NEGDi: Invalid response received.")
+
+    def test_provider_config_is_cached_until_the_provider_is_written(self):
+        """ Test that the provider configuration is read once and rebuilt after a write. """
+        config = self.provider._negdi_get_config()
+        with self.assertQueryCount(0):
+            self.assertIs(self.provider._negdi_get_config(), config)
+        self.assertEqual(config.terminal_id, self.provider.negdi_terminal_identifier)
+        self.assertNotIn(self.provider.negdi_password, repr(config))
+
+        self.provider.negdi_terminal_identifier = '90000002'
+        self.assertEqual(self.provider._negdi_get_config().terminal_id, '90000002')
+
+    def test_provider_write_only_invalidates_the_negdi_cache_entries(self):
+        """ Test that writing a provider rebuilds its configuration without clearing the whole
+        registry cache. """
+        config = self.provider._negdi_get_config()
+        with patch.object(type(self.registry), 'clear_cache') as clear_cache_mock:
+            self.provider.negdi_terminal_identifier = '90000003'
+            self.assertIsNot(self.provider._negdi_get_config(), config)
+        self.assertEqual(clear_cache_mock.call_count, 0)
+
+    def test_return_url_follows_the_website_domain(self):
+        """ Test that the return URL sent to NEGDi is not kept in the cached configuration. """
+        tx = self._create_transaction(flow='redirect')
+        tx._negdi_prepare_ec1000_payload()  # Cache the configuration.
+        with patch.object(
+            self.registry['payment.provider'], 'get_base_url', return_value='https://shop.test'
+        ):
+            payload = tx._negdi_prepare_ec1000_payload()
+        self.assertEqual(payload['returnurl'], f'https://shop.test{NEGDiController._return_url}')
+
+    def test_orders_are_spread_over_the_terminals(self):
+        """ Test that the orders are created through the terminals of the provider according to
+        their weight, and that inquiries use the credentials of the terminal of the order. """
+        terminals = self.env['payment.negdi.terminal'].create([{
+            'provider_id': self.provider.id,
+            'name': f'9100000{i}',
+            'username': f'merchant{i}',
+            'password': f'secret{i}',
+            'weight': i,
+        } for i in (1, 2)])
+        txs = self.env['payment.transaction']
+        for i in range(6):
+            tx = self._create_transaction(flow='redirect', reference=f'terminal-{i}')
+            payload = tx._negdi_prepare_ec1000_payload()
+            self.assertEqual(payload['terminalid'], tx.negdi_terminal_id.name)
+            txs |= tx
+        self.assertEqual(len(txs.filtered(lambda tx: tx.negdi_terminal_id == terminals[1])), 4)
+
+        tx.provider_reference = self.tranid
+        terminals.active = False  # Archived terminals keep answering the inquiries of their orders.
+        payload = tx._negdi_prepare_inquiry_payload(self.check_id)
+        self.assertEqual(
+            (payload['terminalid'], payload['password']),
+            (tx.negdi_terminal_id.name, tx.negdi_terminal_id.password),
+        )
+
+    def test_provider_credentials_are_used_when_all_terminals_are_archived(self):
+        """ Test that the orders are created with the credentials of the provider once all its
+        terminals are archived. """
+        self.env['payment.negdi.terminal'].create({
+            'provider_id': self.provider.id,
+            'name': '91000001',
+            'username': 'merchant1',
+            'password': 'secret1',
+            'active': False,
+        })
+        tx = self._create_transaction(flow='redirect')
+        payload = tx._negdi_prepare_ec1000_payload()
+        self.assertFalse(tx.negdi_terminal_id)
+        self.assertEqual(payload['terminalid'], self.provider.negdi_terminal_identifier)
+
+    def test_custom_api_url_is_used_for_requests(self):
+        """ Test that a custom API URL, e.g. that of a local simulator, replaces the default one. """
+        self.provider.negdi_api_url = 'http://localhost:8099/'
+        client = self.provider._negdi_get_client()
+        self.assertEqual(client.get_url('ec1000'), 'http://localhost:8099/ec1000')
+
+    def test_precreated_order_is_discarded_when_the_cart_changes(self):
+        """ Test that a pre-created NEGDi order is reused as long as the cart amount is unchanged
+        and discarded otherwise. """
+        product = self.env['product.product'].create({'name': "Chair", 'list_price': 100.0})
+        order = self.env['sale.order'].create({
+            'partner_id': self.partner.id,
+            'order_line': [Command.create({'product_id': product.id})],
+        })
+        tx = self._create_transaction(
+            flow='redirect',
+            amount=order.amount_total,
+            currency_id=order.currency_id.id,
+            sale_order_ids=[Command.set(order.ids)],
+            negdi_payment_url=self.ec1000_response['order']['negdiurl'],
+            negdi_precreated=True,
+        )
+        get_precreated_tx = self.env['payment.transaction']._negdi_get_precreated_transaction
+        self.assertEqual(get_precreated_tx(order, self.provider.id, tx.payment_method_id.id), tx)
+
+        order.order_line.product_uom_qty = 2
+        self.assertFalse(get_precreated_tx(order, self.provider.id, tx.payment_method_id.id))
+        self.assertEqual(tx.state, 'cancel')
+
+    def test_handed_over_order_is_not_discarded_when_the_cart_changes(self):
+        """ Test that the NEGDi order of a transaction the customer was redirected to is kept when
+        the cart changes, as the customer may be paying it. """
+        product = self.env['product.product'].create({'name': "Chair", 'list_price': 100.0})
+        order = self.env['sale.order'].create({
+            'partner_id': self.partner.id,
+            'order_line': [Command.create({'product_id': product.id})],
+        })
+        tx = self._create_transaction(
+            flow='redirect',
+            amount=order.amount_total,
+            currency_id=order.currency_id.id,
+            sale_order_ids=[Command.set(order.ids)],
+            negdi_payment_url=self.ec1000_response['order']['negdiurl'],
+        )
+        order.order_line.product_uom_qty = 2
+        self.assertFalse(self.env['payment.transaction']._negdi_get_precreated_transaction(
+            order, self.provider.id, tx.payment_method_id.id
+        ))
+        self.assertEqual(tx.state, 'draft')
+
+    def test_repeated_payment_request_reuses_the_transaction(self):
+        """ Test that a payment request repeated with the same idempotency key is given the
+        transaction of the first request as long as the cart amount is unchanged. """
+        product = self.env['product.product'].create({'name': "Chair", 'list_price': 100.0})
+        order = self.env['sale.order'].create({
+            'partner_id': self.partner.id,
+            'order_line': [Command.create({'product_id': product.id})],
+        })
+        tx = self._create_transaction(
+            flow='redirect',
+            amount=order.amount_total,
+            currency_id=order.currency_id.id,
+            sale_order_ids=[Command.set(order.ids)],
+            negdi_payment_url=self.ec1000_response['order']['negdiurl'],
+            negdi_idempotency_key='key-1',
+        )
+        get_idempotent_tx = self.env['payment.transaction']._negdi_get_idempotent_transaction
+        self.assertEqual(get_idempotent_tx('key-1', order, self.provider.id), tx)
+        self.assertFalse(get_idempotent_tx('key-2', order, self.provider.id))
+
+        order.order_line.product_uom_qty = 2
+        self.assertFalse(get_idempotent_tx('key-1', order, self.provider.id))
+
+    def test_orders_are_created_in_batch_with_partial_failures(self):
+        """ Test that creating NEGDi orders in batch saves the successful ones and sets the failed
+        ones in error without stopping the batch. """
+        txs = self.env['payment.transaction']
+        for i in range(3):
+            txs |= self._create_transaction(flow='redirect', reference=f'batch-{i}')
+
+        def post(_client, _endpoint, payload, **_kwargs):
+            if payload['description'] == 'batch-1':
+                raise requests.exceptions.ConnectionError()
+            tranid = f"{self.tranid}{payload['description'][-1]}"
+            return {'order': {'tranid': tranid, 'checkid': self.check_id, 'negdiurl': tranid}}
+
+        with patch.object(NEGDiClient, 'post', autospec=True, side_effect=post):
+            results = txs._negdi_create_orders(max_workers=2)
+
+        self.assertEqual(results[txs[0].id], {'url': f'{self.tranid}0'})
+        self.assertIn('error', results[txs[1].id])
+        self.assertEqual(txs.mapped('state'), ['draft', 'error', 'draft'])
+        self.assertEqual(txs[2].provider_reference, f'{self.tranid}2')
+
+    def test_payment_links_are_created_for_several_documents(self):
+        """ Test that the payment links of several invoices or sale orders get distinct references,
+        and that the documents without amount due or without provider are reported. """
+        tranids = itertools.count(int(self.tranid))
+
+        def post(_client, _endpoint, payload, **_kwargs):
+            tranid = next(tranids)
+            return {'order': {
+                'tranid': tranid, 'checkid': self.check_id, 'negdiurl': f'https://negdi.test/{tranid}'
+            }}
+
+        product = self.env['product.product'].create({'name': "Chair", 'list_price': 100.0})
+        free_product = self.env['product.product'].create({'name': "Sample", 'list_price': 0.0})
+        orders = self.env['sale.order'].create([{
+            'partner_id': self.partner.id,
+            'order_line': [Command.create({'product_id': line_product.id})],
+        } for line_product in (product, product, free_product)])
+        invoices = self.env['account.move'].create([{
+            'move_type': 'out_invoice',
+            'partner_id': self.partner.id,
+            'invoice_line_ids': [Command.create({'name': "Chair", 'price_unit': 100.0})],
+        } for _i in range(2)])
+        invoices.action_post()
+
+        PaymentTransaction = self.env['payment.transaction']
+        with (
+            patch.object(NEGDiClient, 'post', autospec=True, side_effect=post),
+            # All the references of the batch would share the same prefix.
+            patch.object(payment_utils, 'singularize_reference_prefix', return_value='tx-batch'),
+        ):
+            order_txs, order_results = PaymentTransaction._negdi_create_payment_links(orders)
+            invoice_txs, invoice_results = PaymentTransaction._negdi_create_payment_links(invoices)
+
+        txs = order_txs + invoice_txs
+        self.assertEqual(len(txs), 4)
+        self.assertEqual(len(set(txs.mapped('reference'))), 4)
+        self.assertEqual(order_txs.sale_order_ids, orders[:2])
+        self.assertEqual(invoice_txs.invoice_ids, invoices)
+        for document, results in ((orders[0], order_results), (invoices[0], invoice_results)):
+            self.assertTrue(results[document.id]['url'].startswith('https://negdi.test/'))
+        self.assertIn('error', order_results[orders[2].id])
+
+        self.provider.state = 'disabled'
+        txs, results = PaymentTransaction._negdi_create_payment_links(orders[:1])
+        self.assertFalse(txs)
+        self.assertIn('error', results[orders[0].id])
+
+    def test_state_changes_are_pushed_to_the_status_page(self):
+        """ Test that the new state of a NEGDi transaction is sent on its bus channel. """
+        tx = self._create_transaction(flow='redirect')
+        with patch.object(type(self.env['bus.bus']), '_sendmany') as sendmany_mock:
+            tx._process_notification_data(self.notification_data)
+        sendmany_mock.assert_any_call([(tx, 'payment_negdi/status', {'state': 'done'})])
+
+    def test_status_page_subscribes_to_the_monitored_transaction(self):
+        """ Test that subscribing to the status channel over the websocket, where only the
+        websocket request is bound, returns the channel of the monitored transaction. """
+        tx = self._create_transaction(flow='redirect')
+        wsrequest = SimpleNamespace(session={PaymentPostProcessing.MONITORED_TX_ID_KEY: tx.id})
+        with patch('odoo.addons.payment_negdi.models.ir_websocket.wsrequest', wsrequest):
+            channels = self.env['ir.websocket']._build_bus_channel_list([NEGDI_STATUS_CHANNEL])
+        self.assertIn(tx, channels)
+        self.assertNotIn(NEGDI_STATUS_CHANNEL, channels)
+
+    def test_deferred_inquiry_is_processed_by_the_cron(self):
+        """ Test that a deferred return inquiry is made by the background worker and resolves the
+        transaction. """
+        tx = self._create_transaction(
+            flow='redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
+        tx._negdi_defer_inquiry(self.check_id)
+        self.assertTrue(tx.negdi_inquiry_requested_at)
+        with patch.object(NEGDiClient, 'post', return_value=self.notification_data):
+            tx._cron_negdi_process_deferred_inquiries()
+        self.assertFalse(tx.negdi_inquiry_requested_at)
+        self.assertEqual(tx.state, 'done')
+
+    def test_reconciliation_resolves_stale_transactions(self):
+        """ Test that the reconciliation cron makes the inquiry of stale pending transactions and
+        leaves the recent ones alone. """
+        stale_tx = self._create_transaction(
+            flow='redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
+        recent_tx = self._create_transaction(
+            flow='redirect', reference='recent', provider_reference='1', negdi_check_id='x'
+        )
+        self.env.cr.execute(
+            "UPDATE payment_transaction SET create_date = now() - interval '1 day' WHERE id = %s",
+            [stale_tx.id],
+        )
+        stale_tx.invalidate_recordset(['create_date'])
+        with patch.object(NEGDiClient, 'post', return_value=self.notification_data) as post_mock:
+            self.env['payment.transaction']._cron_negdi_reconcile_pending_transactions()
+        self.assertEqual(post_mock.call_count, 1)
+        self.assertEqual(stale_tx.state, 'done')
+        self.assertEqual(recent_tx.state, 'draft')
+
+    def test_reconciliation_reports_its_actual_progress(self):
+        """ Test that the reconciliation cron only reports the resolved transactions as done and
+        leaves out the transactions older than the maximum age. """
+        failing_tx = self._create_transaction(
+            flow='redirect', reference='failing', provider_reference='1', negdi_check_id='x'
+        )
+        tx = self._create_transaction(
+            flow='redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
+        old_tx = self._create_transaction(
+            flow='redirect', reference='old', provider_reference='2', negdi_check_id='y'
+        )
+        self.env.cr.execute("""
+            UPDATE payment_transaction
+               SET create_date = now() - CASE WHEN id = %s THEN interval '30 days'
+                                              ELSE interval '1 day' END
+             WHERE id IN %s
+        """, [old_tx.id, (failing_tx + tx + old_tx)._ids])
+        (failing_tx + tx + old_tx).invalidate_recordset(['create_date'])
+
+        def post(_client, _endpoint, payload, **_kwargs):
+            if payload['tranid'] == 1:
+                raise requests.exceptions.ConnectTimeout()
+            return self.notification_data
+
+        with (
+            patch.object(NEGDiClient, 'post', autospec=True, side_effect=post) as post_mock,
+            patch.object(self.registry['ir.cron'], '_notify_progress') as notify_progress_mock,
+        ):
+            self.env['payment.transaction']._cron_negdi_reconcile_pending_transactions()
+        self.assertEqual(post_mock.call_count, 2)
+        notify_progress_mock.assert_called_once_with(done=1, remaining=1)
+        self.assertEqual(old_tx.state, 'draft')
+
+    def test_inquiry_failures_are_counted_without_stopping_the_run(self):
+        """ Test that a failed inquiry is reported and does not prevent processing the others. """
+        failing_tx = self._create_transaction(
+            flow='redirect', reference='failing', provider_reference='1', negdi_check_id='x'
+        )
+        tx = self._create_transaction(
+            flow='redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
+
+        def post(_client, _endpoint, payload, **_kwargs):
+            if payload['tranid'] == 1:
+                raise requests.exceptions.ConnectTimeout()
+            return self.notification_data
+
+        with patch.object(NEGDiClient, 'post', autospec=True, side_effect=post):
+            stats = (failing_tx + tx)._negdi_run_inquiries(max_workers=2)
+        self.assertEqual(stats['processed'], 1)
+        self.assertEqual(stats['errors'], {'timeout': 1})
+        self.assertEqual(tx.state, 'done')
+
+    def test_inquiry_locks_are_kept_until_the_responses_are_processed(self):
+        """ Test that the inquiries run only commits once every inquiry sent since the last commit
+        was processed, as the commit releases the locks of their transactions. """
+        txs = self.env['payment.transaction']
+        for i in range(3):
+            txs |= self._create_transaction(
+                flow='redirect', reference=f'chunk-{i}', provider_reference=str(i + 1),
+                negdi_check_id=f'check-{i}',
+            )
+        commits = []
+
+        def commit():
+            commits.append((post_mock.call_count, len(txs.filtered(lambda tx: tx.state == 'done'))))
+
+        with (
+            patch.object(NEGDiClient, 'post', return_value=self.notification_data) as post_mock,
+            patch.object(self.env.cr, 'commit', side_effect=commit),
+        ):
+            stats = txs._negdi_run_inquiries(max_workers=2, chunk_size=1)
+        self.assertEqual(stats['processed'], 3)
+        self.assertGreaterEqual(len(commits), 3)
+        for sent_count, processed_count in commits:
+            self.assertEqual(sent_count, processed_count)
+
+    @mute_logger('odoo.sql_db')
+    def test_negdi_tranid_is_unique(self):
+        """ Test that two NEGDi transactions cannot share the same tranid. """
+        self._create_transaction(
+            flow='redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
+        with self.assertRaises(psycopg2.IntegrityError), self.env.cr.savepoint():
+            self._create_transaction(
+                flow='redirect', reference='duplicate', provider_reference=self.tranid,
+                negdi_check_id='other',
+            )
+
+    def test_tranid_lookup_ignores_other_providers(self):
+        """ Test that a tranid only resolves to NEGDi transactions. """
+        tx = self._create_transaction(
+            flow='redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
+        self.assertEqual(self.env['payment.transaction']._negdi_search_by_tranid(self.tranid), tx)
+        self.assertFalse(self.env['payment.transaction']._negdi_search_by_tranid('unknown'))
+
+    def test_final_transactions_are_not_inquired_again(self):
+        """ Test that a transaction already in a final state is neither inquired nor updated. """
+        tx = self._create_transaction(
+            flow='redirect', state='done', provider_reference=self.tranid,
+            negdi_check_id=self.check_id,
+        )
+        with patch.object(NEGDiClient, 'post') as post_mock:
+            stats = tx._negdi_run_inquiries()
+        self.assertEqual(post_mock.call_count, 0)
+        self.assertEqual(stats['skipped'], 1)
+
+        cancelled_data = {'order': dict(self.notification_data['order'], status='Cancelled')}
+        tx._process_notification_data(cancelled_data)
+        self.assertEqual(tx.state, 'done')
+
+    def _configure_signature_key(self):
+        """ Configure a freshly generated NEGDi public key and return a function signing an order
+        with the matching private key. """
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.provider.negdi_public_key = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+        return lambda order_data: base64.b64encode(private_key.sign(
+            negdi_utils.get_signed_bytes(order_data), padding.PKCS1v15(), hashes.SHA256()
+        )).decode()
+
+    def test_notification_with_valid_signature_is_processed(self):
+        """ Test that a correctly signed notification is processed and that the public key is only
+        parsed once for several notifications. """
+        sign = self._configure_signature_key()
+        tx = self._create_transaction(flow='redirect', provider_reference=self.tranid)
+        notification_data = dict(
+            self.notification_data, ordersign=sign(self.notification_data['order'])
+        )
+        with patch(
+            'odoo.addons.payment_negdi.models.payment_provider.serialization.load_pem_public_key',
+            wraps=serialization.load_pem_public_key,
+        ) as load_key_mock:
+            tx._negdi_verify_signature(
+                notification_data['ordersign'],
+                negdi_utils.get_signed_bytes(notification_data['order']),
+            )
+            tx._process_notification_data(notification_data)
+        self.assertEqual(load_key_mock.call_count, 1)
+        self.assertEqual(tx.state, 'done')
+
+    @mute_logger('odoo.addons.payment_negdi.models.payment_transaction')
+    def test_notification_with_invalid_signature_is_rejected(self):
+        """ Test that a notification whose order was tampered with sets the transaction in error. """
+        sign = self._configure_signature_key()
+        tx = self._create_transaction(flow='redirect', provider_reference=self.tranid)
+        tampered_order = dict(self.notification_data['order'], amount=1)
+        notification_data = {
+            'order': tampered_order, 'ordersign': sign(self.notification_data['order'])
+        }
+        tx._process_notification_data(notification_data)
+        self.assertEqual(tx.state, 'error')
+
+    @mute_logger('odoo.addons.payment_negdi.models.payment_transaction')
+    def test_notification_without_signature_is_rejected_when_key_is_set(self):
+        """ Test that an unsigned notification is rejected once the public key is configured. """
+        self._configure_signature_key()
+        tx = self._create_transaction(flow='redirect', provider_reference=self.tranid)
+        tx._process_notification_data(self.notification_data)
+        self.assertEqual(tx.state, 'error')
+
+    def test_order_results_are_resolved_without_queries(self):
+        """ Test that NEGDi statuses and payment methods are resolved from the precompiled tables,
+        case-insensitively and without querying the database once the tables are built. """
+        card = self.env['payment.method']._get_from_code('card')
+        PaymentTransaction = self.env['payment.transaction']
+        PaymentTransaction._negdi_resolve_order_results([])  # Build the payment method table.
+        orders_data = [
+            {'status': 'Approved', 'paymentmethod': 'Card'},
+            {'status': 'transaction EXPECTED', 'paymentmethod': 'CARD'},
+            {'status': 'Unknown', 'paymentmethod': 'Unknown'},
+        ]
+        with self.assertQueryCount(0):
+            results = PaymentTransaction._negdi_resolve_order_results(orders_data)
+        self.assertEqual(results, [('done', card.id), ('pending', card.id), (None, None)])
+
+    def test_archived_payment_methods_are_not_resolved(self):
+        """ Test that the payment method of a NEGDi order is not resolved to an archived method,
+        as `_get_from_code` would not either. """
+        card = self.env['payment.method']._get_from_code('card')
+        PaymentTransaction = self.env['payment.transaction']
+        PaymentTransaction._negdi_resolve_order_results([])  # Build the payment method table.
+        card.active = False
+        results = PaymentTransaction._negdi_resolve_order_results([{'paymentmethod': 'Card'}])
+        self.assertEqual(results, [(None, None)])
+
+    def test_replayed_result_is_not_applied_again(self):
+        """ Test that a result matching the state and the fields of its transaction is skipped
+        without querying the database. """
+        tx = self._create_transaction(
+            flow='redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
+        pending_data = {
+            'order': dict(self.notification_data['order'], status='transaction EXPECTED')
+        }
+        tx._process_notification_data(pending_data)
+        self.assertEqual(tx.state, 'pending')
+        self.assertEqual(tx.negdi_approval_code, '123456')
+        with self.assertQueryCount(0):
+            tx._process_notification_data(pending_data)
+
+    def test_results_are_applied_in_bulk(self):
+        """ Test that the transactions reaching the same state are written together, along with
+        the other fields of their results. """
+        card = self.env['payment.method']._get_from_code('card')
+        txs = self.env['payment.transaction']
+        for i in range(3):
+            txs |= self._create_transaction(
+                flow='redirect', reference=f'bulk-{i}', provider_reference=str(i + 1),
+                negdi_check_id=f'check-{i}',
+            )
+        orders_data = [
+            dict(self.notification_data['order'], tranid=1, approvalCode='A1'),
+            dict(self.notification_data['order'], tranid=2, approvalCode='A2'),
+            dict(self.notification_data['order'], tranid=3, status='transaction EXPECTED'),
+        ]
+        PaymentTransaction = self.registry['payment.transaction']
+        with patch.object(
+            PaymentTransaction, 'write', autospec=True, side_effect=PaymentTransaction.write
+        ) as write_mock:
+            updated_txs = txs._negdi_apply_results(orders_data)
+        self.assertEqual(write_mock.call_count, 5)  # One write per result values and new state.
+        self.assertEqual(updated_txs, txs)
+        self.assertEqual(txs.mapped('state'), ['done', 'done', 'pending'])
+        self.assertEqual(txs.mapped('negdi_approval_code'), ['A1', 'A2', '123456'])
+        self.assertEqual(txs.payment_method_id, card)
+        with self.assertQueryCount(0):
+            self.assertFalse(txs._negdi_apply_results(orders_data))
@@ -2,11 +2,14 @@
 
 from unittest.mock import patch
 
+import psycopg2
 from werkzeug.exceptions import Forbidden
 
 from odoo.tests import tagged
 from odoo.tools import mute_logger
 
+from odoo.addons.payment_negdi.client import NEGDiClient
+from odoo.addons.payment_negdi.const import NEGDI_INQUIRY_ORDER_ENDPOINT
 from odoo.addons.payment_negdi.controllers.main import NEGDiController
 from odoo.addons.payment_negdi.tests.common import NEGDiCommon
 
@@ -15,48 +18,91 @@ from odoo.addons.payment_negdi.tests.common import NEGDiCommon
 class TestProcessingFlows(NEGDiCommon):
 
     @mute_logger('odoo.addons.payment_negdi.controllers.main')
-    def test_redirect_notification_triggers_processing(self):
-        """ Test that receiving a redirect notification triggers the processing of the notification
-        data. """
-        self._create_transaction(flow='redirect')
+    def test_return_triggers_inquiry_and_processing(self):
+        """ Test that returning from NEGDi triggers an ec1098 inquiry and the processing of its
+        response. """
+        tx = self._create_transaction(
+            'redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
         url = self._build_url(NEGDiController._return_url)
-        with patch(
-            'odoo.addons.payment_negdi.controllers.main.NEGDiController._verify_notification_signature'
-        ), patch(
-            'odoo.addons.payment.models.payment_transaction.PaymentTransaction'
-            '._handle_notification_data'
-        ) as handle_notification_data_mock:
-            self._make_http_post_request(url, data=self.notification_data)
-            self.assertEqual(handle_notification_data_mock.call_count, 1)
+        with patch.object(NEGDiClient, 'post', return_value=self.notification_data) as post_mock:
+            self._make_http_get_request(url, params={'tranid': self.tranid, 'checkid': self.check_id})
+        self.assertEqual(post_mock.call_count, 1)
+        self.assertEqual(post_mock.call_args.args[0], NEGDI_INQUIRY_ORDER_ENDPOINT)
+        self.assertEqual(post_mock.call_args.args[1]['checkid'], self.check_id)
+        self.assertEqual(tx.state, 'done')
 
     @mute_logger('odoo.addons.payment_negdi.controllers.main')
     def test_webhook_notification_triggers_processing(self):
         """ Test that receiving a valid webhook notification triggers the processing of the
-        notification data. """
-        self._create_transaction('redirect')
+        notification data once the inbox is drained. """
+        self._create_transaction(
+            'redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
         url = self._build_url(NEGDiController._webhook_url)
         with patch(
-            'odoo.addons.payment_negdi.controllers.main.NEGDiController._verify_notification_signature'
-        ), patch(
             'odoo.addons.payment.models.payment_transaction.PaymentTransaction'
             '._handle_notification_data'
         ) as handle_notification_data_mock:
-            self._make_http_post_request(url, data=self.notification_data)
+            self._make_json_request(url, data=self.notification_data)
+            self.assertEqual(handle_notification_data_mock.call_count, 0)
+            self.env['payment.negdi.notification']._cron_process_notifications()
             self.assertEqual(handle_notification_data_mock.call_count, 1)
 
+    def test_skipped_notifications_are_processed_shortly_after(self):
+        """ Test that a notification whose transaction is being processed elsewhere is left pending
+        and that the inbox is drained again without waiting for the next scheduled run. """
+        self._create_transaction(
+            'redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
+        Notification = self.env['payment.negdi.notification']
+        Notification._enqueue(self.notification_data)
+        with (
+            patch.object(
+                self.registry['payment.transaction'], '_negdi_lock_for_processing', autospec=True,
+                side_effect=lambda txs: txs.browse(),
+            ),
+            patch.object(self.registry['ir.cron'], '_trigger', autospec=True) as trigger_mock,
+        ):
+            Notification._cron_process_notifications()
+        self.assertEqual(trigger_mock.call_count, 1)
+        self.assertEqual(Notification._get_inbox_metrics()['depth'], 1)
+
     @mute_logger('odoo.addons.payment_negdi.controllers.main')
-    def test_redirect_notification_triggers_signature_check(self):
-        """ Test that receiving a redirect notification triggers a signature check. """
-        self._create_transaction('redirect')
-        url = self._build_url(NEGDiController._return_url)
-        with patch(
-            'odoo.addons.payment_negdi.controllers.main.NEGDiController._verify_notification_signature'
-        ) as signature_check_mock, patch(
-            'odoo.addons.payment.models.payment_transaction.PaymentTransaction'
-            '._handle_notification_data'
+    def test_webhook_notification_is_acknowledged_when_it_cannot_be_stored(self):
+        """ Test that a notification that could not be stored, e.g. because of a database error,
+        is still acknowledged so that NEGDi does not keep sending it. """
+        url = self._build_url(NEGDiController._webhook_url)
+        with patch.object(
+            self.registry['payment.negdi.notification'], '_enqueue',
+            side_effect=psycopg2.OperationalError(),
         ):
-            self._make_http_post_request(url, data=self.notification_data)
-            self.assertEqual(signature_check_mock.call_count, 1)
+            response = self._make_json_request(url, data=self.notification_data)
+        self.assertEqual(response.status_code, 200)
+
+    @mute_logger('odoo.addons.payment_negdi.controllers.main')
+    def test_webhook_notifications_are_deduplicated(self):
+        """ Test that the same notification received twice is only stored once. """
+        url = self._build_url(NEGDiController._webhook_url)
+        self._make_json_request(url, data=self.notification_data)
+        self._make_json_request(url, data=self.notification_data)
+        notifications = self.env['payment.negdi.notification'].search([('tranid', '=', self.tranid)])
+        self.assertEqual(len(notifications), 1)
+        self.assertEqual(
+            self.env['payment.negdi.notification']._get_inbox_metrics()['depth'], 1
+        )
+
+    @mute_logger('odoo.addons.payment_negdi.controllers.main')
+    def test_return_without_identifiers_is_not_processed(self):
+        """ Test that returning from NEGDi without tranid or checkid does not trigger an inquiry. """
+        tx = self._create_transaction(
+            'redirect', provider_reference=self.tranid, negdi_check_id=self.check_id
+        )
+        url = self._build_url(NEGDiController._return_url)
+        with patch.object(NEGDiClient, 'post') as post_mock:
+            self._make_http_get_request(url, params={'tranid': self.tranid})
+        self.assertEqual(post_mock.call_count, 0)
+        self.assertEqual(tx.state, 'draft')
 
     @mute_logger('odoo.addons.payment_negdi.controllers.main')
     def test_webhook_notification_triggers_signature_check(self):
@@ -0,0 +1,78 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.payment_negdi import rate_limiter
+from odoo.addons.payment_negdi.rate_limiter import RateLimiter, RateLimitError
+from odoo.addons.payment_negdi.tests.test_circuit_breaker import _SharedCursor
+
+
+@tagged('post_install', '-at_install')
+class TestRateLimiter(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.limiter = RateLimiter(
+            lambda: _SharedCursor(self.env.cr), 'http://negdi.test/api/pay', reservation_size=1
+        )
+        self.limiter.acquire('checkout')  # Create the buckets.
+
+    def _set_bucket(self, traffic_class, **values):
+        self.env.cr.execute("""
+            UPDATE payment_negdi_rate_limit
+               SET tokens = %(tokens)s, rate = %(rate)s, max_wait = %(max_wait)s
+             WHERE gateway = %(key)s AND traffic_class = %(class)s
+        """, {'key': self.limiter.key, 'class': traffic_class, **values})
+
+    def _get_tokens(self, traffic_class):
+        self.env.cr.execute("""
+            SELECT tokens FROM payment_negdi_rate_limit WHERE gateway = %s AND traffic_class = %s
+        """, [self.limiter.key, traffic_class])
+        return self.env.cr.fetchone()[0]
+
+    def test_requests_fail_fast_once_the_budget_is_exhausted(self):
+        """ Test that a request fails without waiting beyond the maximum wait of its class. """
+        self._set_bucket('background', tokens=0, rate=0.01, max_wait=1)
+        with patch.object(rate_limiter.time, 'sleep') as sleep_mock, self.assertRaises(RateLimitError):
+            self.limiter.acquire('background')
+        self.assertEqual(sleep_mock.call_count, 0)
+
+    def test_requests_wait_for_the_next_token(self):
+        """ Test that a request waits for the next token when it is due within the maximum wait. """
+        self._set_bucket('return', tokens=0, rate=10, max_wait=1)
+        self._set_bucket('background', tokens=0, rate=0.01, max_wait=1)
+
+        def sleep(_duration):
+            self.env.cr.execute("""
+                UPDATE payment_negdi_rate_limit SET updated_at = updated_at - interval '1 second'
+            """)
+
+        with patch.object(rate_limiter.time, 'sleep', side_effect=sleep) as sleep_mock:
+            self.limiter.acquire('return')
+        self.assertAlmostEqual(sleep_mock.call_args[0][0], 0.1)
+
+    def test_checkout_borrows_the_background_budget(self):
+        """ Test that checkouts use the spare tokens of the background inquiries, but not the other
+        way around. """
+        self._set_bucket('checkout', tokens=0, rate=0.01, max_wait=0)
+        self._set_bucket('background', tokens=2, rate=0.01, max_wait=0)
+        self.limiter.acquire('checkout')
+        self.assertAlmostEqual(self._get_tokens('background'), 1)
+
+        self._set_bucket('checkout', tokens=5, rate=0.01, max_wait=0)
+        self._set_bucket('background', tokens=0, rate=0.01, max_wait=0)
+        with self.assertRaises(RateLimitError):
+            self.limiter.acquire('background')
+
+    def test_tokens_are_reserved_in_batches(self):
+        """ Test that a worker takes several tokens of its class at once and consumes them without
+        locking the bucket again. """
+        limiter = RateLimiter(self.limiter.cursor_factory, self.limiter.key, reservation_size=3)
+        self._set_bucket('return', tokens=5, rate=0.01, max_wait=0)
+        with patch.object(limiter, '_execute', wraps=limiter._execute) as execute_mock:
+            for _i in range(3):
+                limiter.acquire('return')
+        self.assertEqual(execute_mock.call_count, 1)
+        self.assertAlmostEqual(self._get_tokens('return'), 2)
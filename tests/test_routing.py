@@ -0,0 +1,45 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import collections
+
+from odoo.tests import tagged
+from odoo.tests.common import BaseCase
+
+from odoo.addons.payment_negdi.routing import TerminalRouter
+
+Terminal = collections.namedtuple('Terminal', ['id', 'weight'])
+
+
+@tagged('post_install', '-at_install')
+class TestNEGDiRouting(BaseCase):
+
+    def test_orders_are_spread_according_to_the_weights(self):
+        """ Test that healthy terminals receive a share of the orders proportional to their weight,
+        without picking the same terminal in a row when it is not needed. """
+        terminals = [Terminal(1, 1), Terminal(2, 2), Terminal(3, 1)]
+        router = TerminalRouter()
+        picks = [router.pick(terminals).id for _i in range(8)]
+        self.assertEqual(collections.Counter(picks), {1: 2, 2: 4, 3: 2})
+        self.assertNotIn((1, 1), zip(picks, picks[1:]))
+
+    def test_failing_and_slow_terminals_receive_fewer_orders(self):
+        """ Test that the share of a terminal decreases with its error rate and its latency, but
+        that a failing terminal keeps receiving some orders. """
+        terminals = [Terminal(1, 1), Terminal(2, 1), Terminal(3, 1)]
+        router = TerminalRouter()
+        for _i in range(20):
+            router.record(1, 0.2, True)
+            router.record(2, 0.8, True)
+            router.record(3, 0.2, False)
+        picks = collections.Counter(router.pick(terminals).id for _i in range(1000))
+        self.assertGreater(picks[1], 3 * picks[2])
+        self.assertGreater(picks[2], picks[3])
+        self.assertGreater(picks[3], 0)
+
+    def test_outcome_of_calls_is_recorded(self):
+        """ Test that the duration and the failure of a call are recorded for its terminal. """
+        router = TerminalRouter()
+        with self.assertRaises(ValueError):
+            router.call(1, int, 'not a number')
+        self.assertEqual(router._error_rates[1], 1)
+        self.assertIn(1, router._latencies)
@@ -0,0 +1,88 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import csv
+import decimal
+import io
+
+from odoo import fields
+from odoo.tests import tagged
+from odoo.tests.common import BaseCase
+
+from odoo.addons.payment_negdi import settlement as negdi_settlement
+from odoo.addons.payment_negdi.tests.common import NEGDiCommon
+
+
+@tagged('post_install', '-at_install')
+class TestNEGDiSettlementParsing(BaseCase):
+
+    def test_lines_are_read_by_chunks(self):
+        """ Test that the statement is returned in chunks of parsed lines, whatever the order,
+        case and separator of the columns. """
+        statement = io.BytesIO(
+            "Status;TranID;Amount\nApproved;1;10,50\nDeclined;2;20\nApproved;3;30\n".encode()
+        )
+        chunks = list(negdi_settlement.read_chunks(statement, chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(chunks[0][0].tranid, '1')
+        self.assertEqual(chunks[0][0].amount, decimal.Decimal('10.50'))
+        self.assertEqual([line.state for line in chunks[0]], ['done', 'error'])
+        self.assertFalse(statement.closed)
+
+    def test_invalid_lines_are_collected(self):
+        """ Test that the lines that cannot be parsed are reported without stopping the parsing,
+        and that a statement without the required columns is rejected. """
+        invalid_lines = []
+        statement = io.BytesIO(b"tranid,amount,status\n1,abc,Approved\n,1,Approved\n2,1,Approved\n")
+        chunks = list(negdi_settlement.read_chunks(statement, 10, invalid_lines))
+        self.assertEqual([line.tranid for line in chunks[0]], ['2'])
+        self.assertEqual([error.line for error in invalid_lines], [2, 3])
+
+        with self.assertRaises(negdi_settlement.SettlementError):
+            list(negdi_settlement.read_chunks(io.BytesIO(b"tranid,status\n1,Approved\n"), 10))
+
+
+@tagged('post_install', '-at_install')
+class TestNEGDiSettlementReconciliation(NEGDiCommon):
+
+    def test_discrepancies_are_reported(self):
+        """ Test that each kind of discrepancy between a statement and the transactions is
+        reported, and that matching lines are not. """
+        for i, state in enumerate(('done', 'done', 'pending'), start=1):
+            self._create_transaction(
+                flow='redirect',
+                reference=f'settled-{i}',
+                state=state,
+                provider_reference=f'3000{i}',
+                negdi_check_id=f'check-{i}',
+            )
+        today = fields.Datetime.now().date()
+        currency = self.currency.name
+        statement = io.BytesIO('\n'.join([
+            "tranid,amount,currency,status",
+            f"30001,{self.amount},{currency},Approved",
+            f"30003,{self.amount},{currency},Approved",
+            f"39999,10,{currency},Approved",
+            f"30001,{self.amount + 1},{currency},Approved",
+            f"30004,abc,{currency},Approved",
+        ]).encode())
+        report = io.StringIO(newline='')
+
+        stats = self.env['payment.transaction']._negdi_reconcile_settlement(
+            statement, report, date_from=today, date_to=today, chunk_size=2
+        )
+
+        self.assertEqual(stats['lines'], 4)
+        self.assertEqual(stats['matched'], 3)
+        self.assertDictEqual(stats['discrepancies'], {
+            'amount': 1,
+            'duplicate': 1,
+            'invalid': 1,
+            'missing_in_file': 1,
+            'missing_in_odoo': 1,
+            'state': 1,
+        })
+        report.seek(0)
+        rows = list(csv.DictReader(report))
+        self.assertIn(
+            ('missing_in_file', '30002'), [(row['kind'], row['tranid']) for row in rows]
+        )
@@ -0,0 +1,51 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+from unittest.mock import patch
+
+from odoo.tests import tagged
+from odoo.tests.common import BaseCase
+
+from odoo.addons.payment_negdi import utils as negdi_utils
+
+
+@tagged('post_install', '-at_install')
+class TestNEGDiLogging(BaseCase):
+
+    def test_credentials_and_card_data_are_redacted(self):
+        """ Test that credentials and card data are masked, including in nested objects. """
+        redacted = negdi_utils.redact({
+            'username': 'merchant',
+            'Password': 'secret',
+            'amount': 10,
+            'order': {'tranid': 1, 'cardNumber': '4111111111111111'},
+        })
+        self.assertEqual(redacted, {
+            'username': '***',
+            'Password': '***',
+            'amount': 10,
+            'order': {'tranid': 1, 'cardNumber': '***'},
+        })
+
+    def test_disabled_events_are_not_formatted(self):
+        """ Test that nothing is serialized when the record is not emitted. """
+        logger = logging.getLogger('odoo.addons.payment_negdi.tests.disabled')
+        logger.setLevel(logging.WARNING)
+        with patch.object(negdi_utils, 'redact') as redact_mock:
+            negdi_utils.log_event(logger, 'ec1000.request', {'password': 'secret'})
+        self.assertEqual(redact_mock.call_count, 0)
+
+    def test_payload_is_only_logged_in_debug_mode(self):
+        """ Test that the summary is logged at INFO level and the redacted payload in debug mode. """
+        logger = logging.getLogger('odoo.addons.payment_negdi.tests.levels')
+        payload = {'password': 'secret', 'amount': 10}
+        logger.setLevel(logging.INFO)
+        with self.assertLogs(logger, logging.INFO) as capture:
+            negdi_utils.log_event(logger, 'ec1000.request', payload, reference='tx1')
+        self.assertEqual(capture.output, [
+            'INFO:%s:NEGDi: {"event":"ec1000.request","reference":"tx1"}' % logger.name
+        ])
+        logger.setLevel(logging.DEBUG)
+        with self.assertLogs(logger, logging.DEBUG) as capture:
+            negdi_utils.log_event(logger, 'ec1000.request', payload, reference='tx1')
+        self.assertIn('"data":{"password":"***","amount":10}', capture.output[0])
@@ -1,5 +1,11 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import json
+import logging
+import random
+
+from . import const
+
 def get_payment_option(payment_method_code):
     """ Map the payment method code to one of the payment options expected by NEGDi.
 
@@ -12,3 +18,110 @@ def get_payment_option(payment_method_code):
     :rtype: str
     """
     return payment_method_code.upper() if payment_method_code != 'card' else ''
+
+
+def normalize_notification_data(data):
+    """ Return the notification data in the format of the ec1098 inquiry response.
+
+    NEGDi webhooks may carry the order fields either at the top level or nested in an `order`
+    object, like the inquiry responses processed by `_process_notification_data`. The `ordersign`
+    signature is kept next to the `order` object, as it is not part of the signed data.
+
+    :param dict data: The notification data.
+    :return: The notification data with the order fields nested in an `order` object.
+    :rtype: dict
+    """
+    if isinstance(data.get('order'), dict):
+        return data
+    order_data = dict(data)
+    signature = order_data.pop('ordersign', None)
+    return {'order': order_data, **({'ordersign': signature} if signature else {})}
+
+
+def get_signed_bytes(order_data):
+    """ Return the canonical bytes of an `order` object signed by NEGDi in `ordersign`.
+
+    :param dict order_data: The `order` object of the notification data.
+    :return: The compact, key-sorted, UTF-8 encoded JSON serialization of the order.
+    :rtype: bytes
+    """
+    return json.dumps(order_data, separators=(',', ':'), sort_keys=True, ensure_ascii=False).encode()
+
+
+def get_transaction_state(status):
+    """ Return the Odoo transaction state matching a NEGDi order status.
+
+    :param str status: The NEGDi status, in any case.
+    :return: The Odoo state, or None if the status is unknown.
+    :rtype: str
+    """
+    return const.STATUS_TO_STATE.get(status.casefold()) if status else None
+
+
+def redact(data):
+    """ Return a copy of NEGDi data with credentials and card data masked.
+
+    :param data: The data to redact: a dict, a list or a scalar value.
+    :return: The redacted copy of the data.
+    """
+    if isinstance(data, dict):
+        return {
+            key: '***' if str(key).casefold() in const.NEGDI_LOG_REDACTED_KEYS else redact(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        return [redact(value) for value in data]
+    return data
+
+
+class LazyLogRecord:
+    """ Structured log record rendered as compact JSON only when the log line is emitted. """
+
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __str__(self):
+        return json.dumps(redact(self.values), separators=(',', ':'), default=str)
+
+
+_sample_rates = None
+
+
+def _get_sample_rate(event):
+    """ Return the sampling rate of an event, overridable with the `negdi_log_sample_rate_<event>`
+    option of the server configuration. """
+    global _sample_rates
+    if _sample_rates is None:
+        from odoo.tools import config  # Imported lazily to keep this module usable outside Odoo.
+        _sample_rates = {
+            name: float(config.get(f'negdi_log_sample_rate_{name}', rate))
+            for name, rate in const.NEGDI_LOG_SAMPLE_RATES.items()
+        }
+    return _sample_rates.get(event, 1.0)
+
+
+def log_event(logger, event, data=None, level=logging.INFO, **values):
+    """ Log a NEGDi event as a structured, redacted JSON record.
+
+    Nothing is formatted if the record is not emitted. At INFO level, only the provided summary
+    values are logged and high-volume events are sampled according to `NEGDI_LOG_SAMPLE_RATES`;
+    in debug mode every event is logged along with its full (redacted) `data`.
+
+    :param logging.Logger logger: The logger to log with.
+    :param str event: The name of the event, e.g. `ec1000.request` or `webhook`.
+    :param dict data: The payload of the event, only logged in debug mode.
+    :param int level: The level of the record.
+    :param dict values: The summary values of the event, e.g. the transaction reference.
+    :return: None
+    """
+    if not logger.isEnabledFor(level):
+        return
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if not debug and level < logging.WARNING and random.random() >= _get_sample_rate(event):
+        return
+    record = {'event': event, **values}
+    if debug and data is not None:
+        record['data'] = data
+    logger.log(level, "NEGDi: %s", LazyLogRecord(record))
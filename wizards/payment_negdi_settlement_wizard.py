@@ -0,0 +1,87 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import base64
+import io
+import tempfile
+
+from odoo import _, fields, models
+
+
+class PaymentNEGDiSettlementWizard(models.TransientModel):
+    """ Import a NEGDi settlement statement and download the discrepancies with the transactions.
+
+    See `payment.transaction._negdi_reconcile_settlement`.
+    """
+    _name = 'payment.negdi.settlement.wizard'
+    _description = "NEGDi Settlement Reconciliation Wizard"
+
+    settlement_file = fields.Binary(string="Settlement File", required=True)
+    settlement_filename = fields.Char(string="Settlement Filename")
+    date_from = fields.Date(
+        string="Period Start",
+        help="The first day of the settlement period. Defaults to the first date of the file.",
+    )
+    date_to = fields.Date(
+        string="Period End",
+        help="The last day of the settlement period. Defaults to the last date of the file.",
+    )
+    state = fields.Selection(
+        selection=[('draft', "Draft"), ('done', "Done")], default='draft', required=True
+    )
+    line_count = fields.Integer(string="Lines", readonly=True)
+    matched_count = fields.Integer(string="Matched Lines", readonly=True)
+    discrepancy_count = fields.Integer(string="Discrepancies", readonly=True)
+    summary = fields.Text(string="Summary", readonly=True)
+    report_file = fields.Binary(string="Discrepancy Report", readonly=True)
+    report_filename = fields.Char(string="Report Filename", readonly=True)
+
+    def action_reconcile(self):
+        """ Reconcile the settlement statement and show the results.
+
+        The statement is read from the filestore rather than loaded whole into memory.
+
+        :return: The action reopening the wizard.
+        :rtype: dict
+        """
+        self.ensure_one()
+        with self._open_settlement_file() as stream, tempfile.TemporaryFile(
+            'w+', encoding='utf-8', newline=''
+        ) as report:
+            stats = self.env['payment.transaction']._negdi_reconcile_settlement(
+                stream, report, date_from=self.date_from, date_to=self.date_to
+            )
+            report.seek(0)
+            report_data = report.read().encode()
+        self.write({
+            'state': 'done',
+            'line_count': stats['lines'],
+            'matched_count': stats['matched'],
+            'discrepancy_count': sum(stats['discrepancies'].values()),
+            'summary': '\n'.join(
+                f"{kind}: {count}" for kind, count in sorted(stats['discrepancies'].items())
+            ) or _("No discrepancies."),
+            'report_file': base64.b64encode(report_data),
+            'report_filename': f"{(self.settlement_filename or 'settlement').rsplit('.', 1)[0]}"
+                               f"_discrepancies.csv",
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _open_settlement_file(self):
+        """ Open the uploaded settlement statement.
+
+        :return: The statement, as a binary file object.
+        """
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'settlement_file'),
+            ('res_id', '=', self.id),
+        ], limit=1)
+        if attachment.store_fname:
+            return open(attachment._full_path(attachment.store_fname), 'rb')
+        return io.BytesIO(attachment.raw or b'')